@@ -0,0 +1,129 @@
+"""threading / gevent 两种并发模式对比
+
+对每种模式启动一个后端进程，建立 --connections 个空闲 websocket 连接，
+读取进程 RSS 计算每 GB 内存可承载的连接数；然后在这些连接保持在线的情况下，
+由一个客户端向群组发送消息，测量收到自己消息的往返延迟。
+
+前置条件同 socket_scale.py：MySQL/Redis 可用，存在从 --first-user-id 开始的连续用户。
+客户端依赖：pip install "python-socketio[client]" aiohttp PyJWT
+
+用法（在 backend 目录下，仅支持 Linux）：
+    python bench/async_mode_bench.py --connections 2000 --messages 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import socketio
+
+from socket_scale import SRC_DIR, make_token, wait_for_port
+
+
+def rss_bytes(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def thread_count(pid):
+    return len(os.listdir(f'/proc/{pid}/task'))
+
+
+def start_server(mode, port):
+    env = {**os.environ, 'PORT': str(port), 'SSL_ENABLED': '0', 'SOCKETIO_ASYNC_MODE': mode}
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=SRC_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+async def open_connections(url, args):
+    clients = []
+    for i in range(args.connections):
+        client = socketio.AsyncClient(reconnection=False)
+        await client.connect(url, auth={'token': make_token(args.first_user_id + i, args.secret)},
+                             transports=['websocket'])
+        clients.append(client)
+    return clients
+
+
+async def measure_latency(url, args):
+    client = socketio.AsyncClient(reconnection=False)
+    latencies = []
+    received = asyncio.Event()
+
+    @client.on('message')
+    async def on_message(data):
+        content = data.get('content', '')
+        if content.startswith('bench:'):
+            latencies.append(time.time() - float(content.split(':')[1]))
+            received.set()
+
+    await client.connect(url, auth={'token': make_token(args.first_user_id, args.secret)},
+                         transports=['websocket'])
+    for _ in range(args.messages):
+        received.clear()
+        await client.emit('chat', {
+            'room': f'group_{args.group}',
+            'message': {'type': 'text', 'group_id': args.group, 'content': f'bench:{time.time()}'}
+        })
+        try:
+            await asyncio.wait_for(received.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            pass
+    await client.disconnect()
+    return sorted(latencies)
+
+
+async def bench_mode(mode, args):
+    process = start_server(mode, args.port)
+    url = f'http://127.0.0.1:{args.port}'
+    try:
+        baseline = rss_bytes(process.pid)
+        clients = await open_connections(url, args)
+        await asyncio.sleep(2)
+        loaded = rss_bytes(process.pid)
+        threads = thread_count(process.pid)
+        latencies = await measure_latency(url, args)
+        for client in clients:
+            await client.disconnect()
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    per_connection = max(loaded - baseline, 1) / args.connections
+    return {
+        'rss_mb': loaded / 2 ** 20,
+        'threads': threads,
+        'conn_per_gb': 2 ** 30 / per_connection,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', nargs='+', default=['threading', 'gevent'])
+    parser.add_argument('--connections', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--port', type=int, default=5200)
+    parser.add_argument('--group', type=int, default=1)
+    parser.add_argument('--first-user-id', type=int, default=1)
+    parser.add_argument('--secret', default=os.environ.get('JWT_SECRET_KEY', 'dev-jwt-secret-key'))
+    args = parser.parse_args()
+
+    print(f"{'mode':>10} {'rss MB':>8} {'threads':>8} {'conn/GB':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in args.modes:
+        result = asyncio.run(bench_mode(mode, args))
+        print(f"{mode:>10} {result['rss_mb']:>8.0f} {result['threads']:>8} {result['conn_per_gb']:>10,.0f}"
+              f" {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""在线状态广播基准测试
+
+对比两种方式在重连风暴下发送的字节数和编码 CPU 时间：
+- legacy：每次连接/断开都向所有客户端广播完整 online_users 列表和 user_online/user_offline
+- delta：按节拍合并状态变化，广播 presence_delta；重连的客户端各自请求一次完整快照
+
+python-socketio 广播时对每个接收者单独编码数据包，因此这里按 "单次编码耗时 × 接收者数" 估算 CPU，
+不依赖真实的 Socket.IO 服务。
+
+用法：python bench/presence_bench.py [--users 1000 10000 50000] [--churn 0.1] [--window 5] [--tick 0.5]
+"""
+import argparse
+import json
+import random
+import time
+
+
+def packet(event, data):
+    # Socket.IO 文本帧：'4'(engine.io message) + '2'(socket.io event) + JSON
+    return '42' + json.dumps([event, data], separators=(',', ':'))
+
+
+def encode_cost(event, data, repeat=5):
+    """返回 (数据包字节数, 单次编码秒数)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoded = packet(event, data)
+    return len(encoded.encode()), (time.perf_counter() - start) / repeat
+
+
+def make_events(users, churn, window):
+    """生成重连风暴：churn 比例的用户在 window 秒内各断开一次并在 0~2 秒后重连"""
+    events = []
+    for user_id in random.sample(range(1, users + 1), int(users * churn)):
+        down = random.uniform(0, window)
+        events.append((down, user_id, False))
+        events.append((down + random.uniform(0, 2), user_id, True))
+    events.sort()
+    return events
+
+
+def bench_legacy(users, events):
+    online = set(range(1, users + 1))
+    total_bytes = total_cpu = 0.0
+    emits = 0
+    for _, user_id, is_online in events:
+        if is_online:
+            online.add(user_id)
+        else:
+            online.discard(user_id)
+        recipients = len(online)
+        for event, data in (
+            ('online_users', {'users': sorted(online)}),
+            ('user_online' if is_online else 'user_offline', {'user_id': user_id})
+        ):
+            size, cost = encode_cost(event, data, repeat=1)
+            total_bytes += size * recipients
+            total_cpu += cost * recipients
+            emits += recipients
+    return emits, total_bytes, total_cpu
+
+
+def bench_delta(users, events, tick):
+    online = set(range(1, users + 1))
+    total_bytes = total_cpu = 0.0
+    emits = 0
+    pending = {}
+    next_tick = tick
+    reconnected = 0
+    version = 0
+
+    def flush():
+        nonlocal total_bytes, total_cpu, emits, version
+        changed_on = [uid for uid, (initial, final) in pending.items() if initial != final and final]
+        changed_off = [uid for uid, (initial, final) in pending.items() if initial != final and not final]
+        pending.clear()
+        if not changed_on and not changed_off:
+            return
+        version += 1
+        size, cost = encode_cost('presence_delta', {'version': version, 'online': changed_on, 'offline': changed_off})
+        recipients = len(online)
+        total_bytes += size * recipients
+        total_cpu += cost * recipients
+        emits += recipients
+
+    for at, user_id, is_online in events:
+        while at >= next_tick:
+            flush()
+            next_tick += tick
+        if user_id in pending:
+            pending[user_id][1] = is_online
+        else:
+            pending[user_id] = [not is_online, is_online]
+        if is_online:
+            online.add(user_id)
+            reconnected += 1
+        else:
+            online.discard(user_id)
+    flush()
+
+    # 每个重连的客户端请求一次完整快照
+    size, cost = encode_cost('online_users', {'users': sorted(online), 'version': version})
+    total_bytes += size * reconnected
+    total_cpu += cost * reconnected
+    emits += reconnected
+    return emits, total_bytes, total_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--churn', type=float, default=0.1)
+    parser.add_argument('--window', type=float, default=5.0)
+    parser.add_argument('--tick', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f'churn={args.churn:.0%} window={args.window}s tick={args.tick}s')
+    print(f"{'users':>7} {'mode':>7} {'emits':>14} {'bytes sent':>14} {'encode cpu (s)':>15}")
+    for users in args.users:
+        random.seed(args.seed)
+        events = make_events(users, args.churn, args.window)
+        for mode, result in (
+            ('legacy', bench_legacy(users, events)),
+            ('delta', bench_delta(users, events, args.tick))
+        ):
+            emits, total_bytes, total_cpu = result
+            print(f'{users:>7} {mode:>7} {emits:>14,} {total_bytes / 1e6:>12,.1f}MB {total_cpu:>15.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""多进程 Socket.IO 扩展性压测
+
+依次启动 --workers 中各个数量的后端进程（各自监听不同端口，共享 Redis 消息队列），把客户端按顺序分配到各进程
+（相当于粘性会话），由一部分客户端向同一群组发送消息，统计所有客户端收到消息的吞吐量和延迟。
+
+前置条件：MySQL/Redis 可用，数据库中存在 ID 从 --first-user-id 开始的连续用户且都在 --group 群组中
+（注册用户默认都在公共频道 group 1）。JWT_SECRET_KEY 需与后端一致。
+客户端依赖：pip install "python-socketio[client]" PyJWT
+
+用法（在 backend 目录下）：
+    python bench/socket_scale.py --workers 1 2 4 --clients 400 --senders 40 --messages 50
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import jwt
+import socketio
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def make_token(user_id, secret):
+    now = datetime.utcnow()
+    return jwt.encode({'user_id': user_id, 'sub': str(user_id), 'iat': now,
+                       'exp': now + timedelta(hours=1)}, secret, algorithm='HS256')
+
+
+def start_workers(count, base_port, redis_url):
+    processes = []
+    for i in range(count):
+        env = {
+            **os.environ,
+            'PORT': str(base_port + i),
+            'SSL_ENABLED': '0',
+            'SOCKETIO_MESSAGE_QUEUE': redis_url
+        }
+        processes.append(subprocess.Popen(
+            [sys.executable, 'app.py'], cwd=SRC_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    for i in range(count):
+        wait_for_port(base_port + i)
+    return processes
+
+
+def wait_for_port(port, timeout=120):
+    """等待进程开始监听；多个进程同时启动时导入模块、建表可能需要十几秒"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def stop_workers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait(timeout=30)
+
+
+def run_load(urls, args):
+    received = []
+    lock = threading.Lock()
+    clients = []
+
+    def on_message(data):
+        content = data.get('content', '')
+        if content.startswith('bench:'):
+            latency = time.time() - float(content.split(':')[1])
+            with lock:
+                received.append(latency)
+
+    for i in range(args.clients):
+        client = socketio.Client(reconnection=False)
+        client.on('message', on_message)
+        token = make_token(args.first_user_id + i, args.secret)
+        client.connect(urls[i % len(urls)], auth={'token': token}, transports=['websocket'])
+        clients.append(client)
+    time.sleep(2)
+
+    def send(client):
+        for _ in range(args.messages):
+            client.emit('chat', {
+                'room': f'group_{args.group}',
+                'message': {'type': 'text', 'group_id': args.group, 'content': f'bench:{time.time()}'}
+            })
+            time.sleep(args.interval)
+
+    expected = args.senders * args.messages * args.clients
+    start = time.time()
+    senders = [threading.Thread(target=send, args=(client,)) for client in clients[:args.senders]]
+    for thread in senders:
+        thread.start()
+    for thread in senders:
+        thread.join()
+    while len(received) < expected and time.time() - start < args.timeout:
+        time.sleep(0.1)
+    elapsed = time.time() - start
+
+    for client in clients:
+        client.disconnect()
+
+    latencies = sorted(received)
+    return {
+        'delivered': len(latencies),
+        'expected': expected,
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='依次测试的进程数')
+    parser.add_argument('--base-port', type=int, default=5100)
+    parser.add_argument('--redis-url', default=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--senders', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.01, help='每个发送者两条消息之间的间隔（秒）')
+    parser.add_argument('--group', type=int, default=1)
+    parser.add_argument('--first-user-id', type=int, default=1)
+    parser.add_argument('--secret', default=os.environ.get('JWT_SECRET_KEY', 'dev-jwt-secret-key'))
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'delivered':>12} {'deliveries/s':>13} {'p50 ms':>8} {'p99 ms':>8}")
+    for count in args.workers:
+        processes = start_workers(count, args.base_port, args.redis_url)
+        try:
+            urls = [f'http://127.0.0.1:{args.base_port + i}' for i in range(count)]
+            result = run_load(urls, args)
+        finally:
+            stop_workers(processes)
+        print(f"{count:>7} {result['delivered']:>6}/{result['expected']:<6}"
+              f"{result['throughput']:>13,.0f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""白板绘制事件基准测试
+
+模拟多个房间中多人同时绘制（每人每秒 --rate 个采样点），对比两种方式：
+- legacy：每个点一个 draw 事件，打印一行日志，并向房间内每个成员各发送一次
+- batch：按 --tick 节拍把房间内所有人的点合并为一个 draw_batch 发送
+
+python-socketio 广播时对每个接收者单独编码数据包，因此与 presence_bench 一样按
+"单次编码耗时 × 接收者数" 估算编码 CPU；服务端处理（日志、合并）的 CPU 实测。
+另外模拟一个每秒只能处理 --slow-rate 个事件的慢速接收者，统计它的积压队列：
+batch 模式下积压超过 --max-lag 秒即暂停推送，消化完积压后用一次完整状态恢复。
+
+用法：python bench/whiteboard_bench.py [--rooms 10] [--drawers 1 3 5] [--members 8] [--seconds 10]
+"""
+import argparse
+import io
+import json
+import math
+import random
+import time
+from contextlib import redirect_stdout
+
+
+def packet(event, data):
+    # Socket.IO 文本帧：'4'(engine.io message) + '2'(socket.io event) + JSON
+    return '42' + json.dumps([event, data], separators=(',', ':'))
+
+
+def make_points(rooms, drawers, rate, seconds):
+    """生成 (时间, 房间, 绘制者, x, y, 是否落笔) 序列，每个绘制者每 0.5~1.5 秒起一笔"""
+    events = []
+    for room in range(rooms):
+        for drawer in range(drawers):
+            sid = f'{room}-{drawer}'
+            at, stroke_end = random.uniform(0, 1 / rate), 0.0
+            x, y, angle = random.uniform(0, 600), random.uniform(0, 400), 0.0
+            while at < seconds:
+                pen_down = at >= stroke_end
+                if pen_down:
+                    stroke_end = at + random.uniform(0.5, 1.5)
+                    x, y = random.uniform(0, 600), random.uniform(0, 400)
+                angle += random.uniform(-0.3, 0.3)
+                x = min(600, max(0, x + 4 * math.cos(angle)))
+                y = min(400, max(0, y + 4 * math.sin(angle)))
+                events.append((at, f'whiteboard_{room}', sid, round(x, 1), round(y, 1), pen_down))
+                at += 1 / rate
+    events.sort()
+    return events
+
+
+def bench_legacy(events, members):
+    emits = total_bytes = encode_cpu = 0.0
+    log = io.StringIO()
+    start = time.process_time()
+    for _, room, sid, x, y, pen_down in events:
+        data = {'x': x, 'y': y, 'drawing': not pen_down, 'color': '#000000', 'lineWidth': 2, 'room': room}
+        with redirect_stdout(log):
+            print(f'Broadcasting whiteboard event to room: {room}')
+        encode_start = time.perf_counter()
+        size = len(packet('draw', data).encode())
+        encode_cpu += (time.perf_counter() - encode_start) * members
+        total_bytes += size * members
+        emits += members
+    server_cpu = time.process_time() - start
+    return emits, total_bytes, encode_cpu, server_cpu
+
+
+def bench_batch(events, members, tick):
+    emits = total_bytes = encode_cpu = 0.0
+    batches = []
+    pending, last = {}, {}
+
+    def flush(at):
+        nonlocal emits, total_bytes, encode_cpu
+        for room, segments in pending.items():
+            strokes = [segment for _, segment in segments if len(segment['p']) >= 4]
+            if not strokes:
+                continue
+            data = {'room': room, 't': int(at * 1000), 'strokes': strokes}
+            encode_start = time.perf_counter()
+            size = len(packet('draw_batch', data).encode())
+            encode_cpu += (time.perf_counter() - encode_start) * members
+            total_bytes += size * members
+            emits += members
+            batches.append((at, room))
+        pending.clear()
+
+    start = time.process_time()
+    next_tick = tick
+    for at, room, sid, x, y, pen_down in events:
+        while at >= next_tick:
+            flush(next_tick)
+            next_tick += tick
+        segments = pending.setdefault(room, [])
+        previous = last.get(sid)
+        last[sid] = (x, y)
+        current = next((segment for owner, segment in reversed(segments) if owner == sid), None)
+        if not pen_down and current:
+            current['p'].extend((x, y))
+            continue
+        points = [x, y] if pen_down or not previous else [previous[0], previous[1], x, y]
+        segments.append((sid, {'c': '#000000', 'w': 2, 'p': points}))
+    flush(next_tick)
+    server_cpu = time.process_time() - start
+    return emits, total_bytes, encode_cpu, server_cpu, batches
+
+
+def slow_receiver(arrivals, slow_rate, max_lag=None):
+    """arrivals 为发往该接收者的事件时间序列，返回 (最大积压事件数, 最大延迟秒, 暂停次数)
+
+    max_lag 不为空时模拟背压：处理到的事件延迟超过 max_lag 后不再接收新事件，
+    积压消化完后恢复（恢复时的完整状态计为一个事件）。
+    """
+    queue = []
+    busy_until = 0.0
+    max_queue = max_delay = 0.0
+    pauses = 0
+    paused = False
+    for at in arrivals:
+        # 处理到 at 时刻为止能处理完的事件
+        while queue and max(busy_until, queue[0]) + 1 / slow_rate <= at:
+            sent = queue.pop(0)
+            busy_until = max(busy_until, sent) + 1 / slow_rate
+            delay = busy_until - sent
+            max_delay = max(max_delay, delay)
+            if max_lag is not None and not paused and delay > max_lag:
+                paused = True
+                pauses += 1
+        if paused:
+            if queue:
+                continue
+            paused = False
+            queue.append(at)  # 恢复时发送的完整状态
+            continue
+        queue.append(at)
+        max_queue = max(max_queue, len(queue))
+    return int(max_queue), max_delay, pauses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--drawers', type=int, nargs='+', default=[1, 3, 5])
+    parser.add_argument('--members', type=int, default=8, help='每个房间的成员数（含绘制者）')
+    parser.add_argument('--rate', type=float, default=60.0, help='每个绘制者每秒的采样点数')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--tick', type=float, default=0.025)
+    parser.add_argument('--slow-rate', type=float, default=15.0, help='慢速接收者每秒能处理的事件数')
+    parser.add_argument('--max-lag', type=float, default=2.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f'rooms={args.rooms} members={args.members} rate={args.rate}/s '
+          f'seconds={args.seconds} tick={args.tick * 1000:.0f}ms slow-rate={args.slow_rate}/s')
+    print(f"{'drawers':>7} {'mode':>6} {'emits/s/member':>15} {'MB sent':>9} "
+          f"{'encode cpu':>11} {'server cpu':>11} {'slow backlog':>13} {'slow delay':>11} {'pauses':>7}")
+    for drawers in args.drawers:
+        random.seed(args.seed)
+        events = make_points(args.rooms, drawers, args.rate, args.seconds)
+        legacy = bench_legacy(events, args.members)
+        *batch, batches = bench_batch(events, args.members, args.tick)
+
+        room = 'whiteboard_0'
+        legacy_slow = slow_receiver([at for at, r, *_ in events if r == room], args.slow_rate)
+        batch_slow = slow_receiver([at for at, r in batches if r == room], args.slow_rate, args.max_lag)
+
+        for mode, (emits, total_bytes, encode_cpu, server_cpu), (backlog, delay, pauses) in (
+            ('legacy', legacy, legacy_slow),
+            ('batch', batch, batch_slow)
+        ):
+            per_member = emits / args.members / args.rooms / args.seconds
+            print(f'{drawers:>7} {mode:>6} {per_member:>15.1f} {total_bytes / 1e6:>9.2f} '
+                  f'{encode_cpu:>10.3f}s {server_cpu:>10.3f}s {backlog:>13} {delay:>10.2f}s {pauses:>7}')
+
+
+if __name__ == '__main__':
+    main()
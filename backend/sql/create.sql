@@ -59,7 +59,26 @@ CREATE TABLE messages (
     file_url VARCHAR(255),
     is_read BOOLEAN DEFAULT FALSE,
     FOREIGN KEY (sender_id) REFERENCES users(id),
-    FOREIGN KEY (receiver_id) REFERENCES users(id)
+    FOREIGN KEY (receiver_id) REFERENCES users(id),
+    INDEX idx_messages_group_created (group_id, created_at, id),
+    INDEX idx_messages_pair_created (sender_id, receiver_id, created_at, id)
+);
+
+-- 创建文件索引表（文件内容按 sha256 存放在 uploads/objects/<ab>/<cd>/<sha256>）
+CREATE TABLE files (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    file_id VARCHAR(255) NOT NULL UNIQUE,
+    name VARCHAR(255) NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    size BIGINT NOT NULL,
+    mime_type VARCHAR(127),
+    owner_id INT,
+    conversation VARCHAR(64),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (owner_id) REFERENCES users(id),
+    INDEX idx_files_conversation_created (conversation, created_at),
+    INDEX idx_files_owner_created (owner_id, created_at),
+    INDEX idx_files_sha256 (sha256)
 );
 
 -- 创建登录日志表
@@ -0,0 +1,12 @@
+-- 聊天记录键集分页所需的复合索引
+-- 群聊：WHERE group_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+-- 私聊：WHERE sender_id = ? AND receiver_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+-- 大表上建议使用 ALGORITHM=INPLACE, LOCK=NONE 在线建索引
+
+ALTER TABLE messages
+    ADD INDEX idx_messages_group_created (group_id, created_at, id),
+    ALGORITHM=INPLACE, LOCK=NONE;
+
+ALTER TABLE messages
+    ADD INDEX idx_messages_pair_created (sender_id, receiver_id, created_at, id),
+    ALGORITHM=INPLACE, LOCK=NONE;
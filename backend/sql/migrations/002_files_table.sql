@@ -0,0 +1,20 @@
+-- 上传文件元数据索引表
+-- 文件内容按 sha256 分两级目录存放：uploads/objects/<ab>/<cd>/<sha256>，
+-- 下载地址 /uploads/<file_id> 通过本表找到内容；conversation 为 group:<id> 或 dm:<小ID>:<大ID>
+-- 建表后运行 tools/migrate_uploads.py 把平铺在 uploads/ 下的旧文件迁移到新布局
+
+CREATE TABLE files (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    file_id VARCHAR(255) NOT NULL UNIQUE,
+    name VARCHAR(255) NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    size BIGINT NOT NULL,
+    mime_type VARCHAR(127),
+    owner_id INT,
+    conversation VARCHAR(64),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (owner_id) REFERENCES users(id),
+    INDEX idx_files_conversation_created (conversation, created_at),
+    INDEX idx_files_owner_created (owner_id, created_at),
+    INDEX idx_files_sha256 (sha256)
+);
@@ -1,3 +1,12 @@
+# 协作式并发（gevent）模式必须在导入其他模块之前打补丁，让数据库、Redis、AI 接口的网络 IO 都让出执行权；
+# 媒体处理进程池的子进程（__mp_main__）只做计算，不打补丁，任务超时依赖原生的 SIGALRM
+import os
+from dotenv import load_dotenv
+load_dotenv()
+if os.environ.get('SOCKETIO_ASYNC_MODE', 'threading') == 'gevent' and __name__ != '__mp_main__':
+    from gevent import monkey
+    monkey.patch_all()
+
 from flask import Flask, send_from_directory
 from flask_cors import CORS
 from config import Config
@@ -14,7 +23,14 @@ from config import Config
 from dotenv import load_dotenv
 from flask_jwt_extended import JWTManager
 from routes.whiteboard import whiteboard_bp
-import ssl, os
+from services.message_writer import message_writer
+from services.history_cache import history_cache
+from websocket import OnlineUserManager
+from services.presence import presence
+from services.file_manager import upload_manager
+from services.media_processor import media_processor
+from services.whiteboard import draw_batcher
+import ssl, signal, sys
 
 def create_app(app):
     # 配置CORS
@@ -41,7 +57,8 @@ def create_app(app):
     
     socketio.init_app(app, 
         cors_allowed_origins="*",
-        async_mode='threading',
+        async_mode=Config.SOCKETIO_ASYNC_MODE,
+        message_queue=Config.SOCKETIO_MESSAGE_QUEUE,
         ping_timeout=60,
         ping_interval=25,
         logger=True,
@@ -58,18 +75,42 @@ def create_app(app):
     app.register_blueprint(whiteboard_bp, url_prefix='/api/whiteboard')
     app.register_blueprint(ai_bp, url_prefix='/api/ai')
 
+    with app.app_context():
+        db.create_all()
+    logger.info('数据库初始化完毕')
+
+    # 依赖数据表已存在（需要读取当前最大消息ID）
+    message_writer.init_app(app)
+    history_cache.init_app(app)
+    OnlineUserManager.init_app(app)
+    presence.init_app(app)
+    upload_manager.init_app(app)
+    media_processor.init_app(app)
+    draw_batcher.init_app(app)
+
     return app
 
 app = Flask(__name__)
 
 if __name__ == '__main__':
-    load_dotenv()
     create_app(app)
-    with app.app_context():
-        db.create_all()
-    logger.info('数据库初始化完毕')
 
-    ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-    ssl_ctx.load_cert_chain(certfile='chat.yihang01.cn_bundle.crt', keyfile='chat.yihang01.cn.key')
+    # SIGTERM 时正常退出，保证 atexit 中的消息落库、连接清理等逻辑得以执行
+    if Config.SOCKETIO_ASYNC_MODE == 'gevent':
+        # gevent 下 signal.signal 的处理函数会在任意一个协程里抛出 SystemExit，只结束该协程；
+        # 改为停止服务器，socketio.run 返回后进程正常退出
+        import gevent
+        gevent.signal_handler(signal.SIGTERM, socketio.stop)
+    else:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    ssl_options = {}
+    if Config.SSL_ENABLED and Config.SOCKETIO_ASYNC_MODE == 'gevent':
+        # gevent 的 WSGIServer 直接接收证书文件
+        ssl_options = {'certfile': Config.SSL_CERT_FILE, 'keyfile': Config.SSL_KEY_FILE}
+    elif Config.SSL_ENABLED:
+        ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+        ssl_ctx.load_cert_chain(certfile=Config.SSL_CERT_FILE, keyfile=Config.SSL_KEY_FILE)
+        ssl_options = {'ssl_context': ssl_ctx}
 
-    socketio.run(app, debug=False, port=Config.PORT, host='0.0.0.0', ssl_context=ssl_ctx)
\ No newline at end of file
+    socketio.run(app, debug=False, port=Config.PORT, host='0.0.0.0', **ssl_options)
\ No newline at end of file
@@ -2,7 +2,11 @@ import os
 from datetime import timedelta
 
 class Config:
-    REDIS_URL = "redis://localhost:6379/0"
+    REDIS_URL = os.environ.get('REDIS_URL', "redis://localhost:6379/0")
+    # threading：每个连接/流式响应一个系统线程；gevent：协程模式，单进程可承载更多长连接
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+    # 多进程部署时设置为 Redis 地址，Socket.IO 通过它在进程间转发 emit
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key')
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'dev-jwt-secret-key')
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
@@ -18,11 +22,97 @@ class Config:
     }
     SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{MYSQL_CONFIG['user']}:{MYSQL_CONFIG['password']}@{MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}/{MYSQL_CONFIG['database']}?charset={MYSQL_CONFIG['charset']}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # gevent 模式下并发请求远多于线程数，连接池需相应放大
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_recycle': 3600,
+        'pool_pre_ping': True
+    }
     UPLOAD_FOLDER = 'uploads'
+    MESSAGE_BATCH_SIZE = 200
+    MESSAGE_FLUSH_INTERVAL = 0.05  # 秒
+    MESSAGE_QUEUE_MAXSIZE = 10000
+    # 批量写入失败（数据库不可用等）时的重试次数和首次重试间隔（秒，之后翻倍），仍失败的消息转入 Redis 死信列表
+    MESSAGE_WRITE_RETRIES = 3
+    MESSAGE_WRITE_RETRY_BACKOFF = 0.5
+    # 可以查看运维统计（如 /api/chat/writer/stats）的用户ID，逗号分隔
+    ADMIN_USER_IDS = {int(uid) for uid in os.environ.get('ADMIN_USER_IDS', '').split(',') if uid.strip()}
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_MAX_PAGE_SIZE = 200
+    HISTORY_CACHE_DEPTH = 50
+    HISTORY_CACHE_TTL = 7 * 24 * 3600  # 秒
+    HISTORY_CACHE_WARM_GROUPS = [1]
+    WORKER_HEARTBEAT_INTERVAL = 10  # 秒
+    PRESENCE_TICK = 0.5  # 秒
+    PRESENCE_INCLUDE_GROUP_PEERS = True
+    PRESENCE_EXCLUDED_GROUPS = [1]  # 公共频道人人都在，不作为在线状态的可见范围
+    PRESENCE_PEERS_TTL = 24 * 3600  # 秒
+    PRESENCE_BATCH_LIMIT = 1000
+    WHITEBOARD_STATE_TTL = 24 * 3600  # 秒
+    WHITEBOARD_CANVAS_SIZE = (600, 400)  # 与前端画布尺寸一致
+    WHITEBOARD_SIMPLIFY_TOLERANCE = 1.0  # 笔画简化的最大偏差（像素）
+    WHITEBOARD_MAX_STROKES = 5000  # 每个白板快照保留的笔画数上限，超出时最早的笔画画进快照底图
+    WHITEBOARD_SNAPSHOT_EVERY = 200  # 每追加多少个操作生成一次快照
+    WHITEBOARD_LOG_RETAIN = 1000  # 快照之前保留的操作数，落后不超过该数的客户端可以增量同步
+    WHITEBOARD_RASTER_WORKERS = 1  # 生成栅格快照的后台线程数
+    WHITEBOARD_MAX_STROKE_POINTS = 2000  # 单笔超过该点数时分段保存
+    WHITEBOARD_TICK = 0.025  # 秒，绘制事件合并发送的节拍
+    WHITEBOARD_MAX_LAG = 2.0  # 秒，客户端绘制落后超过该值时暂停推送
+    WHITEBOARD_MAX_LINE_WIDTH = 50  # 线宽上限（像素），坐标也只保留画布外这么宽的边距
+    # 文件分片上传：分片先写入临时目录，与 UPLOAD_FOLDER 同一文件系统以便原子重命名
+    UPLOAD_SPOOL_FOLDER = os.path.join(UPLOAD_FOLDER, '.spool')
+    UPLOAD_CHUNK_SIZE = 200 * 1024
+    # 按内容哈希存放的文件对象，/uploads/<文件ID> 通过 files 表找到对象；临时文件重命名到这里，需与 UPLOAD_SPOOL_FOLDER 同一文件系统
+    UPLOAD_OBJECTS_FOLDER = os.path.join(UPLOAD_FOLDER, 'objects')
+    UPLOAD_MAX_FILE_SIZE = 1024 * 1024 * 1024
+    # 客户端同时在途（已发送未确认）的分片数
+    UPLOAD_CHUNK_WINDOW = 8
+    # 上传会话在最后一次收到分片后保留的时间（秒），过期后临时文件由后台线程清理
+    UPLOAD_SESSION_TTL = 24 * 3600
+    UPLOAD_SWEEP_INTERVAL = 600
+    # 没有 files 记录引用的内容对象超过该时间（秒，按最近一次被引用的修改时间）后由后台线程回收
+    UPLOAD_OBJECT_GRACE = 3600
+    # 上传进度推送节流：进度增加的百分点 / 最长间隔（秒）
+    UPLOAD_PROGRESS_STEP = 5
+    UPLOAD_PROGRESS_INTERVAL = 0.5
+
+    # 媒体处理（图片预览、视频封面、低码率音视频）：进程数、最多在途任务数、单个任务超时（秒）
+    MEDIA_FOLDER = os.path.join(UPLOAD_FOLDER, 'media')
+    MEDIA_WORKERS = 2
+    MEDIA_QUEUE_MAXSIZE = 32
+    MEDIA_JOB_TIMEOUT = 300
+    MEDIA_PREVIEW_SIZE = 1024
+    MEDIA_POSTER_SIZE = 640
+    MEDIA_AUDIO_BITRATE = '64k'
+    MEDIA_VIDEO_HEIGHT = 480
+    MEDIA_VIDEO_CRF = 28
+
+    # 文件下载：'' 由本服务发送，'x-accel' 返回 X-Accel-Redirect 交给 nginx（需配置 internal
+    # location 指向 UPLOAD_FOLDER），'x-sendfile' 返回 X-Sendfile 交给 Apache/lighttpd
+    FILE_SENDFILE_MODE = os.getenv('FILE_SENDFILE_MODE', '')
+    FILE_ACCEL_PREFIX = os.getenv('FILE_ACCEL_PREFIX', '/protected-uploads/')
+    USE_X_SENDFILE = FILE_SENDFILE_MODE == 'x-sendfile'
+    FILE_CACHE_MAX_AGE = 3600
+
+    # 头像缩略图尺寸（像素）、生成线程数、进程内缓存条数、带版本地址的缓存时间（秒）
+    AVATAR_SIZES = (32, 64, 128)
+    AVATAR_WORKERS = 2
+    AVATAR_CACHE_ENTRIES = 2048
+    AVATAR_CACHE_MAX_AGE = 365 * 24 * 3600
+
+    # AI 回复建议缓存：进程内 LRU 条目数与 Redis 中的过期时间
+    AI_CACHE_ENTRIES = 256
+    AI_CACHE_TTL = 10 * 60  # 秒
+
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     PREFERRED_URL_SCHEME = 'https'
     BASE_URL = 'https://chat.yihang01.cn'
-    PORT = 5000
+    PORT = int(os.environ.get('PORT', 5000))
+    # 多进程部署时由前置的 nginx 终止 TLS，各进程可关闭 SSL
+    SSL_ENABLED = os.environ.get('SSL_ENABLED', '1') == '1'
+    SSL_CERT_FILE = os.environ.get('SSL_CERT_FILE', 'chat.yihang01.cn_bundle.crt')
+    SSL_KEY_FILE = os.environ.get('SSL_KEY_FILE', 'chat.yihang01.cn.key')
     MAIL_SERVER = 'smtp.qq.com'
     MAIL_PORT = 587
     MAIL_USE_TLS = True
@@ -0,0 +1,52 @@
+from datetime import datetime
+from extensions import db
+
+class File(db.Model):
+    """上传文件的元数据索引
+
+    文件内容按 sha256 存放在分片目录中，多个文件ID可以引用同一份内容（引用数即相同 sha256 的行数）；
+    conversation 与聊天记录缓存使用同样的会话键（group:<id> / dm:<小ID>:<大ID>）。
+    """
+    __tablename__ = 'files'
+    __table_args__ = (
+        db.Index('idx_files_conversation_created', 'conversation', 'created_at'),
+        db.Index('idx_files_owner_created', 'owner_id', 'created_at'),
+        db.Index('idx_files_sha256', 'sha256'),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    file_id = db.Column(db.String(255), unique=True, nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(127))
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    conversation = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f'<File {self.file_id} {self.sha256}>'
+
+    @staticmethod
+    def conversation_files(conversation, limit=50):
+        return File.query.filter_by(conversation=conversation).order_by(
+            File.created_at.desc()).limit(limit).all()
+
+    @staticmethod
+    def owner_usage(owner_id):
+        """返回 (文件数, 总字节数)"""
+        count, total = db.session.query(db.func.count(File.id), db.func.sum(File.size)).filter(
+            File.owner_id == owner_id).one()
+        return count, int(total or 0)
+
+    def to_dict(self):
+        return {
+            'file_id': self.file_id,
+            'name': self.name,
+            'size': self.size,
+            'mime_type': self.mime_type,
+            'owner_id': self.owner_id,
+            'conversation': self.conversation,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'file_url': f'/uploads/{self.file_id}'
+        }
@@ -3,6 +3,10 @@ from extensions import db
 
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index('idx_messages_group_created', 'group_id', 'created_at', 'id'),
+        db.Index('idx_messages_pair_created', 'sender_id', 'receiver_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -46,6 +50,9 @@ class Message(db.Model):
             'sender_name': self.sender_name
         }
     
+    def to_row(self):
+        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
+
     def save(self):
         print(f'Saving message: {self}')
         if None in [self.sender_id, self.receiver_id, self.group_id]:
@@ -1,8 +1,10 @@
 from flask import Response, stream_with_context
 import json
 from flask import request, Blueprint, jsonify
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from services.ai_cache import ai_cache, normalize_text
 import os
+import time
 from openai import OpenAI
 from volcenginesdkarkruntime import Ark
 from dotenv import load_dotenv
@@ -18,7 +20,11 @@ class AIModel(Enum):
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-genai.configure(api_key=GOOGLE_API_KEY)
+# 默认的 gRPC 传输会绕过 gevent 的补丁阻塞事件循环，协程模式下改用 REST
+if os.getenv('SOCKETIO_ASYNC_MODE', 'threading') == 'gevent':
+    genai.configure(api_key=GOOGLE_API_KEY, transport='rest')
+else:
+    genai.configure(api_key=GOOGLE_API_KEY)
 DEEP_API_KEY = os.getenv('DEEP_API_KEY')
 GROK_API_KEY = os.getenv('GROK_API_KEY')
 
@@ -72,7 +78,7 @@ def suggest_stream():
         sender = message.get('sender_id')
         content = message.get('content')
         if sender and content:
-            conversation.append(f'用户{sender}: {content}')
+            conversation.append(f'用户{sender}: {normalize_text(content)}')
         else:
             print(f"Invalid message format: {message}") 
             continue
@@ -96,8 +102,15 @@ def suggest_stream():
         return jsonify({"error": "current_user_id is required"}), 400
     if not messages:
         return jsonify({"error": "messages is required"}), 400
-    
-    
+
+    # 相同模型、相同用户、相同上下文的请求直接重放缓存的回复；refresh 为真时重新生成
+    cache_key = ai_cache.make_key(choose_model.name, get_jwt_identity(), prompt)
+    cached = None if data.get('refresh') else ai_cache.get(cache_key)
+    if cached is not None:
+        def replay():
+            for content in cached:
+                yield f"data: {json.dumps({'content': content})}\n\n"
+        return Response(replay(), mimetype='text/event-stream')
 
     def get_Doubao_response():
         # print(prompt)
@@ -147,7 +160,7 @@ def suggest_stream():
     def Doubao_generate():
         stream = get_Doubao_response()
         if stream is None:
-            yield f"data: {json.dumps({'error': 'Failed to get AI response'})}\n\n"
+            yield {'error': 'Failed to get AI response'}
             return
         
         try:
@@ -155,55 +168,55 @@ def suggest_stream():
                 if chunk.choices and chunk.choices[0].delta.content:
                     content = chunk.choices[0].delta.content
                     # print(f"Sending content: {content}")
-                    yield f"data: {json.dumps({'content': content})}\n\n"
+                    yield {'content': content}
         except Exception as e:
             print(f"Error processing stream: {e}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield {'error': str(e)}
     
     def Gemeni_generate():
         stream = get_Gemini_response()
         if stream is None:
-            yield f"data: {json.dumps({'error': 'Failed to get AI response'})}\n\n"
+            yield {'error': 'Failed to get AI response'}
             return
         
         try:
             for chunk in stream:
                 content = chunk.text
                 # print(f"Sending content: {content}")
-                yield f"data: {json.dumps({'content': content})}\n\n"
+                yield {'content': content}
         except Exception as e:
             print(f"Error processing stream: {e}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield {'error': str(e)}
 
     def DeepSeek_generate():
         stream = get_Deep_response()
         if stream is None:
-            yield f"data: {json.dumps({'error': 'Failed to get AI response'})}\n\n"
+            yield {'error': 'Failed to get AI response'}
             return
         try:
             for chunk in stream:
                 print(f'Chunk: {chunk}')
                 if chunk.choices and chunk.choices[0].delta.content:
                     content = chunk.choices[0].delta.content
-                    yield f"data: {json.dumps({'content': content})}\n\n"
+                    yield {'content': content}
         except Exception as e:
             print(f"Error processing stream: {e}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield {'error': str(e)}
 
     def Grok_generate():
         stream = get_Grok_response()
         if stream is None:
-            yield f"data: {json.dumps({'error': 'Failed to get AI response'})}\n\n"
+            yield {'error': 'Failed to get AI response'}
             return
         try:
             for chunk in stream:
                 if chunk.choices and chunk.choices[0].delta.content:
                     content = chunk.choices[0].delta.content
                     # print(f"Sending content: {content}")
-                    yield f"data: {json.dumps({'content': content})}\n\n"
+                    yield {'content': content}
         except Exception as e:
             print(f"Error processing stream: {e}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield {'error': str(e)}
 
     def AI_generate():
         if choose_model == AIModel.DOUBAO:
@@ -219,7 +232,25 @@ def suggest_stream():
             for chunk in Grok_generate():
                 yield chunk
 
+    def cached_generate():
+        # 客户端中途断开时生成器在 yield 处结束，不会缓存不完整的回复
+        chunks, failed = [], False
+        started = time.monotonic()
+        for event in AI_generate():
+            if 'error' in event:
+                failed = True
+            else:
+                chunks.append(event['content'])
+            yield f"data: {json.dumps(event)}\n\n"
+        if not failed:
+            ai_cache.put(cache_key, chunks, time.monotonic() - started)
+
     return Response(
-        stream_with_context(AI_generate()),
+        stream_with_context(cached_generate()),
         mimetype='text/event-stream'
-    )
\ No newline at end of file
+    )
+
+@ai_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def cache_stats():
+    return jsonify(ai_cache.stats())
\ No newline at end of file
@@ -4,6 +4,7 @@ from models.user import User
 from services.chat import ChatService  
 from models.login_log import LoginLog
 from models.group_member import GroupMember
+from services.read_state import ReadStateManager
 from sqlalchemy import or_
 from extensions import db, redis_client, mail
 from flask_sqlalchemy import SQLAlchemy
@@ -147,6 +148,7 @@ def register():
             group_id=1,
             role='member'
         ).save()
+        ReadStateManager.on_join(new_user.id, 1)
 
         return jsonify({
             'message': '注册成功',
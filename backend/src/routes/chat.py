@@ -1,9 +1,15 @@
 from flask import Blueprint, request, jsonify
 from services.chat import ChatService
+from services.message_writer import message_writer
+from services.history_cache import conversation_key
+from services.read_state import ReadStateManager
+from models.group_member import GroupMember
 from models.message import Message
 from models.user import User
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from utils.token_util import admin_required
 from extensions import db
+from config import Config
 
 chat_bp = Blueprint('chat', __name__)
 chat_service = ChatService()
@@ -39,7 +45,7 @@ def send_message():
         elif type == 'file':
             message = chat_service.send_file_message(sender, receiver, group, content, file_url, status)
         
-        message.save()
+        chat_service.store_message(message)
         return jsonify(message.to_dict()), 200
     except Exception as e:
         print(e)
@@ -52,6 +58,11 @@ def receive_messages(user_id):
     # return jsonify(messages), 200
     return 200
 
+@chat_bp.route('/writer/stats', methods=['GET'])
+@admin_required
+def get_writer_stats():
+    return jsonify(message_writer.stats()), 200
+
 @chat_bp.route('/history', methods=['POST'])
 @jwt_required()
 def get_history():
@@ -60,23 +71,30 @@ def get_history():
         data = request.get_json()
         group_id = data.get('groupId')
         friend_id = data.get('friendId')
+        if not group_id and not friend_id and data.get('channelId') == 'public':
+            group_id = 1
 
-        print(f'group_id: {group_id}, friend_id: {friend_id}', user_id)
-        
-        query = Message.query
-        
-        if group_id:
-            query = query.filter(Message.group_id == group_id)
-        elif friend_id:
-            query = query.filter(
-                ((Message.sender_id == user_id) & (Message.receiver_id == friend_id)) |
-                ((Message.sender_id == friend_id) & (Message.receiver_id == user_id))
-            )
-            
-        messages = query.order_by(Message.created_at.desc()).limit(50).all()
-        messages.reverse()
-        return jsonify([msg.to_dict() for msg in messages]), 200
+        cursor = data.get('cursor')
+        direction = data.get('direction', 'before')
+        if direction not in ('before', 'after'):
+            return jsonify({'error': 'direction 只能是 before 或 after'}), 400
+        try:
+            limit = min(max(int(data.get('limit', Config.HISTORY_PAGE_SIZE)), 1), Config.HISTORY_MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'limit 必须是整数'}), 400
+
+        page = chat_service.get_history_page(
+            user_id,
+            group_id=group_id,
+            friend_id=friend_id,
+            cursor=cursor,
+            direction=direction,
+            limit=limit
+        )
+        return jsonify(page), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -84,16 +102,16 @@ def get_history():
 @jwt_required()
 def mark_messages_read(chat_id):
     try:
-        current_user = User.query.get(get_jwt_identity())
-        Message.query.filter(
-            Message.receiver_id == current_user.id,
-            (Message.sender_id == chat_id) | (Message.group_id == chat_id),
-            (Message.is_read == False or Message.is_read == None)
-        ).update({Message.is_read: True})
-        db.session.commit()
-        return jsonify({'success': True}), 200
+        user_id = int(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        chat_type = data.get('type') or request.args.get('type', 'friend')
+        if chat_type == 'group':
+            conv = conversation_key(group_id=chat_id)
+        else:
+            conv = conversation_key(sender_id=user_id, receiver_id=chat_id)
+        last_read_id = ReadStateManager.mark_read(user_id, conv)
+        return jsonify({'success': True, 'last_read_id': last_read_id}), 200
     except Exception as e:
-        db.session.rollback()
         print('error', str(e))
         return jsonify({'error': str(e)}), 500
 
@@ -101,15 +119,18 @@ def mark_messages_read(chat_id):
 @jwt_required()
 def get_unread_counts():
     try:
-        current_user = User.query.get(get_jwt_identity())
-        unread_counts = db.session.query(
-            Message.sender_id,
-            db.func.count(Message.id)
-        ).filter(
-            Message.receiver_id == current_user.id,
-            Message.is_read == False
-        ).group_by(Message.sender_id).all()
-        
-        return jsonify({str(sender_id): count for sender_id, count in unread_counts}), 200
+        user_id = int(get_jwt_identity())
+        group_ids = [member.group_id for member in GroupMember.query.filter_by(user_id=user_id).all()]
+        unread = ReadStateManager.get_unread_counts(user_id, group_ids)
+
+        # 私聊以好友ID为键（与原接口一致），群聊以 group_<id> 为键
+        result = {}
+        for conv, count in unread.items():
+            if conv.startswith('group:'):
+                result[f"group_{conv.split(':')[1]}"] = count
+            else:
+                low, high = conv.split(':')[1:]
+                result[high if low == str(user_id) else low] = count
+        return jsonify(result), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
@@ -1,52 +1,248 @@
-from flask import Blueprint, request, jsonify, send_from_directory, Response
+from flask import Blueprint, request, jsonify, send_from_directory, Response, send_file
 from config import Config
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models.file import File
+from services.file_manager import resolve_path, upload_manager
+from services.media_processor import media_processor
+from services.avatar import avatar_service, avatar_folder, sniff_mimetype
 from werkzeug.utils import secure_filename
+from werkzeug.http import http_date, is_resource_modified, quote_etag
 import os
-from urllib.parse import unquote
+import secrets
+import mimetypes
+from datetime import datetime, timezone
+from urllib.parse import unquote, quote, urlsplit, parse_qs
+from models.user import User
+from models.group_member import GroupMember
+from services.history_cache import conversation_key
 
 file_bp = Blueprint('file', __name__)
 
-@file_bp.route('/uploads/<path:filename>', methods=['GET'])
-def uploaded_file(filename):
-    def send_file():
-        decoded_filename = unquote(filename)
-        store_path = os.path.join(Config.UPLOAD_FOLDER, decoded_filename)
-        try:
-            with open(store_path, 'rb') as targetfile:
-                while 1:
-                    data = targetfile.read(1024 * 1024)
+
+def _file_etag(record, stat):
+    # 有文件记录的用内容哈希作为强 ETag，尚未迁移的旧文件由 mtime 和大小生成
+    if record:
+        return record.sha256
+    return f'{int(stat.st_mtime)}-{stat.st_size}'
+
+
+def _content_disposition(file_id):
+    return f"attachment; filename*=UTF-8''{quote(file_id)}"
+
+
+def _requested_ranges(size):
+    """返回多段 Range 请求规范化后的 [(start, stop)]，不是多段请求时返回 None"""
+    ranges = request.range
+    if ranges is None or ranges.units != 'bytes' or len(ranges.ranges) < 2:
+        return None
+    normalized = []
+    for start, stop in ranges.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            normalized.append((start, stop))
+    return normalized
+
+
+def _multipart_response(path, file_id, ranges, size, mimetype, etag, stat):
+    boundary = secrets.token_hex(16)
+    headers = [
+        (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+        for start, stop in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    length = sum(len(h) + stop - start for h, (start, stop) in zip(headers, ranges)) \
+        + 2 * (len(ranges) - 1) + len(closing)
+
+    def generate():
+        with open(path, 'rb') as f:
+            for i, (header, (start, stop)) in enumerate(zip(headers, ranges)):
+                if i:
+                    yield b'\r\n'
+                yield header
+                f.seek(start)
+                remaining = stop - start
+                while remaining:
+                    data = f.read(min(1024 * 1024, remaining))
                     if not data:
                         break
+                    remaining -= len(data)
                     yield data
+        yield closing
+
+    response = Response(generate(), status=206,
+                        content_type=f'multipart/byteranges; boundary={boundary}')
+    response.headers['Content-Length'] = str(length)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['ETag'] = quote_etag(etag)
+    response.headers['Last-Modified'] = http_date(stat.st_mtime)
+    response.headers['Content-Disposition'] = _content_disposition(file_id)
+    return response
+
+
+@file_bp.route('/uploads/<path:filename>', methods=['GET'])
+def uploaded_file(filename):
+    try:
+        file_id = unquote(filename)
+        # 上传文件ID不含目录，拒绝访问临时目录、对象目录或上传目录之外的路径
+        if not file_id or '/' in file_id or '\\' in file_id or file_id.startswith('.'):
+            return jsonify({'error': 'File not found'}), 404
+        record, store_path = resolve_path(file_id)
+        mimetype = (record and record.mime_type) or mimetypes.guess_type(file_id)[0] \
+            or 'application/octet-stream'
+        download_name = file_id
+
+        # ?variant= 取后台生成的预览图、视频封面或低码率版本
+        variant = request.args.get('variant')
+        if variant:
+            store_path = record and media_processor.find_variant(record.sha256, record.mime_type, variant)
+            if not store_path:
+                return jsonify({'error': 'Variant not found'}), 404
+            mimetype = mimetypes.guess_type(store_path)[0] or 'application/octet-stream'
+            download_name = f'{os.path.splitext(file_id)[0]}_{variant}{os.path.splitext(store_path)[1]}'
+
+        store_path = os.path.abspath(store_path)
+        try:
+            stat = os.stat(store_path)
         except FileNotFoundError:
             print(f"File not found: {store_path}")
             return jsonify({'error': 'File not found'}), 404
-        except Exception as e:
-            print(f"Error reading file: {e}")
-            return jsonify({'error': 'Error reading file'}), 500
 
-    try:
-        decoded_filename = unquote(filename)
-        decoded_filename = decoded_filename.encode('utf-8').decode('latin1')
-        response = Response(send_file(), content_type='application/octet-stream')
-        response.headers["Content-disposition"] = f"attachment; filename*='UTF-8''{decoded_filename}" # Corrected line
-        return response
+        etag = _file_etag(record, stat)
+        if variant:
+            etag = f'{etag}-{variant}'
+
+        if Config.FILE_SENDFILE_MODE == 'x-accel':
+            # 由 nginx 通过内部 location 发送文件，Range 和条件请求也由 nginx 处理
+            response = Response(mimetype=mimetype)
+            relative = os.path.relpath(store_path, os.path.abspath(Config.UPLOAD_FOLDER))
+            response.headers['X-Accel-Redirect'] = Config.FILE_ACCEL_PREFIX + quote(relative)
+            response.headers['Content-Disposition'] = _content_disposition(download_name)
+            response.headers['ETag'] = quote_etag(etag)
+            return response
+
+        # 多段 Range：werkzeug 只处理单段，这里自行生成 multipart/byteranges
+        last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+        if_range = request.if_range
+        if if_range.etag:
+            range_applies = if_range.etag == etag
+        elif if_range.date:
+            range_applies = if_range.date >= last_modified
+        else:
+            range_applies = True
+        ranges = _requested_ranges(stat.st_size) if range_applies else None
+        if ranges is not None and is_resource_modified(
+                request.environ, etag=etag, last_modified=last_modified):
+            if not ranges:
+                response = Response(status=416)
+                response.headers['Content-Range'] = f'bytes */{stat.st_size}'
+                return response
+            return _multipart_response(store_path, download_name, ranges, stat.st_size, mimetype, etag, stat)
+
+        # 单段 Range、If-None-Match/If-Modified-Since 由 send_file 处理；x-sendfile 模式下
+        # （USE_X_SENDFILE）只返回 X-Sendfile 头，否则交给 WSGI 服务器的 wsgi.file_wrapper 发送，
+        # 支持的服务器会使用 sendfile 零拷贝
+        return send_file(
+            store_path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=True,
+            etag=etag,
+            last_modified=last_modified,
+            max_age=Config.FILE_CACHE_MAX_AGE
+        )
     except Exception as e:
         print(f"File download error: {str(e)}")
         return jsonify({'error': str(e)}), 500
     
+@file_bp.route('/uploads/<path:filename>', methods=['DELETE'])
+@jwt_required()
+def delete_file(filename):
+    # 只有上传者可以删除；内容没有其他文件引用时对象一并删除
+    file_id = unquote(filename)
+    record = File.query.filter_by(file_id=file_id).first()
+    if not record:
+        return jsonify({'error': 'File not found'}), 404
+    if record.owner_id != int(get_jwt_identity()):
+        return jsonify({'error': '只能删除自己上传的文件'}), 403
+    upload_manager.release(file_id)
+    return jsonify({'message': '文件已删除'})
+
+@file_bp.route('/usage', methods=['GET'])
+@jwt_required()
+def file_usage():
+    count, total = File.owner_usage(int(get_jwt_identity()))
+    return jsonify({'files': count, 'bytes': total})
+
+@file_bp.route('/conversation/<int:chat_id>', methods=['GET'])
+@jwt_required()
+def conversation_files(chat_id):
+    # 会话中最近上传的文件，?type=group 为群聊（需是群成员），否则为与该好友的私聊
+    user_id = int(get_jwt_identity())
+    if request.args.get('type', 'friend') == 'group':
+        if not GroupMember.query.filter_by(group_id=chat_id, user_id=user_id).first():
+            return jsonify({'error': '不是该群组成员'}), 403
+        conv = conversation_key(group_id=chat_id)
+    else:
+        # 私聊会话键由双方ID组成，请求者必然是参与者
+        conv = conversation_key(sender_id=user_id, receiver_id=chat_id)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    return jsonify([record.to_dict() for record in File.conversation_files(conv, limit)])
+
+@file_bp.route('/media/stats', methods=['GET'])
+@jwt_required()
+def media_stats():
+    return jsonify(media_processor.stats())
+
+@file_bp.route('/avatar/versions', methods=['POST'])
+@jwt_required()
+def avatar_versions():
+    # 批量返回用户头像的内容版本（上传时写入头像地址的 ?v=），前端据此拼出可永久缓存的缩略图地址
+    user_ids = (request.get_json() or {}).get('user_ids', [])
+    if not isinstance(user_ids, list) or not all(isinstance(uid, int) for uid in user_ids):
+        return jsonify({'error': 'user_ids 必须是整数列表'}), 400
+    users = User.query.filter(User.id.in_(user_ids[:500])).all() if user_ids else []
+    versions = {}
+    for user in users:
+        version = parse_qs(urlsplit(user.avatar or '').query).get('v')
+        versions[str(user.id)] = version[0] if version else None
+    return jsonify(versions), 200
+
 @file_bp.route('/avatar/<path:filename>', methods=['GET'])
 def get_avatar(filename):
     try:
-        avatar_path = os.path.join(Config.UPLOAD_FOLDER, 'avatar', filename)
-        # print(f"Avatar path: {avatar_path}")
+        filename = os.path.basename(filename)
+        original = os.path.join(avatar_folder(), filename)
+        path = original
+
+        # ?size= 选择缩略图，尚未生成时先返回原图并在后台生成
+        size = request.args.get('size', type=int)
+        variant = avatar_service.pick_size(size) if size else None
+        if variant:
+            path = avatar_service.variant_path(filename, size) or original
+            if path == original and os.path.exists(original):
+                avatar_service.schedule(filename)
+
         try:
-            with open(avatar_path, 'rb') as avatar:
-                return avatar.read(), 200, {'Content-Type': 'image/jpeg'}
+            current_version = avatar_service.content_version(original)
+            data, etag = avatar_service.load(path)
         except FileNotFoundError:
-            print(f"Avatar not found: {avatar_path}")
+            print(f"Avatar not found: {original}")
             return jsonify({'error': 'Avatar not found'}), 404
 
+        response = Response(data, mimetype='image/jpeg' if path != original else sniff_mimetype(data))
+        response.set_etag(etag)
+        # 地址带有完整的当前内容版本（?v=，与 content_version 一致）且取到的是缩略图时可以永久缓存，否则每次协商
+        if request.args.get('v') == current_version and (path != original or not variant):
+            response.headers['Cache-Control'] = f'public, max-age={Config.AVATAR_CACHE_MAX_AGE}, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
     except Exception as e:
         print(f"获取头像失败: {str(e)}")
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
@@ -6,6 +6,8 @@ from models.user import User
 from models.friendship import Friendship
 from extensions import db
 from websocket import socketio
+from services.presence import presence
+from services.session_context import current_session
 
 friend_request_bp = Blueprint('friend_request', __name__)
 
@@ -24,14 +26,15 @@ def check_friendship(user_id):
 @socketio.on('friend_request')
 def handle_friend_request(data):
     try:
-        sender_id = data.get('sender_id')
+        # 发送者取自会话上下文，不查库也不信任客户端传来的 sender_id
+        session = current_session()
+        sender_id = session['user_id']
         receiver_id = data.get('receiver_id')
         
         print(f"处理好友请求: 从 {sender_id} 到 {receiver_id}")
         print(f"当前活动房间: {rooms()}")
         
-        sender = User.query.get(sender_id)
-        if not sender:
+        if not session['username']:
             raise Exception('用户不存在')
             
         existing_friendship = Friendship.query.filter(
@@ -61,9 +64,9 @@ def handle_friend_request(data):
         emit('friend_request_received', {
             'request_id': friend_request.id,
             'sender': {
-                'id': sender.id,
-                'username': sender.username,
-                'avatar': sender.avatar
+                'id': sender_id,
+                'username': session['username'],
+                'avatar': session['avatar']
             }
         }, room=room)
         print(f"通知已发送到房间 {room}")
@@ -87,9 +90,11 @@ def handle_accept_friend_request(data):
         sender_id = request.sender_id
         receiver_id = request.receiver_id
         
-        # 获取发送者和接收者信息
+        # 只有请求的接收者本人可以接受，接收者信息取自会话上下文
+        session = current_session()
+        if session['user_id'] != receiver_id:
+            raise Exception('无权处理该好友请求')
         sender = User.query.get(sender_id)
-        receiver = User.query.get(receiver_id)
         
         friendship = Friendship(
             user_id=sender_id,
@@ -102,6 +107,7 @@ def handle_accept_friend_request(data):
         db.session.commit()
         
         print(f"好友请求已接受: {sender_id} -> {receiver_id}")
+        presence.add_peers(sender_id, receiver_id)
         
         room = [f'user_{sender_id}', f'user_{receiver_id}']
         emit('friend_request_accepted', {
@@ -112,10 +118,10 @@ def handle_accept_friend_request(data):
                 'status': sender.status or 'offline'
             },
             'receiver': {
-                'id': receiver.id,
-                'username': receiver.username,
-                'avatar': receiver.avatar,
-                'status': receiver.status or 'offline'
+                'id': receiver_id,
+                'username': session['username'],
+                'avatar': session['avatar'],
+                'status': 'online'
             }
         }, room=room)
         
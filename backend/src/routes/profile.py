@@ -4,6 +4,7 @@ from models.profile import Profile
 from models.user import User
 from extensions import db
 from config import Config
+from services.avatar import avatar_service
 import os
 
 profile_bp = Blueprint('profile', __name__)
@@ -76,7 +77,10 @@ def upload_avatar():
                 os.makedirs(os.path.join(Config.UPLOAD_FOLDER, 'avatar'))
             file.save(storepath)
             # print(f'Avatar saved to {storepath}')
-            profile.avatar = f'{Config.BASE_URL}:{Config.PORT}/api/file/avatar/{filename}'
+            avatar_service.schedule(filename)
+            # 地址带上内容版本，头像更换后地址随之变化，浏览器可以永久缓存
+            version = avatar_service.content_version(storepath)
+            profile.avatar = f'{Config.BASE_URL}:{Config.PORT}/api/file/avatar/{filename}?v={version}'
             user = User.query.get(user_id)
             user.avatar = profile.avatar
             db.session.commit()
@@ -4,6 +4,7 @@ from models.user import User
 from models.group_member import GroupMember
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.friendship import Friendship
+from websocket import OnlineUserManager
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/update', methods=['PUT'])
@@ -59,4 +60,19 @@ def get_user_groups():
 def get_user_status():
     user_id = get_jwt_identity()
     user = User.query.get(user_id)
-    return jsonify({'status': user.status}), 200
\ No newline at end of file
+    return jsonify({'status': user.status}), 200
+
+@user_bp.route('/online-status', methods=['POST'])
+@jwt_required()
+def get_online_status():
+    user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    user_ids = data.get('user_ids', [])
+    if not isinstance(user_ids, list):
+        return jsonify({'error': 'user_ids 必须是列表'}), 400
+    try:
+        user_ids = [int(uid) for uid in user_ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'user_ids 只能包含用户ID'}), 400
+    status = OnlineUserManager.get_visible_status(user_id, user_ids)
+    return jsonify({str(uid): online for uid, online in status.items()}), 200
@@ -1,11 +1,41 @@
+import math
+import re
 from flask import Blueprint, request, jsonify
 from extensions import socketio
 from flask_socketio import emit, join_room, leave_room
+from flask_jwt_extended import jwt_required
+from config import Config
+from services.whiteboard import stroke_log, draw_batcher, raster_snapshots
 
 whiteboard_bp = Blueprint('whiteboard', __name__)
 
-# 存储每个房间的白板状态
-whiteboard_states = {}
+COLOR_PATTERN = re.compile(r'^#([0-9a-fA-F]{3}|[0-9a-fA-F]{6})$')
+DEFAULT_COLOR = '#000000'
+
+# 白板内容以笔画为单位保存在 Redis 的操作日志和快照中，多个进程共享，见 services/whiteboard.py
+def _send_state(room, since=None, raster=True):
+    # since 为客户端最后见到的序号，仍在日志范围内时只发送之后的笔画（incremental）；
+    # 否则有栅格快照时发送 PNG（二进制）加其后的笔画
+    seq, incremental, image, strokes, truncated = stroke_log.load(room, since, raster)
+    state = {
+        'strokes': strokes,
+        'seq': seq,
+        'incremental': incremental,
+        'room': room
+    }
+    if image:
+        state['image'] = image
+    if truncated:
+        # 不接收栅格快照时，早期笔画只保存在快照底图中，告诉客户端画面不完整
+        state['truncated'] = truncated
+    emit('whiteboard_state', state)
+
+def _clamp(value, low, high):
+    return min(max(value, low), high)
+
+def _since(data):
+    since = data.get('since')
+    return since if isinstance(since, int) and since >= 0 else None
 
 @socketio.on('join_whiteboard')
 def handle_join_whiteboard(data):
@@ -16,16 +46,16 @@ def handle_join_whiteboard(data):
         return
 
     join_room(room)
-    if room in whiteboard_states:
-        emit('whiteboard_state', {
-            'state': whiteboard_states[room],
-            'room': room
-        })
+    draw_batcher.resume(room, request.sid)
+    _send_state(room, _since(data))
 
 @socketio.on('leave_whiteboard')
 def handle_leave_whiteboard(data):
     room = data.get('room')
     if room:
+        stroke_log.end(room, request.sid)
+        draw_batcher.forget(room, request.sid)
+        draw_batcher.resume(room, request.sid)
         leave_room(room)
 
 @socketio.on('draw')
@@ -34,36 +64,72 @@ def handle_draw(data):
     if not room:
         return
 
-    # 更新房间的白板状态
-    if room not in whiteboard_states:
-        whiteboard_states[room] = []
-    
-    draw_data = {
-        'x': data.get('x'),
-        'y': data.get('y'),
-        'drawing': data.get('drawing'),
-        'color': data.get('color', '#000000'),
-        'lineWidth': data.get('lineWidth', 2),
-        'room': room 
-    }
+    try:
+        x, y = float(data.get('x')), float(data.get('y'))
+        line_width = float(data.get('lineWidth', 2))
+        if not all(math.isfinite(value) for value in (x, y, line_width)):
+            raise ValueError('非有限数值')
+    except (TypeError, ValueError):
+        return
+
+    # 过大的线宽和坐标会让栅格化逐点盖章的开销失控，写入日志前先限制在画布附近
+    max_width = Config.WHITEBOARD_MAX_LINE_WIDTH
+    width, height = Config.WHITEBOARD_CANVAS_SIZE
+    line_width = _clamp(line_width, 0, max_width)
+    x = _clamp(x, -max_width, width + max_width)
+    y = _clamp(y, -max_width, height + max_width)
+
+    drawing = bool(data.get('drawing'))
+    # 颜色原样写入日志并参与栅格化，只接受 #rgb / #rrggbb
+    color = data.get('color')
+    if not isinstance(color, str) or not COLOR_PATTERN.match(color):
+        color = DEFAULT_COLOR
     
-    whiteboard_states[room].append(draw_data)
+    # drawing 为 False 表示落笔，开始新的一笔
+    if drawing:
+        stroke_log.extend(room, request.sid, x, y, color, line_width)
+    else:
+        stroke_log.begin(room, request.sid, x, y, color, line_width)
     
-    print(f'Broadcasting whiteboard event to room: {room}')
-    emit('draw', draw_data, room=room, broadcast=True)
+    # 不再逐点广播，由 draw_batcher 按节拍合并后发送 draw_batch
+    draw_batcher.add(room, request.sid, x, y, color, line_width, drawing)
+
+@socketio.on('draw_ack')
+def handle_draw_ack(data):
+    room = data.get('room')
+    sent_at = data.get('t')
+    if room and isinstance(sent_at, (int, float)):
+        draw_batcher.report_ack(room, request.sid, sent_at)
+
+@socketio.on('stroke_end')
+def handle_stroke_end(data):
+    room = data.get('room')
+    if room:
+        stroke_log.end(room, request.sid)
 
 @socketio.on('clear_whiteboard')
 def handle_clear_whiteboard(data):
     room = data.get('room')
     if room:
-        whiteboard_states[room] = []  # 清空状态
-        emit('clear_whiteboard', {'room': room}, room=room, broadcast=True)
+        seq = stroke_log.clear(room)  # 清空状态
+        draw_batcher.clear(room)
+        emit('clear_whiteboard', {'room': room, 'seq': seq}, room=room, broadcast=True)
 
 @socketio.on('request_whiteboard_state')
 def handle_state_request(data):
     room = data.get('room')
-    if room and room in whiteboard_states:
-        emit('whiteboard_state', {
-            'state': whiteboard_states[room],
-            'room': room
-        })
+    if room:
+        if data.get('resume'):
+            # 客户端收到 whiteboard_paused 后请求恢复推送
+            draw_batcher.resume(room, request.sid)
+        # raster 为 False 时只发送笔画（客户端无法解码栅格快照时使用）
+        _send_state(room, _since(data), data.get('raster', True) is not False)
+
+@whiteboard_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def whiteboard_stats():
+    return jsonify({
+        'strokes': stroke_log.stats(),
+        'batches': draw_batcher.stats(),
+        'rasters': raster_snapshots.stats()
+    })
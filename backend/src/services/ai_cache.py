@@ -0,0 +1,106 @@
+import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from extensions import redis_client, logger
+
+
+def normalize_text(text):
+    """合并空白，避免仅空格/换行不同的相同上下文产生不同的缓存键"""
+    return ' '.join(str(text).split())
+
+
+class AIResponseCache:
+    """AI 回复建议缓存
+
+    键为 (模型, 请求用户, 规范化提示词的 sha256)。进程内 LRU（AI_CACHE_ENTRIES 条）在前，
+    Redis（ai_suggest:<模型>:<用户>:<哈希>，AI_CACHE_TTL 秒过期）在后，多个进程共享。
+    缓存内容为完整回复的分块列表，命中时按原样重放为相同的 SSE 分块；
+    只缓存正常结束的回复，出错或客户端中途断开的不缓存。
+    """
+
+    def __init__(self):
+        self.ttl = Config.AI_CACHE_TTL
+        self.max_entries = Config.AI_CACHE_ENTRIES
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'redis_hits': 0, 'misses': 0, 'stored': 0,
+                       'provider_seconds': 0.0, 'provider_calls': 0, 'cached_chars_served': 0}
+
+    @staticmethod
+    def make_key(model, user_id, prompt):
+        digest = hashlib.sha256(prompt.encode()).hexdigest()
+        return f'ai_suggest:{model}:{user_id}:{digest}'
+
+    def get(self, key):
+        """返回缓存的分块列表，未命中时返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > now:
+                self._cache.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                self._stats['cached_chars_served'] += sum(len(chunk) for chunk in entry[1])
+                return entry[1]
+            if entry:
+                del self._cache[key]
+
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.ttl(key)
+            data, ttl = pipe.execute()
+        except Exception as e:
+            logger.error(f'读取 AI 回复缓存失败: {str(e)}')
+            data = None
+        if data is None:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+
+        chunks = json.loads(data)
+        with self._lock:
+            self._stats['redis_hits'] += 1
+            self._stats['cached_chars_served'] += sum(len(chunk) for chunk in chunks)
+            self._remember(key, chunks, now + max(ttl, 1))
+        return chunks
+
+    def put(self, key, chunks, elapsed):
+        """保存一次完整的回复，elapsed 为调用模型服务的耗时"""
+        with self._lock:
+            self._stats['provider_calls'] += 1
+            self._stats['provider_seconds'] += elapsed
+            if not chunks:
+                return
+            self._stats['stored'] += 1
+            self._remember(key, chunks, time.time() + self.ttl)
+        try:
+            redis_client.set(key, json.dumps(chunks, ensure_ascii=False), ex=self.ttl)
+        except Exception as e:
+            logger.error(f'写入 AI 回复缓存失败: {str(e)}')
+
+    def _remember(self, key, chunks, expires_at):
+        self._cache[key] = (expires_at, chunks)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits = self._stats['memory_hits'] + self._stats['redis_hits']
+            lookups = hits + self._stats['misses']
+            calls = self._stats['provider_calls']
+            avg_provider = self._stats['provider_seconds'] / calls if calls else 0
+            return {
+                **self._stats,
+                'entries': len(self._cache),
+                'hit_rate': round(hits / lookups, 4) if lookups else 0,
+                'avg_provider_seconds': round(avg_provider, 3),
+                # 每次命中按模型服务的平均耗时估算节省的等待时间
+                'estimated_seconds_saved': round(hits * avg_provider, 1)
+            }
+
+
+ai_cache = AIResponseCache()
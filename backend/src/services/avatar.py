@@ -0,0 +1,153 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from config import Config
+from extensions import logger
+
+# 超过该大小的原图不放入进程内缓存
+CACHE_MAX_FILE_SIZE = 256 * 1024
+
+
+def avatar_folder():
+    return os.path.join(Config.UPLOAD_FOLDER, 'avatar')
+
+
+def variant_name(filename, size):
+    base, _ = os.path.splitext(filename)
+    return f'{base}_{size}.jpg'
+
+
+def sniff_mimetype(data):
+    """原图按上传时的内容识别类型（文件名固定为 .jpg）"""
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data.startswith(b'GIF8'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+class AvatarService:
+    """头像缩略图
+
+    上传头像后在后台线程池中生成 AVATAR_SIZES 中各尺寸的方形 JPEG 缩略图
+    （avatar_<id>_<size>.jpg），读取时按 ?size= 选择不小于请求尺寸的最小缩略图。
+    进程内用 LRU 缓存热点头像的内容和 ETag（内容哈希），每次命中检查文件 mtime，
+    重新上传后自动失效；超过 CACHE_MAX_FILE_SIZE 的原图不缓存内容，只缓存 ETag，
+    判断 ?v= 是否为当前版本时不必重新读取和哈希原图。
+    """
+
+    def __init__(self):
+        self.sizes = sorted(Config.AVATAR_SIZES)
+        self.cache_entries = Config.AVATAR_CACHE_ENTRIES
+        self._executor = ThreadPoolExecutor(max_workers=Config.AVATAR_WORKERS,
+                                            thread_name_prefix='avatar')
+        # 正在生成的头像 -> 生成期间是否又有新的上传（需要再生成一次）
+        self._pending = {}
+        self._cache = OrderedDict()
+        # 路径 -> (mtime, ETag)，不保存内容
+        self._etags = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'generated': 0}
+
+    def content_version(self, path):
+        """原图内容哈希的前 12 位（ETag 的前缀），用作带版本的头像地址"""
+        return self.etag(path)[:12]
+
+    def etag(self, path):
+        """只返回 ETag，文件未变化时不读取内容；文件不存在时抛出 FileNotFoundError"""
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._etags.get(path)
+            if entry and entry[0] == mtime:
+                self._etags.move_to_end(path)
+                return entry[1]
+        return self.load(path)[1]
+
+    def pick_size(self, requested):
+        for size in self.sizes:
+            if size >= requested:
+                return size
+        return None
+
+    def schedule(self, filename):
+        """后台生成缩略图，同一头像同时只排队一次"""
+        with self._lock:
+            if filename in self._pending:
+                self._pending[filename] = True
+                return
+            self._pending[filename] = False
+        self._executor.submit(self._generate, filename)
+
+    def variant_path(self, filename, size):
+        """返回不小于 size 的最小缩略图路径；缩略图不存在或比原图旧时返回 None"""
+        variant = self.pick_size(size)
+        if not variant:
+            return None
+        path = os.path.join(avatar_folder(), variant_name(filename, variant))
+        try:
+            if os.stat(path).st_mtime_ns >= os.stat(os.path.join(avatar_folder(), filename)).st_mtime_ns:
+                return path
+        except FileNotFoundError:
+            pass
+        return None
+
+    def _generate(self, filename):
+        try:
+            source = os.path.join(avatar_folder(), filename)
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image).convert('RGB')
+                for size in self.sizes:
+                    thumb = ImageOps.fit(image, (size, size), Image.LANCZOS)
+                    target = os.path.join(avatar_folder(), variant_name(filename, size))
+                    # 写临时文件后原子替换，读取方不会拿到写了一半的缩略图
+                    tmp = f'{target}.tmp'
+                    thumb.save(tmp, 'JPEG', quality=85, optimize=True, progressive=True)
+                    os.replace(tmp, target)
+            with self._lock:
+                self._stats['generated'] += 1
+        except Exception as e:
+            logger.error(f'生成头像缩略图失败 {filename}: {str(e)}')
+        finally:
+            with self._lock:
+                rerun = self._pending.pop(filename, False)
+            if rerun:
+                self.schedule(filename)
+
+    def load(self, path):
+        """返回 (内容, ETag)，文件不存在时抛出 FileNotFoundError"""
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._cache.get(path)
+            if entry and entry[0] == mtime:
+                self._cache.move_to_end(path)
+                self._stats['hits'] += 1
+                return entry[1], entry[2]
+            self._stats['misses'] += 1
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        etag = hashlib.sha256(data).hexdigest()[:32]
+        with self._lock:
+            self._etags[path] = (mtime, etag)
+            self._etags.move_to_end(path)
+            while len(self._etags) > self.cache_entries:
+                self._etags.popitem(last=False)
+            if len(data) > CACHE_MAX_FILE_SIZE:
+                return data, etag
+            self._cache[path] = (mtime, data, etag)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return data, etag
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'cached': len(self._cache), 'pending': len(self._pending)}
+
+
+avatar_service = AvatarService()
@@ -1,7 +1,7 @@
 from flask_socketio import emit
 from flask import request
-from models.user import User
-from extensions import socketio
+from extensions import socketio, redis_client
+from services.session_context import current_session
 
 
 class CallService:
@@ -17,9 +17,10 @@ class CallService:
                 return
             try:
                 # print(f'处理通话请求: {data}')
-                sender_id = data.get('sender_id') or request.sid
+                session = current_session()
+                sender_id = session['user_id']
                 target_id = data.get('target_id')
-                caller_name = data.get('caller_name')
+                caller_name = session['username'] or data.get('caller_name')
                 sdp = data.get('sdp')
                 call_type = data.get('type')
                 
@@ -28,9 +29,9 @@ class CallService:
                     emit('call_error', {'message': '请求参数不完整'}, room=request.sid)
                     return
                 
-                target_user = User.query.get(target_id)
-                if not target_user:
-                    emit('call_error', {'message': '用户不存在'}, room=request.sid)
+                # 目标用户不在线时无法接通，用 Redis 在线集合判断，不再查库
+                if not redis_client.sismember('online_users', target_id):
+                    emit('call_error', {'message': '对方不在线'}, room=request.sid)
                     return
 
                 print(f'用户 {sender_id} ({caller_name}) 请求与用户 {target_id} 通话')
@@ -53,7 +54,7 @@ class CallService:
         @socketio.on('call_answer')
         def handle_call_answer(data):
             try:
-                sender_id = data.get('sender_id') or request.sid
+                sender_id = current_session()['user_id']
                 target_id = data.get('target_id')
                 sdp = data.get('sdp')
                 
@@ -76,7 +77,7 @@ class CallService:
             try:
                 target_id = data.get('target_id')
                 candidate = data.get('candidate')
-                sender_id = data.get('sender_id', request.sid)
+                sender_id = current_session()['user_id']
                 
                 if not target_id:
                     emit('call_error', {'message': '目标用户ID不存在'})
@@ -94,7 +95,7 @@ class CallService:
         def handle_call_rejected(data):
             try:
                 target_id = data.get('target_id')
-                sender_id = data.get('sender_id', request.sid)
+                sender_id = current_session()['user_id']
                 
                 if not target_id:
                     emit('call_error', {'message': '目标用户ID不存在'})
@@ -111,7 +112,7 @@ class CallService:
         def handle_call_ended(data):
             try:
                 target_id = data.get('target_id')
-                sender_id = data.get('sender_id', request.sid)
+                sender_id = current_session()['user_id']
                 
                 if not target_id:
                     emit('call_error', {'message': '目标用户ID不存在'})
@@ -137,9 +138,10 @@ class CallService:
             if call_type != 'video':
                 return
             try:
-                sender_id = data.get('sender_id') or request.sid
+                session = current_session()
+                sender_id = session['user_id']
                 target_id = data.get('target_id')
-                caller_name = data.get('caller_name')
+                caller_name = session['username'] or data.get('caller_name')
                 sdp = data.get('sdp')
                 call_type = data.get('type')
                 
@@ -148,9 +150,9 @@ class CallService:
                     emit('call_error', {'message': '请求参数不完整'}, room=request.sid)
                     return
                 
-                target_user = User.query.get(target_id)
-                if not target_user:
-                    emit('call_error', {'message': '用户不存在'}, room=request.sid)
+                # 目标用户不在线时无法接通，用 Redis 在线集合判断，不再查库
+                if not redis_client.sismember('online_users', target_id):
+                    emit('call_error', {'message': '对方不在线'}, room=request.sid)
                     return
 
                 print(f'用户 {sender_id} ({caller_name}) 请求与用户 {target_id} 视频通话')
@@ -173,7 +175,7 @@ class CallService:
         @socketio.on('video_call_answer')
         def handle_video_call_answer(data):
             try:
-                sender_id = data.get('sender_id') or request.sid
+                sender_id = current_session()['user_id']
                 target_id = data.get('target_id')
                 sdp = data.get('sdp')
                 
@@ -196,7 +198,7 @@ class CallService:
             try:
                 target_id = data.get('target_id')
                 candidate = data.get('candidate')
-                sender_id = data.get('sender_id', request.sid)
+                sender_id = current_session()['user_id']
                 
                 if not target_id:
                     emit('call_error', {'message': '目标用户ID不存在'})
@@ -214,7 +216,7 @@ class CallService:
         def handle_video_call_rejected(data):
             try:
                 target_id = data.get('target_id')
-                sender_id = data.get('sender_id', request.sid)
+                sender_id = current_session()['user_id']
                 
                 if not target_id:
                     emit('call_error', {'message': '目标用户ID不存在'})
@@ -231,7 +233,7 @@ class CallService:
         def handle_video_call_ended(data):
             try:
                 target_id = data.get('target_id')
-                sender_id = data.get('sender_id', request.sid)
+                sender_id = current_session()['user_id']
                 
                 if not target_id:
                     emit('call_error', {'message': '目标用户ID不存在'})
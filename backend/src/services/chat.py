@@ -1,16 +1,22 @@
 from flask import Blueprint, request, jsonify
 from models.message import Message
-import jwt, time, os
+import jwt, time, os, base64
 from werkzeug.utils import secure_filename
 from jwt import encode, decode
 from models.user import User
 from config import Config
 from datetime import datetime, timedelta, UTC
 from extensions import db
+from sqlalchemy import or_, and_
 from websocket import socketio
 from models.group_member import GroupMember
 from flask_socketio import emit, join_room, leave_room
-from services.file_manager import FileUploadManager
+from services.file_manager import upload_manager, resolve_path
+from services.media_processor import media_processor
+from services.message_writer import message_writer
+from services.history_cache import history_cache, conversation_key
+from services.read_state import ReadStateManager
+from services.session_context import current_session, in_group
 from models.message import Message
 from extensions import socketio
 from flask_socketio import emit
@@ -18,7 +24,7 @@ from flask_socketio import emit
 class ChatService:
     def __init__(self):
         self.setup_socket_handlers()
-        self.file_manager = FileUploadManager()
+        self.file_manager = upload_manager
         
     def setup_socket_handlers(self):
         @socketio.on('chat')
@@ -49,61 +55,122 @@ class ChatService:
             try:
                 # print(f"data[message]: {data['message']}")
                 print('fileName: ', data['fileName'])
+                session = current_session()
+                # 发送者信息以会话上下文为准
+                message_data = {
+                    **data['message'],
+                    'sender_id': session['user_id'],
+                    'sender_name': session['username']
+                }
+
+                # 客户端预先提供内容哈希且本人上传过相同内容时，不再上传任何分片
+                digest = data.get('sha256')
+                reused = self.file_manager.reuse_object(digest, data.get('fileSize'), data['fileName'],
+                                                        data.get('fileType'), message_data)
+                if reused:
+                    file_id, file_url = reused
+                    self.broadcast_file_message(message_data, file_url)
+                    self.process_media(file_id, message_data)
+                    emit('file_transfer_init', {'file_id': file_id, 'complete': True})
+                    return
+
                 file_id = self.file_manager.init_file(
                     data['fileName'],
                     data['totalChunks'],
                     data['fileType'],
-                    data['message']
+                    message_data,
+                    file_size=data.get('fileSize'),
+                    chunk_size=data.get('chunkSize')
                 )
+                if not file_id:
+                    raise ValueError("初始化文件传输失败")
                 # print(f"初始化文件传输: {file_id}")
-                emit('file_transfer_init', {'file_id': file_id})
+                # 客户端最多同时发送 window 个未确认的分片
+                emit('file_transfer_init', {'file_id': file_id, 'window': Config.UPLOAD_CHUNK_WINDOW})
             except Exception as e:
                 print(f"初始化文件传输失败: {str(e)}")
                 emit('error', {'msg': str(e)})
 
+        @socketio.on('file_transfer_status')
+        def handle_file_status(data):
+            try:
+                session = current_session()
+                info, missing = self.file_manager.missing_chunks(data['fileId'])
+                if info and info['owner'] != session['user_id']:
+                    info, missing = None, None
+                # 会话不存在（已过期或已完成）时客户端需要重新开始上传
+                emit('file_transfer_status', {
+                    'fileId': data['fileId'],
+                    'exists': info is not None,
+                    'totalChunks': info['total_chunks'] if info else 0,
+                    'missing': missing or []
+                })
+            except Exception as e:
+                print(f"查询文件传输状态失败: {str(e)}")
+                emit('error', {'msg': str(e)})
+
         @socketio.on('file_chunk')
         def handle_file_chunk(data):
             try:
                 # print(f"接收文件分片: {data}")
-                if self.file_manager.add_chunk(data['fileId'], data['chunkIndex'], data['data']):
+                session = current_session()
+                complete, progress = self.file_manager.add_chunk(
+                    data['fileId'], data['chunkIndex'], data['data'], user_id=session['user_id'])
+                if complete:
+                    file_info = self.file_manager.get_info(data['fileId'])
+                    if not file_info:
+                        raise ValueError(f"找不到文件信息: {data['fileId']}")
                     file_url = self.file_manager.save_file(data['fileId'])
                     if file_url:
-                        file_info = self.file_manager.file_info.get(data['fileId'])
-                        # print('file info: ',self.file_manager.file_info)
-                        if not file_info:
-                            raise ValueError(f"找不到文件信息: {data['fileId']}")
-                            
-                        message_data = file_info['message_data']
-                        new_message = Message(
-                            sender_id=message_data['sender_id'],
-                            receiver_id=message_data['receiver_id'],
-                            group_id=message_data['group_id'],
-                            content=message_data['content'],
-                            type='file',
-                            sender_name=message_data['sender_name'],
-                            file_url=file_url
-                        )
-                        new_message.save()
-                        
-                        emit('message', {
-                            'id': new_message.id,
-                            'sender_id': new_message.sender_id,
-                            'receiver_id': new_message.receiver_id,
-                            'group_id': new_message.group_id,
-                            'content': new_message.content,
-                            'type': 'file',
-                            'sender_name': new_message.sender_name,
-                            'created_at': new_message.created_at.isoformat(),
-                            'file_url': file_url
-                        }, room=message_data['room'])
+                        self.broadcast_file_message(file_info['message_data'], file_url)
+                        self.file_manager.discard(data['fileId'])
+                        self.process_media(data['fileId'], file_info['message_data'])
                     else:
                         raise ValueError("文件保存失败，没有文件URL")
+                elif progress is not None and self.file_manager.should_report_progress(data['fileId'], progress):
+                    # 进度只推送给上传者本人，并按步长/时间间隔节流
+                    emit('upload_progress', {'fileId': data['fileId'], 'progress': progress}, to=request.sid)
 
-                emit('chunk_received', {'index': data['chunkIndex']})
+                # 分片确认本身携带进度，最后一个分片不再单独推送进度
+                emit('chunk_received', {'fileId': data['fileId'], 'index': data['chunkIndex'], 'progress': progress})
             except Exception as e:
                 print(f"处理文件分片失败: {str(e)}")
                 emit('error', {'msg': str(e)})
             
+    @staticmethod
+    def process_media(file_id, message_data):
+        """图片/音视频提交到后台进程池生成预览和低码率版本，完成后推送 media_processed"""
+        record, _ = resolve_path(file_id)
+        if record:
+            media_processor.submit(file_id, record.sha256, record.mime_type, message_data['room'])
+
+    @staticmethod
+    def broadcast_file_message(message_data, file_url):
+        """上传完成后生成文件消息：分配ID、排队落库并发送到会话房间"""
+        new_message = Message(
+            sender_id=message_data['sender_id'],
+            receiver_id=message_data['receiver_id'],
+            group_id=message_data['group_id'],
+            content=message_data['content'],
+            type='file',
+            sender_name=message_data['sender_name'],
+            file_url=file_url
+        )
+        ChatService.store_message(new_message)
+
+        emit('message', {
+            'id': new_message.id,
+            'sender_id': new_message.sender_id,
+            'receiver_id': new_message.receiver_id,
+            'group_id': new_message.group_id,
+            'content': new_message.content,
+            'type': 'file',
+            'sender_name': new_message.sender_name,
+            'created_at': new_message.created_at.isoformat(),
+            'file_url': file_url
+        }, room=message_data['room'])
+        return new_message
+
     def handle_text_message(self, data):
         try:
             message = data.get('message')
@@ -112,24 +179,32 @@ class ChatService:
             if not room:
                 raise ValueError("房间ID不能为空")
                 
-            sender = User.query.get(message['sender_id'])
+            # 发送者取自连接时构建的会话上下文，不查库也不信任消息体中的 sender_id
+            session = current_session()
+            if not session['username']:
+                raise ValueError("用户不存在")
+            group_id = message.get('group_id', 0)
+            if group_id and not in_group(session, group_id):
+                raise ValueError("不是该群组成员")
             
             new_message = Message(
-                sender_id=message['sender_id'],
+                sender_id=session['user_id'],
                 receiver_id=message.get('receiver_id', 0),
-                group_id=message.get('group_id', 0),
+                group_id=group_id,
                 content=message['content'],
                 type=message['type'],
-                sender_name=sender.username
+                sender_name=session['username']
             )
             
-            new_message.save()
+            # 分配ID后立即广播，落库由批量写入器异步完成
+            ChatService.store_message(new_message)
             
             # 确保消息只发送到指定房间
             emit('message', {
                 **message,
                 'id': new_message.id,
-                'sender_name': sender.username,
+                'sender_id': new_message.sender_id,
+                'sender_name': new_message.sender_name,
                 'created_at': new_message.created_at.isoformat()
             }, room=room)
             
@@ -189,6 +264,105 @@ class ChatService:
             ((Message.sender_id == user2_id) & (Message.receiver_id == user1_id))
         ).order_by(Message.created_at.desc()).limit(limit).all()
     
+    @staticmethod
+    def encode_cursor(created_at, message_id):
+        if isinstance(created_at, datetime):
+            created_at = created_at.strftime('%Y-%m-%d %H:%M:%S')
+        raw = f"{created_at}|{message_id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S'), int(message_id)
+        except Exception:
+            raise ValueError('无效的游标')
+
+    @staticmethod
+    def _keyset_query(query, cursor, direction, limit):
+        # 按 (created_at, id) 做键集分页，配合 (…, created_at, id) 复合索引，任意深度都只扫描 limit 行
+        if cursor:
+            created_at, message_id = cursor
+            if direction == 'after':
+                query = query.filter(or_(
+                    Message.created_at > created_at,
+                    and_(Message.created_at == created_at, Message.id > message_id)
+                ))
+            else:
+                query = query.filter(or_(
+                    Message.created_at < created_at,
+                    and_(Message.created_at == created_at, Message.id < message_id)
+                ))
+        if direction == 'after':
+            query = query.order_by(Message.created_at.asc(), Message.id.asc())
+        else:
+            query = query.order_by(Message.created_at.desc(), Message.id.desc())
+        return query.limit(limit + 1).all()
+
+    @staticmethod
+    def fetch_history_rows(user_id, group_id=None, friend_id=None, cursor=None, direction='before', limit=50):
+        """按键集分页查询，最多返回 limit + 1 行（多取的一行用于判断是否还有更多），顺序与 direction 一致"""
+        if group_id:
+            return ChatService._keyset_query(
+                Message.query.filter(Message.group_id == group_id), cursor, direction, limit)
+        if friend_id:
+            # 拆成两个方向分别走 (sender_id, receiver_id, created_at, id) 索引，再合并，避免 OR 导致全表排序
+            rows = ChatService._keyset_query(
+                Message.query.filter(Message.sender_id == user_id, Message.receiver_id == friend_id),
+                cursor, direction, limit)
+            rows += ChatService._keyset_query(
+                Message.query.filter(Message.sender_id == friend_id, Message.receiver_id == user_id),
+                cursor, direction, limit)
+            rows.sort(key=lambda m: (m.created_at, m.id), reverse=(direction != 'after'))
+            return rows[:limit + 1]
+        return []
+
+    @staticmethod
+    def get_history_page(user_id, group_id=None, friend_id=None, cursor=None, direction='before', limit=50):
+        """键集分页获取聊天记录
+
+        direction 为 before 时返回游标之前（更早）的消息，为 after 时返回游标之后（更新）的消息；
+        不带游标时返回最新一页，优先从 Redis 热点缓存读取。返回的消息按时间正序排列。
+        """
+        decoded = ChatService.decode_cursor(cursor) if cursor else None
+        conv = conversation_key(group_id, user_id, friend_id) if (group_id or friend_id) else None
+        cacheable = conv is not None and not cursor and direction == 'before' and limit <= history_cache.depth
+
+        if cacheable:
+            cached = history_cache.get_recent(conv, limit)
+            if cached is not None:
+                return ChatService._build_page(cached, len(cached) == limit, direction, cursor)
+
+        fetch_limit = max(limit, history_cache.depth) if cacheable else limit
+        rows = ChatService.fetch_history_rows(user_id, group_id, friend_id, decoded, direction, fetch_limit)
+        if cacheable and message_writer.pending() == 0:
+            history_cache.warm(conv, [message.to_dict() for message in rows[:history_cache.depth]])
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction != 'after':
+            rows.reverse()
+        return ChatService._build_page([message.to_dict() for message in rows], has_more, direction, cursor)
+
+    @staticmethod
+    def _build_page(messages, has_more, direction, cursor):
+        return {
+            'messages': messages,
+            'prev_cursor': ChatService.encode_cursor(messages[0]['created_at'], messages[0]['id']) if messages else cursor,
+            'next_cursor': ChatService.encode_cursor(messages[-1]['created_at'], messages[-1]['id']) if messages else cursor,
+            'has_more_before': has_more if direction != 'after' else bool(cursor),
+            'has_more_after': has_more if direction == 'after' else bool(cursor)
+        }
+
+    @staticmethod
+    def store_message(message):
+        """分配ID并排队落库，同时写入热点会话缓存和未读计数"""
+        message_writer.submit(message)
+        history_cache.push(message)
+        ReadStateManager.on_message(message)
+        return message
+
     @staticmethod
     def generate_token(user_id):
         payload = {
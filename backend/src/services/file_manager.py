@@ -1,85 +1,627 @@
 import os
+import re
+import glob
+import json
 import time
+import hashlib
+import mimetypes
+import secrets
+import threading
+from contextlib import contextmanager
 from config import Config
+from extensions import db, redis_client, logger
+from models.file import File
+from services.history_cache import conversation_key
 from urllib.parse import unquote
 
+# 写入前认领一个分片：已收到返回 {1, 已接收分片数}，其他请求正在写入同一分片返回 {2, 已接收分片数}，
+# 认领成功返回 {0, 已接收分片数}；会话不存在返回 nil。认领在 ARGV[2] 秒后自动失效，
+# 写入途中进程退出时该分片仍可重传
+CLAIM_CHUNK_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+local received = tonumber(redis.call('HGET', KEYS[1], 'received'))
+if redis.call('GETBIT', KEYS[2], ARGV[1]) == 1 then
+    return {1, received}
+end
+if not redis.call('SET', KEYS[3], 1, 'NX', 'EX', ARGV[2]) then
+    return {2, received}
+end
+return {0, received}
+'''
+
+# 记录一个分片：位图中置位，首次收到时已接收计数 +1，释放认领并刷新会话过期时间；
+# 会话不存在（已过期或已完成）返回 nil。返回 {已接收分片数, 该分片此前是否已收到}
+ADD_CHUNK_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+redis.call('DEL', KEYS[3])
+local seen = redis.call('SETBIT', KEYS[2], ARGV[1], 1)
+local received
+if seen == 0 then
+    received = redis.call('HINCRBY', KEYS[1], 'received', 1)
+else
+    received = tonumber(redis.call('HGET', KEYS[1], 'received'))
+end
+if ARGV[3] ~= '' then
+    redis.call('HSET', KEYS[1], 'file_size', ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return {received, seen}
+'''
+
+# 只释放自己持有的对象锁（锁已过期被他人取得时不删除）
+UNLOCK_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+def session_key(file_id):
+    return f'upload:{file_id}'
+
+
+def bitmap_key(file_id):
+    return f'upload_chunks:{file_id}'
+
+
+def claim_key(file_id, chunk_index):
+    return f'upload_claim:{file_id}:{chunk_index}'
+
+
+def object_lock_key(digest):
+    return f'object_lock:{digest}'
+
+
+def spool_path(file_id):
+    return os.path.join(Config.UPLOAD_SPOOL_FOLDER, f'{file_id}.part')
+
+
+# 分片认领的有效期（秒），应远大于写入一个分片所需的时间
+CHUNK_CLAIM_TTL = 30
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# 内容对象锁的有效期（秒）和等待上限
+OBJECT_LOCK_TTL = 30
+OBJECT_LOCK_WAIT = 10
+
+
+@contextmanager
+def object_lock(digest):
+    """跨进程互斥同一内容对象的增删：引用（写入 files 记录）与回收（计数为 0 时删除对象）不能交错"""
+    key, token = object_lock_key(digest), secrets.token_hex(8)
+    deadline = time.monotonic() + OBJECT_LOCK_WAIT
+    while not redis_client.set(key, token, nx=True, ex=OBJECT_LOCK_TTL):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'等待内容对象锁超时: {digest}')
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        redis_client.eval(UNLOCK_SCRIPT, 1, key, token)
+
+
+def object_path(digest):
+    # 按哈希前两个字节分两级目录，每级 256 个子目录，单个目录中的文件数保持在较小规模
+    return os.path.join(Config.UPLOAD_OBJECTS_FOLDER, digest[:2], digest[2:4], digest)
+
+
+def legacy_path(file_id):
+    """迁移前平铺在 UPLOAD_FOLDER 中的文件"""
+    return os.path.join(Config.UPLOAD_FOLDER, file_id)
+
+
+def resolve_path(file_id):
+    """返回 (文件记录, 磁盘路径)；尚未迁移的旧文件没有记录，直接使用平铺路径"""
+    record = File.query.filter_by(file_id=file_id).first()
+    if record:
+        return record, object_path(record.sha256)
+    return None, legacy_path(file_id)
+
+
 class FileUploadManager:
+    """可续传的分片上传
+
+    上传会话（元数据 + 已接收分片位图）保存在 Redis 中，分片数据 pwrite 到 UPLOAD_SPOOL_FOLDER
+    中预分配的临时文件对应偏移处，进程内不保存任何上传状态：客户端断线重连、服务重启或连到
+    其他进程后，都可以通过 file_transfer_status 取得缺失的分片序号，只补传这些分片。
+    多进程部署时 UPLOAD_FOLDER 需为各进程共享的目录。
+
+    会话在最后一个分片到达 UPLOAD_SESSION_TTL 秒后过期，后台线程定期清理已无会话的临时文件。
+
+    文件内容按 SHA-256 存放在 UPLOAD_OBJECTS_FOLDER/<ab>/<cd>/<哈希>，files 表记录文件ID、
+    大小、类型、所有者、会话和内容哈希，下载地址 /uploads/<文件ID> 通过该表找到内容，保持不变；
+    相同内容只存一份，引用数即相同 sha256 的记录数。release 删除记录后引用数为 0 时删除对象；
+    后台线程还会回收没有任何记录引用、且超过 UPLOAD_OBJECT_GRACE 秒未被引用的对象（例如重命名后
+    写记录失败留下的）。新增引用和回收都在该哈希的 Redis 锁（object_lock）内进行，不会删掉刚被引用的对象。
+    同一文件的分片可以并发、乱序、重复到达：各分片写入临时文件的不同偏移，互不影响；
+    写入前先在 Redis 中原子地认领分片：已收到或正在被其他请求写入的分片直接跳过，不会覆盖
+    已计入哈希的内容；置位和计数在同一个 Lua 脚本中原子完成，只有补齐最后一个缺失分片的
+    那次调用会触发保存。增量哈希的状态由每个文件自己的锁保护。
+
+    哈希在分片按顺序到达时增量计算，乱序分片在前面的空缺补齐后从临时文件中读出并入，
+    完成时只需读取尚未计算的部分（换了进程则从头读一遍）。
+    """
+
     def __init__(self):
-        self.file_chunks = {}  
-        self.file_info = {}  
+        self.session_ttl = Config.UPLOAD_SESSION_TTL
+        self.sweep_interval = Config.UPLOAD_SWEEP_INTERVAL
+        self.object_grace = Config.UPLOAD_OBJECT_GRACE
+        self._app = None
+        self._thread = None
+        self.progress_step = Config.UPLOAD_PROGRESS_STEP
+        self.progress_interval = Config.UPLOAD_PROGRESS_INTERVAL
+        # 本进程内正在增量计算的哈希：file_id -> {'sha256', 'next', 'lock'}
+        self._hashers = {}
+        # 本进程内最近一次推送的上传进度：file_id -> (百分比, 时间)
+        self._progress = {}
+        self._hashers_lock = threading.Lock()
 
-    def init_file(self, file_name, total_chunks, file_type, message_data):
+    def init_app(self, app):
+        self.session_ttl = app.config.get('UPLOAD_SESSION_TTL', self.session_ttl)
+        self.sweep_interval = app.config.get('UPLOAD_SWEEP_INTERVAL', self.sweep_interval)
+        self.object_grace = app.config.get('UPLOAD_OBJECT_GRACE', self.object_grace)
+        self.progress_step = app.config.get('UPLOAD_PROGRESS_STEP', self.progress_step)
+        self.progress_interval = app.config.get('UPLOAD_PROGRESS_INTERVAL', self.progress_interval)
+        os.makedirs(app.config.get('UPLOAD_SPOOL_FOLDER', Config.UPLOAD_SPOOL_FOLDER), exist_ok=True)
+        if self._thread:
+            return
+        # 回收内容对象需要查询 files 表
+        self._app = app
+        self._thread = threading.Thread(target=self._run, name='upload-sweeper', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def new_file_id(file_name, sender_id):
+        """返回 (文件名, 文件ID)"""
+        # 解码并规范化文件名，去掉路径部分防止写到上传目录之外
+        decoded_name = os.path.basename(unquote(file_name).replace('\\', '/'))
+        if not decoded_name:
+            raise ValueError('文件名不能为空')
+        # 生成文件ID时保持原始格式
+        return decoded_name, f"{sender_id}_{int(time.time())}_{decoded_name}"
+
+    def init_file(self, file_name, total_chunks, file_type, message_data, file_size=None, chunk_size=None):
         try:
-            # 解码并规范化文件名
-            decoded_name = unquote(file_name)
-            # 生成文件ID时保持原始格式
-            file_id = f"{message_data['sender_id']}_{int(time.time())}_{decoded_name}"
-            
-            self.file_chunks[file_id] = [None] * total_chunks
-            self.file_info[file_id] = {
+            decoded_name, file_id = self.new_file_id(file_name, message_data['sender_id'])
+            chunk_size = int(chunk_size or Config.UPLOAD_CHUNK_SIZE)
+            total_chunks = int(total_chunks)
+            if total_chunks <= 0 or chunk_size <= 0:
+                raise ValueError('分片参数不正确')
+            if total_chunks * chunk_size > Config.UPLOAD_MAX_FILE_SIZE + chunk_size:
+                raise ValueError('文件过大')
+            if file_size is not None:
+                file_size = int(file_size)
+                if file_size > total_chunks * chunk_size or file_size <= (total_chunks - 1) * chunk_size:
+                    raise ValueError('文件大小与分片数不一致')
+
+            os.makedirs(Config.UPLOAD_SPOOL_FOLDER, exist_ok=True)
+            fd = os.open(spool_path(file_id), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if file_size:
+                    self._preallocate(fd, file_size)
+            finally:
+                os.close(fd)
+
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.delete(bitmap_key(file_id))
+            pipe.hset(session_key(file_id), mapping={
                 'name': decoded_name,
-                'type': file_type,
+                'type': file_type or '',
+                'owner': message_data['sender_id'],
                 'total_chunks': total_chunks,
-                'received_chunks': 0,
-                'message_data': message_data
-            }
+                'chunk_size': chunk_size,
+                'file_size': file_size if file_size is not None else '',
+                'received': 0,
+                'message_data': json.dumps(message_data, ensure_ascii=False)
+            })
+            pipe.expire(session_key(file_id), self.session_ttl)
+            pipe.execute()
             return file_id
         except Exception as e:
             print(f"初始化文件失败: {str(e)}")
             return None
 
-    def add_chunk(self, file_id, chunk_index, chunk_data):
+    @staticmethod
+    def _preallocate(fd, size):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            # 不支持 fallocate 的平台/文件系统退化为稀疏文件
+            os.ftruncate(fd, size)
+
+    @staticmethod
+    def get_info(file_id):
+        """读取上传会话元数据，会话不存在时返回 None"""
+        raw = redis_client.hgetall(session_key(unquote(file_id)))
+        if not raw:
+            return None
+        info = {k.decode(): v.decode() for k, v in raw.items()}
+        for field in ('owner', 'total_chunks', 'chunk_size', 'received'):
+            info[field] = int(info[field])
+        info['file_size'] = int(info['file_size']) if info['file_size'] else None
+        info['message_data'] = json.loads(info['message_data'])
+        return info
+
+    def add_chunk(self, file_id, chunk_index, chunk_data, user_id=None):
+        """写入一个分片，返回 (是否由本次补齐全部分片, 接收进度百分比)；失败时进度为 None"""
         try:
             decoded_file_id = unquote(file_id)
-            
-            if decoded_file_id in self.file_chunks:
-                self.file_chunks[decoded_file_id][chunk_index] = chunk_data
-                self.file_info[decoded_file_id]['received_chunks'] += 1
-                
+            info = self.get_info(decoded_file_id)
+
+            if info:
+                if user_id is not None and info['owner'] != user_id:
+                    raise ValueError('无权上传该文件')
+                chunk_index = int(chunk_index)
+                total_chunks = info['total_chunks']
+                if not 0 <= chunk_index < total_chunks:
+                    raise ValueError(f'分片序号越界: {chunk_index}')
+
+                data = chunk_data if isinstance(chunk_data, bytes) else bytes(chunk_data)
+                if len(data) > info['chunk_size']:
+                    raise ValueError(f'分片过大: {len(data)}')
+                if chunk_index < total_chunks - 1 and len(data) != info['chunk_size']:
+                    raise ValueError(f'分片大小不正确: {len(data)}')
+
+                # 已收到的分片不再写入：其内容可能已经计入哈希
+                claim = redis_client.eval(
+                    CLAIM_CHUNK_SCRIPT, 3, session_key(decoded_file_id), bitmap_key(decoded_file_id),
+                    claim_key(decoded_file_id, chunk_index), chunk_index, CHUNK_CLAIM_TTL)
+                if claim is None:
+                    print(f'上传会话已失效: {decoded_file_id}')
+                    return False, None
+                if int(claim[0]):
+                    return False, (int(claim[1]) / total_chunks) * 100
+
+                # 先落盘再置位，位图中的分片一定已经写入临时文件
+                try:
+                    fd = os.open(spool_path(decoded_file_id), os.O_WRONLY)
+                except FileNotFoundError:
+                    # 并发的最后一个分片已完成上传并移走了临时文件，重复分片直接忽略
+                    redis_client.delete(claim_key(decoded_file_id, chunk_index))
+                    return False, None
+                try:
+                    os.pwrite(fd, data, chunk_index * info['chunk_size'])
+                except Exception:
+                    redis_client.delete(claim_key(decoded_file_id, chunk_index))
+                    raise
+                finally:
+                    os.close(fd)
+
+                file_size = ''
+                if chunk_index == total_chunks - 1:
+                    file_size = chunk_index * info['chunk_size'] + len(data)
+                result = redis_client.eval(
+                    ADD_CHUNK_SCRIPT, 3, session_key(decoded_file_id), bitmap_key(decoded_file_id),
+                    claim_key(decoded_file_id, chunk_index), chunk_index, self.session_ttl, file_size)
+                if result is None:
+                    print(f'上传会话已失效: {decoded_file_id}')
+                    return False, None
+                received_chunks, seen = int(result[0]), int(result[1])
+                if not seen:
+                    self._advance_hash(decoded_file_id, info, chunk_index, data)
+
                 # 计算接收进度
-                total_chunks = self.file_info[decoded_file_id]['total_chunks']
-                received_chunks = self.file_info[decoded_file_id]['received_chunks']
                 progress = (received_chunks / total_chunks) * 100
-                
-                # 发送进度更新
-                from extensions import socketio
-                socketio.emit('upload_progress', {
-                    'fileId': file_id,
-                    'progress': progress
-                })
-                
-                return received_chunks == total_chunks
+
+                # 只有补齐最后一个缺失分片的那次调用返回 True，重复分片不会重复触发完成
+                return received_chunks == total_chunks and not seen, progress
 
             else:
                 print(f'未找到文件ID: {decoded_file_id}')
-                return False
+                return False, None
         except Exception as e:
             print(f"添加分片失败: {str(e)}")
-            return False
+            return False, None
 
-    def save_file(self, file_id):
+    def should_report_progress(self, file_id, progress):
+        """进度较上次推送增加 UPLOAD_PROGRESS_STEP 个百分点，或距上次推送超过
+        UPLOAD_PROGRESS_INTERVAL 秒时才推送"""
+        now = time.monotonic()
+        with self._hashers_lock:
+            last = self._progress.get(file_id)
+            if last and progress - last[0] < self.progress_step and now - last[1] < self.progress_interval:
+                return False
+            self._progress[file_id] = (progress, now)
+            return True
+
+    def missing_chunks(self, file_id):
+        """返回 (会话元数据, 缺失的分片序号列表)，会话不存在时返回 (None, None)"""
+        decoded_file_id = unquote(file_id)
+        info = self.get_info(decoded_file_id)
+        if not info:
+            return None, None
+        bitmap = redis_client.get(bitmap_key(decoded_file_id)) or b''
+        missing = []
+        for index in range(info['total_chunks']):
+            # Redis 位图按字节内高位在前编号
+            byte = index >> 3
+            if byte >= len(bitmap) or not bitmap[byte] & (0x80 >> (index & 7)):
+                missing.append(index)
+        return info, missing
+
+    def _advance_hash(self, file_id, info, chunk_index, data):
+        """分片按顺序到达时并入哈希，并把之前乱序到达、已写入临时文件的后续分片一并读入"""
+        with self._hashers_lock:
+            state = self._hashers.get(file_id)
+            if state is None:
+                if chunk_index != 0:
+                    return
+                state = self._hashers[file_id] = {
+                    'sha256': hashlib.sha256(), 'next': 0, 'lock': threading.Lock()}
+
+        with state['lock']:
+            if chunk_index != state['next']:
+                return
+            state['sha256'].update(data)
+            state['next'] += 1
+
+            # 最后一个分片留到完成时处理（此时文件大小才确定）
+            last = info['total_chunks'] - 1
+            if state['next'] >= last:
+                return
+            bitmap = redis_client.get(bitmap_key(file_id)) or b''
+            fd = None
+            try:
+                while state['next'] < last:
+                    index = state['next']
+                    byte = index >> 3
+                    if byte >= len(bitmap) or not bitmap[byte] & (0x80 >> (index & 7)):
+                        break
+                    if fd is None:
+                        fd = os.open(spool_path(file_id), os.O_RDONLY)
+                    size = info['chunk_size']
+                    state['sha256'].update(os.pread(fd, size, index * size))
+                    state['next'] += 1
+            finally:
+                if fd is not None:
+                    os.close(fd)
+
+    def _finish_hash(self, file_id, info):
+        """读入尚未计算的部分，返回完整文件的 SHA-256"""
+        with self._hashers_lock:
+            state = self._hashers.pop(file_id, None)
+        if state is None:
+            state = {'sha256': hashlib.sha256(), 'next': 0, 'lock': threading.Lock()}
+
+        with state['lock']:
+            with open(spool_path(file_id), 'rb') as f:
+                f.seek(state['next'] * info['chunk_size'])
+                while True:
+                    block = f.read(1024 * 1024)
+                    if not block:
+                        break
+                    state['sha256'].update(block)
+            return state['sha256'].hexdigest()
+
+    @staticmethod
+    def find_object(digest, file_size, owner_id):
+        """客户端预先提供哈希时查找已存储的相同内容，大小不一致视为不存在
+
+        只匹配该用户自己上传过的内容：客户端给出哈希并不能证明持有这些字节，
+        否则知道哈希的人就能拿到别人私有文件的下载地址。其他用户的相同内容仍需完整上传，
+        保存时再与已有对象去重，磁盘上只存一份。
+        """
+        if not digest or not SHA256_PATTERN.match(str(digest)):
+            return None
+        if not File.query.filter_by(sha256=digest, owner_id=owner_id).first():
+            return None
+        path = object_path(digest)
         try:
-            if file_id not in self.file_chunks:
+            if os.stat(path).st_size != int(file_size):
                 return None
+        except (OSError, TypeError, ValueError):
+            return None
+        return path
 
-            # file_data = self.file_info[file_id]
-            chunks = self.file_chunks[file_id]
-            
-            if None in chunks:
+    def reuse_object(self, digest, file_size, file_name, file_type, message_data):
+        """本人上传过相同内容时直接新增一条引用，返回 (文件ID, 下载地址)，否则返回 None"""
+        if not digest or not SHA256_PATTERN.match(str(digest)):
+            return None
+        with object_lock(digest):
+            if not self.find_object(digest, file_size, message_data['sender_id']):
                 return None
+            name, file_id = self.new_file_id(file_name, message_data['sender_id'])
+            return file_id, self.register(digest, file_id, name, int(file_size), file_type, message_data)
+
+    @staticmethod
+    def refcount(digest):
+        return File.query.filter_by(sha256=digest).count()
+
+    def release(self, file_id):
+        """删除文件记录，内容没有其他引用时一并删除对象；返回是否删除了记录"""
+        record = File.query.filter_by(file_id=file_id).first()
+        if not record:
+            return False
+        digest = record.sha256
+        with object_lock(digest):
+            db.session.delete(record)
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            if self.refcount(digest) == 0:
+                self._remove_object(digest)
+        return True
+
+    @staticmethod
+    def _remove_object(digest):
+        # 连同后台生成的预览图、封面等派生文件（MEDIA_FOLDER 中以哈希开头）一起删除
+        variants = glob.glob(os.path.join(Config.MEDIA_FOLDER, digest[:2], digest[2:4], f'{digest}_*'))
+        for path in [object_path(digest), *variants]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        logger.info(f'内容对象已无引用，删除: {digest}')
 
-            if not os.path.exists(Config.UPLOAD_FOLDER):
-                os.makedirs(Config.UPLOAD_FOLDER)
+    @staticmethod
+    def register(digest, file_id, name, size, mime_type, message_data):
+        """写入文件记录，返回下载地址"""
+        if not mime_type:
+            mime_type = mimetypes.guess_type(name)[0]
+        conversation = conversation_key(message_data.get('group_id'), message_data['sender_id'],
+                                        message_data.get('receiver_id') or 0)
+        db.session.add(File(
+            file_id=file_id,
+            name=name,
+            sha256=digest,
+            size=size,
+            mime_type=mime_type,
+            owner_id=message_data['sender_id'],
+            conversation=conversation
+        ))
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return f'/uploads/{file_id}'
+
+    def save_file(self, file_id):
+        try:
+            info = self.get_info(file_id)
+            if not info or info['received'] != info['total_chunks']:
+                return None
 
-            file_path = os.path.join(Config.UPLOAD_FOLDER, file_id)
-            with open(file_path, 'wb') as f:
-                for chunk in chunks:
-                    f.write(bytes(chunk))
+            # 截掉预分配多出的部分
+            part_path = spool_path(file_id)
+            fd = os.open(part_path, os.O_WRONLY)
+            try:
+                os.ftruncate(fd, info['file_size'])
+                os.fsync(fd)
+            finally:
+                os.close(fd)
 
-            del self.file_chunks[file_id]
-            # del self.file_info[file_id]
+            digest = self._finish_hash(file_id, info)
+            path = object_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with object_lock(digest):
+                if os.path.exists(path):
+                    # 相同内容已经存储过，直接引用已有对象；更新修改时间，写记录失败时回收也会等过宽限期
+                    print(f'文件内容已存在: {digest}')
+                    os.remove(part_path)
+                    os.utime(path)
+                else:
+                    # 临时文件整体重命名为内容对象（不再与临时文件共享 inode），下载方不会看到写了一半的文件
+                    os.replace(part_path, path)
 
-            return f'/uploads/{file_id}'
+                return self.register(digest, file_id, info['name'], info['file_size'], info['type'],
+                                     info['message_data'])
         except Exception as e:
             print(f"保存文件失败: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    def discard(self, file_id):
+        """上传完成（或放弃）后删除会话和残留的临时文件"""
+        with self._hashers_lock:
+            self._hashers.pop(file_id, None)
+            self._progress.pop(file_id, None)
+        redis_client.delete(session_key(file_id), bitmap_key(file_id))
+        try:
+            os.remove(spool_path(file_id))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self):
+        """删除会话已过期的临时文件，返回删除的数量"""
+        with self._hashers_lock:
+            stale = [file_id for file_id in {*self._hashers, *self._progress}
+                     if not redis_client.exists(session_key(file_id))]
+            for file_id in stale:
+                self._hashers.pop(file_id, None)
+                self._progress.pop(file_id, None)
+
+        folder = Config.UPLOAD_SPOOL_FOLDER
+        if not os.path.isdir(folder):
+            return 0
+        # 刚创建、会话尚未写入 Redis 的文件不删除
+        cutoff = time.time() - 60
+        removed = 0
+        for entry in os.scandir(folder):
+            if not entry.name.endswith('.part'):
+                continue
+            file_id = entry.name[:-len('.part')]
+            try:
+                if entry.stat().st_mtime > cutoff or redis_client.exists(session_key(file_id)):
+                    continue
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                # 其他进程已清理
+                continue
+        return removed
+
+    def collect_objects(self, batch_size=500):
+        """删除没有任何 files 记录引用、且超过宽限期未被引用的内容对象，返回删除的数量"""
+        folder = Config.UPLOAD_OBJECTS_FOLDER
+        if not os.path.isdir(folder):
+            return 0
+        cutoff = time.time() - self.object_grace
+        removed = 0
+        candidates = []
+        for root, _, names in os.walk(folder):
+            for name in names:
+                if not SHA256_PATTERN.match(name):
+                    continue
+                try:
+                    if os.stat(os.path.join(root, name)).st_mtime > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                candidates.append(name)
+                if len(candidates) >= batch_size:
+                    removed += self._collect_batch(candidates)
+                    candidates = []
+        if candidates:
+            removed += self._collect_batch(candidates)
+        return removed
+
+    def _collect_batch(self, digests):
+        referenced = {digest for (digest,) in db.session.query(File.sha256).filter(
+            File.sha256.in_(digests)).distinct()}
+        db.session.rollback()
+        removed = 0
+        for digest in digests:
+            if digest in referenced:
+                continue
+            with object_lock(digest):
+                # 加锁后重新确认：期间可能有相同内容的上传完成
+                try:
+                    if os.stat(object_path(digest)).st_mtime > time.time() - self.object_grace:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if self.refcount(digest) == 0:
+                    self._remove_object(digest)
+                    removed += 1
+                db.session.rollback()
+        return removed
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.info(f'清理过期上传临时文件 {removed} 个')
+            except Exception as e:
+                logger.error(f'清理上传临时文件失败: {str(e)}')
+            try:
+                with self._app.app_context():
+                    removed = self.collect_objects()
+                    db.session.remove()
+                if removed:
+                    logger.info(f'回收无引用的内容对象 {removed} 个')
+            except Exception as e:
+                logger.error(f'回收内容对象失败: {str(e)}')
+
+
+upload_manager = FileUploadManager()
@@ -0,0 +1,107 @@
+import json
+import redis
+from config import Config
+from extensions import redis_client, logger
+
+
+def conversation_key(group_id=0, sender_id=0, receiver_id=0):
+    """群聊按群组ID，私聊按两人ID（小的在前）确定会话"""
+    if group_id:
+        return f'group:{group_id}'
+    low, high = sorted([int(sender_id), int(receiver_id)])
+    return f'dm:{low}:{high}'
+
+
+class HistoryCache:
+    """热门会话最近消息的 Redis 环形缓冲
+
+    每个会话一个定长列表（最新的在前），新消息 LPUSH + LTRIM；
+    只有从数据库完整预热过的会话（存在 ready 标记）才对外提供读取。
+    """
+
+    def __init__(self):
+        self.depth = Config.HISTORY_CACHE_DEPTH
+        self.ttl = Config.HISTORY_CACHE_TTL
+
+    def init_app(self, app):
+        self.depth = app.config.get('HISTORY_CACHE_DEPTH', self.depth)
+        self.ttl = app.config.get('HISTORY_CACHE_TTL', self.ttl)
+
+        from services.chat import ChatService
+        with app.app_context():
+            for group_id in app.config.get('HISTORY_CACHE_WARM_GROUPS', []):
+                try:
+                    rows = ChatService.fetch_history_rows(None, group_id=group_id, limit=self.depth)
+                    self.warm(conversation_key(group_id=group_id), [row.to_dict() for row in rows])
+                except Exception as e:
+                    logger.error(f'预热群组 {group_id} 历史消息缓存失败: {str(e)}')
+
+    @staticmethod
+    def _list_key(conv):
+        return f'history:{conv}'
+
+    @staticmethod
+    def _ready_key(conv):
+        return f'history_ready:{conv}'
+
+    def push(self, message):
+        """写入一条新消息（无论会话是否已预热都写入，预热时会与数据库结果合并）"""
+        conv = conversation_key(message.group_id, message.sender_id, message.receiver_id)
+        key = self._list_key(conv)
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.lpush(key, json.dumps(message.to_dict()))
+            pipe.ltrim(key, 0, self.depth - 1)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            # 缓存只是加速手段，写入失败不影响消息发送
+            logger.error(f'写入历史消息缓存失败: {str(e)}')
+
+    def get_recent(self, conv, limit):
+        """返回最近 limit 条消息（时间正序），未预热或超出缓存深度时返回 None"""
+        if limit > self.depth:
+            return None
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.exists(self._ready_key(conv))
+            pipe.lrange(self._list_key(conv), 0, limit - 1)
+            ready, items = pipe.execute()
+        except Exception as e:
+            logger.error(f'读取历史消息缓存失败，回退到数据库: {str(e)}')
+            return None
+        if not ready:
+            return None
+        messages = [json.loads(item) for item in items]
+        messages.reverse()
+        return messages
+
+    def warm(self, conv, messages):
+        """用数据库查出的最近消息（时间倒序）预热缓存，与预热期间新写入的消息按ID合并"""
+        key = self._list_key(conv)
+        with redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    merged = {message['id']: message for message in messages}
+                    for item in pipe.lrange(key, 0, -1):
+                        message = json.loads(item)
+                        merged[message['id']] = message
+                    latest = sorted(merged.values(), key=lambda m: (m['created_at'], m['id']), reverse=True)[:self.depth]
+
+                    pipe.multi()
+                    pipe.delete(key)
+                    if latest:
+                        pipe.rpush(key, *[json.dumps(message) for message in latest])
+                        pipe.expire(key, self.ttl)
+                    pipe.set(self._ready_key(conv), 1, ex=self.ttl)
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+                except Exception as e:
+                    logger.error(f'预热历史消息缓存失败: {str(e)}')
+                    return
+
+
+history_cache = HistoryCache()
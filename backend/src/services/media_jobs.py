@@ -0,0 +1,109 @@
+"""媒体处理任务，在 MediaProcessor 的子进程中执行
+
+本模块只依赖图像/音视频库，不导入 Flask 和数据库相关模块，子进程启动时不会初始化应用。
+每个任务接收源文件路径和输出路径，返回 {variant: 输出路径}；输出已存在（相同内容处理过）时直接返回。
+"""
+import os
+import signal
+import subprocess
+import time
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise JobTimeout()
+
+
+def _atomic_target(target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    base, ext = os.path.splitext(target)
+    return f'{base}.tmp{ext}'
+
+
+def image_preview(source, target, max_size):
+    from PIL import Image, ImageOps
+    with Image.open(source) as image:
+        # JPEG 解码时直接按目标尺寸降采样，大图只解码需要的分辨率
+        image.draft('RGB', (max_size, max_size))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        tmp = _atomic_target(target)
+        image.save(tmp, 'JPEG', quality=80, optimize=True, progressive=True)
+    os.replace(tmp, target)
+
+
+def video_poster(source, target, max_size):
+    import cv2
+    capture = cv2.VideoCapture(source)
+    try:
+        # 取第 1 秒的画面，太短的视频退回第一帧
+        capture.set(cv2.CAP_PROP_POS_MSEC, 1000)
+        ok, frame = capture.read()
+        if not ok:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = capture.read()
+        if not ok:
+            raise ValueError('无法读取视频帧')
+    finally:
+        capture.release()
+    height, width = frame.shape[:2]
+    scale = min(1.0, max_size / max(height, width))
+    if scale < 1.0:
+        frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    if not ok:
+        raise ValueError('封面编码失败')
+    tmp = _atomic_target(target)
+    with open(tmp, 'wb') as f:
+        f.write(encoded.tobytes())
+    os.replace(tmp, target)
+
+
+def audio_rendition(source, target, bitrate):
+    from pydub import AudioSegment
+    tmp = _atomic_target(target)
+    AudioSegment.from_file(source).export(tmp, format='mp3', bitrate=bitrate)
+    os.replace(tmp, target)
+
+
+def video_rendition(source, target, height, crf, timeout):
+    tmp = _atomic_target(target)
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error', '-i', source,
+        '-vf', f'scale=-2:min({height}\\,ih)',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(crf),
+        '-c:a', 'aac', '-b:a', '96k', '-movflags', '+faststart', tmp
+    ], check=True, timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    os.replace(tmp, target)
+
+
+def run_job(kind, source, targets, options, timeout):
+    """子进程入口：按 kind 生成 targets 中各个输出，超过 timeout 秒抛出 JobTimeout
+
+    返回 {'outputs': {variant: 路径}, 'elapsed': 秒}
+    """
+    started = time.monotonic()
+    # 子进程的主线程中执行，可以用 SIGALRM 限制整个任务的时间
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.alarm(timeout)
+    try:
+        outputs = {}
+        for variant, target in targets.items():
+            if not os.path.exists(target):
+                if kind == 'image':
+                    image_preview(source, target, options['preview_size'])
+                elif variant == 'poster':
+                    video_poster(source, target, options['poster_size'])
+                elif kind == 'audio':
+                    audio_rendition(source, target, options['audio_bitrate'])
+                else:
+                    remaining = max(1, timeout - int(time.monotonic() - started))
+                    video_rendition(source, target, options['video_height'], options['video_crf'], remaining)
+            outputs[variant] = target
+        return {'outputs': outputs, 'elapsed': time.monotonic() - started}
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
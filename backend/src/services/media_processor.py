@@ -0,0 +1,148 @@
+import os
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+from extensions import socketio, logger
+from services.file_manager import object_path
+from services import media_jobs
+
+# 每种媒体生成的衍生文件：variant -> 扩展名
+VARIANTS = {
+    'image': {'preview': 'jpg'},
+    'video': {'poster': 'jpg', 'low': 'mp4'},
+    'audio': {'low': 'mp3'},
+}
+
+
+def media_kind(mime_type):
+    kind = (mime_type or '').split('/', 1)[0]
+    return kind if kind in VARIANTS else None
+
+
+class MediaProcessor:
+    """后台媒体处理
+
+    文件上传完成后提交任务，由进程池生成图片预览、视频封面和低码率音视频，
+    完成后向会话房间推送 media_processed。提交从不阻塞：在途任务达到 MEDIA_QUEUE_MAXSIZE
+    时直接放弃处理（原文件照常可用）。每个任务在子进程内受 MEDIA_JOB_TIMEOUT 限制。
+    """
+
+    def __init__(self):
+        self.workers = Config.MEDIA_WORKERS
+        self.max_pending = Config.MEDIA_QUEUE_MAXSIZE
+        self.timeout = Config.MEDIA_JOB_TIMEOUT
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'timeouts': 0}
+        self._elapsed = {kind: [0, 0.0] for kind in VARIANTS}
+
+    def init_app(self, app):
+        self.workers = app.config.get('MEDIA_WORKERS', self.workers)
+        self.max_pending = app.config.get('MEDIA_QUEUE_MAXSIZE', self.max_pending)
+        self.timeout = app.config.get('MEDIA_JOB_TIMEOUT', self.timeout)
+        os.makedirs(app.config.get('MEDIA_FOLDER', Config.MEDIA_FOLDER), exist_ok=True)
+
+    def _get_executor(self):
+        # 用 spawn 启动子进程：不继承父进程的线程、锁、数据库连接和 socket；
+        # 子进程会以 __mp_main__ 重新导入入口模块（不执行 create_app）
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    @staticmethod
+    def _variant_target(digest, variant, ext):
+        # 衍生文件与原文件一样按内容哈希分两级目录存放，相同内容只处理一次
+        return os.path.join(Config.MEDIA_FOLDER, digest[:2], digest[2:4], f'{digest}_{variant}.{ext}')
+
+    def find_variant(self, digest, mime_type, variant):
+        """返回已生成的衍生文件路径，没有时返回 None"""
+        ext = VARIANTS.get(media_kind(mime_type), {}).get(variant)
+        if not ext:
+            return None
+        path = self._variant_target(digest, variant, ext)
+        return path if os.path.exists(path) else None
+
+    def submit(self, file_id, digest, mime_type, room):
+        """提交处理任务，不是媒体文件或队列已满时返回 False"""
+        kind = media_kind(mime_type)
+        if not kind:
+            return False
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                return False
+            self._pending += 1
+            self._stats['submitted'] += 1
+
+        targets = {variant: self._variant_target(digest, variant, ext)
+                   for variant, ext in VARIANTS[kind].items()}
+        options = {
+            'preview_size': Config.MEDIA_PREVIEW_SIZE,
+            'poster_size': Config.MEDIA_POSTER_SIZE,
+            'audio_bitrate': Config.MEDIA_AUDIO_BITRATE,
+            'video_height': Config.MEDIA_VIDEO_HEIGHT,
+            'video_crf': Config.MEDIA_VIDEO_CRF,
+        }
+        try:
+            future = self._submit_job(kind, object_path(digest), targets, options)
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+                self._stats['failed'] += 1
+            logger.error(f'提交媒体处理任务失败 {file_id}: {str(e)}')
+            return False
+        future.add_done_callback(lambda f: self._on_done(f, kind, file_id, room))
+        return True
+
+    def _submit_job(self, kind, source, targets, options):
+        try:
+            return self._get_executor().submit(media_jobs.run_job, kind, source, targets, options, self.timeout)
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可用，重建后重试一次
+            logger.error('媒体处理进程池已损坏，重新创建')
+            self._executor = None
+            return self._get_executor().submit(media_jobs.run_job, kind, source, targets, options, self.timeout)
+
+    def _on_done(self, future, kind, file_id, room):
+        with self._lock:
+            self._pending -= 1
+        try:
+            result = future.result()
+        except (media_jobs.JobTimeout, subprocess.TimeoutExpired):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            logger.error(f'媒体处理超时: {file_id}')
+            return
+        except Exception as e:
+            with self._lock:
+                self._stats['failed'] += 1
+            logger.error(f'媒体处理失败 {file_id}: {str(e)}')
+            return
+
+        with self._lock:
+            self._stats['completed'] += 1
+            self._elapsed[kind][0] += 1
+            self._elapsed[kind][1] += result['elapsed']
+        socketio.emit('media_processed', {
+            'fileId': file_id,
+            'file_url': f'/uploads/{file_id}',
+            'variants': {variant: f'/uploads/{file_id}?variant={variant}'
+                         for variant in result['outputs']}
+        }, room=room)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                'pending': self._pending,
+                'avg_seconds': {kind: round(total / count, 3) if count else 0
+                                for kind, (count, total) in self._elapsed.items()}
+            }
+
+
+media_processor = MediaProcessor()
@@ -0,0 +1,248 @@
+import atexit
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from extensions import db, redis_client, logger
+from models.message import Message
+
+# 消息ID序列号，所有写入路径共享，保证先分配ID再落库
+MESSAGE_ID_SEQ_KEY = 'message_id_seq'
+
+# 重试后仍写入失败的消息（JSON），下次启动时重新加入写入队列
+MESSAGE_DEAD_LETTER_KEY = 'message_dead_letter'
+
+# 若 Redis 中的序列号落后于数据库最大ID（如 Redis 被清空），将其推进到最大ID
+SEED_SEQ_SCRIPT = '''
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if current < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return redis.call('GET', KEYS[1])
+'''
+
+
+class MessageWriter:
+    """消息批量写入器（write-behind）
+
+    消息在提交时立即分配ID和时间戳并返回，由后台线程按批量大小或时间间隔
+    合并为一次 INSERT + COMMIT 写入 messages 表。
+
+    消息在落库前已经广播，写入失败不能直接丢弃：批量写入失败时按退避间隔重试，仍失败则逐条写入；
+    主键冲突说明 Redis 中的序列号落后于数据库（如 Redis 被清空后重启前已有新消息），此时把序列号
+    推进到数据库最大ID并为该消息换一个ID；其他仍无法写入的消息放入 Redis 死信列表，启动时重新写入。
+    """
+
+    def __init__(self):
+        self.app = None
+        self.queue = None
+        self.batch_size = Config.MESSAGE_BATCH_SIZE
+        self.flush_interval = Config.MESSAGE_FLUSH_INTERVAL
+        self.max_retries = Config.MESSAGE_WRITE_RETRIES
+        self.retry_backoff = Config.MESSAGE_WRITE_RETRY_BACKOFF
+        self._thread = None
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'flushed': 0,
+            'batches': 0,
+            'failed': 0,
+            'retries': 0,
+            'reassigned': 0,
+            'dead_lettered': 0,
+            'max_queue_depth': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': 0.0
+        }
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('MESSAGE_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('MESSAGE_FLUSH_INTERVAL', self.flush_interval)
+        self.max_retries = app.config.get('MESSAGE_WRITE_RETRIES', self.max_retries)
+        self.retry_backoff = app.config.get('MESSAGE_WRITE_RETRY_BACKOFF', self.retry_backoff)
+        self.queue = queue.Queue(maxsize=app.config.get('MESSAGE_QUEUE_MAXSIZE', Config.MESSAGE_QUEUE_MAXSIZE))
+
+        with app.app_context():
+            self._seed_sequence()
+        self._requeue_dead_letters()
+
+        self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+        logger.info(f'消息批量写入器已启动: batch_size={self.batch_size}, flush_interval={self.flush_interval}s')
+
+    def submit(self, message):
+        """为消息分配ID和时间戳并加入写入队列，返回同一个消息对象"""
+        if None in [message.sender_id, message.receiver_id, message.group_id]:
+            raise Exception('Sender ID, Receiver ID, or Group ID is required')
+        if not message.sender_id:
+            raise Exception('Sender ID is required')
+        if message.receiver_id == 0 and message.group_id == 0:
+            raise Exception('Receiver ID or Group ID is required')
+
+        message.id = int(redis_client.incr(MESSAGE_ID_SEQ_KEY))
+        # DATETIME 列只保存到秒，这里保持一致，避免广播与历史记录中的时间不一致
+        message.created_at = datetime.now().replace(microsecond=0)
+        if message.is_read is None:
+            message.is_read = False
+
+        self.queue.put(message.to_row())
+        with self._stats_lock:
+            self._stats['submitted'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self.queue.qsize())
+        return message
+
+    @staticmethod
+    def _seed_sequence():
+        max_id = db.session.query(db.func.max(Message.id)).scalar() or 0
+        redis_client.eval(SEED_SEQ_SCRIPT, 1, MESSAGE_ID_SEQ_KEY, max_id)
+
+    def _requeue_dead_letters(self):
+        """把上次运行中写入失败的消息重新加入写入队列"""
+        requeued = 0
+        while not self.queue.full():
+            raw = redis_client.lpop(MESSAGE_DEAD_LETTER_KEY)
+            if raw is None:
+                break
+            row = json.loads(raw)
+            if row.get('created_at'):
+                row['created_at'] = datetime.fromisoformat(row['created_at'])
+            self.queue.put(row)
+            requeued += 1
+        if requeued:
+            logger.info(f'重新写入死信列表中的消息 {requeued} 条')
+
+    def pending(self):
+        return self.queue.qsize() if self.queue else 0
+
+    def stats(self):
+        with self._stats_lock:
+            return {**self._stats, 'queue_depth': self.pending()}
+
+    def shutdown(self):
+        """停止后台线程，并把队列中剩余的消息全部落库"""
+        if not self._thread or self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._thread.join(timeout=30)
+        remaining = self._drain(block=False)
+        while remaining:
+            self._flush(remaining)
+            remaining = self._drain(block=False)
+        logger.info(f'消息批量写入器已停止: {self.stats()}')
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._drain(block=True)
+            if batch:
+                self._flush(batch)
+
+    def _drain(self, block):
+        batch = []
+        if block:
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                return batch
+
+        # 在批量上限和时间窗口内尽量多取
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, rows):
+        start = time.perf_counter()
+        with self.app.app_context():
+            flushed, failed = self._write(rows)
+
+        with self._stats_lock:
+            self._stats['flushed'] += flushed
+            self._stats['failed'] += failed
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(rows)
+            self._stats['last_flush_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    def _write(self, rows):
+        """返回 (写入数, 失败数)"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                db.session.execute(Message.__table__.insert(), rows)
+                db.session.commit()
+                return len(rows), 0
+            except IntegrityError as e:
+                # 重试也无法解决，逐条找出冲突的消息
+                db.session.rollback()
+                logger.error(f'批量写入消息冲突，改为逐条写入: {str(e)}')
+                break
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f'批量写入消息失败（第 {attempt + 1} 次）: {str(e)}')
+                if attempt < self.max_retries:
+                    with self._stats_lock:
+                        self._stats['retries'] += 1
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+        return self._flush_one_by_one(rows)
+
+    def _flush_one_by_one(self, rows):
+        flushed = failed = 0
+        for row in rows:
+            try:
+                self._insert_row(row)
+                flushed += 1
+            except Exception as e:
+                db.session.rollback()
+                failed += 1
+                logger.error(f'写入消息失败，转入死信列表: id={row.get("id")}, {str(e)}')
+                self._dead_letter(row)
+        return flushed, failed
+
+    def _insert_row(self, row):
+        try:
+            db.session.execute(Message.__table__.insert(), [row])
+            db.session.commit()
+            return
+        except IntegrityError:
+            db.session.rollback()
+            existing = db.session.get(Message, row['id'])
+            if existing is None:
+                # 不是主键冲突（如外键约束），换ID也无法写入
+                raise
+            if (existing.sender_id, existing.created_at, existing.content) == \
+                    (row['sender_id'], row['created_at'], row['content']):
+                # 同一条消息已经写入过（如死信重新写入）
+                return
+
+        # 主键被其他消息占用：序列号落后于数据库，推进后为这条消息换一个ID。
+        # 已广播和缓存的仍是旧ID，客户端刷新历史记录后以数据库为准
+        self._seed_sequence()
+        old_id, row['id'] = row['id'], int(redis_client.incr(MESSAGE_ID_SEQ_KEY))
+        db.session.execute(Message.__table__.insert(), [row])
+        db.session.commit()
+        logger.warning(f'消息ID {old_id} 已被占用，序列号已按数据库最大ID重新推进，改用 {row["id"]}')
+        with self._stats_lock:
+            self._stats['reassigned'] += 1
+
+    def _dead_letter(self, row):
+        try:
+            redis_client.rpush(MESSAGE_DEAD_LETTER_KEY, json.dumps(row, default=str))
+            with self._stats_lock:
+                self._stats['dead_lettered'] += 1
+        except Exception as e:
+            # Redis 也不可用时只能留在日志中
+            logger.error(f'写入死信列表失败: {json.dumps(row, default=str, ensure_ascii=False)}, {str(e)}')
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,179 @@
+import threading
+import time
+from config import Config
+from extensions import db, socketio, redis_client, logger
+from models.friendship import Friendship
+from models.group_member import GroupMember
+
+
+def peers_key(user_id):
+    return f'presence_peers:{user_id}'
+
+
+def version_key(user_id):
+    return f'presence_version:{user_id}'
+
+
+# 为 worker 上每个连接所属用户的可见范围续期，返回续期的连接数
+KEEP_PEERS_SCRIPT = '''
+local sids = redis.call('SMEMBERS', 'worker_sids:' .. ARGV[1])
+for _, sid in ipairs(sids) do
+    local user_id = redis.call('HGET', 'sid_user:' .. sid, 'user_id')
+    if user_id then
+        redis.call('EXPIRE', 'presence_peers:' .. user_id, ARGV[2])
+    end
+end
+return #sids
+'''
+
+
+class PresenceBroadcaster:
+    """合并在线状态变化并按节拍推送增量
+
+    连接/断开只记录状态变化，后台线程每个节拍把这段时间内的变化合并，
+    只发给能看到这些用户的在线好友（以及可选的群成员）的 user_<id> 房间；
+    同一节拍内上线又离线的用户会被抵消。每个接收者有自己递增的版本号，
+    客户端发现版本号不连续时通过 presence_sync 获取自己可见范围内的快照。
+    """
+
+    def __init__(self):
+        self.tick = Config.PRESENCE_TICK
+        self.include_group_peers = Config.PRESENCE_INCLUDE_GROUP_PEERS
+        self.excluded_groups = set(Config.PRESENCE_EXCLUDED_GROUPS)
+        self.peers_ttl = Config.PRESENCE_PEERS_TTL
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        self._stats = {'ticks': 0, 'deltas': 0, 'transitions': 0, 'coalesced': 0}
+
+    def init_app(self, app):
+        self.tick = app.config.get('PRESENCE_TICK', self.tick)
+        self.include_group_peers = app.config.get('PRESENCE_INCLUDE_GROUP_PEERS', self.include_group_peers)
+        self.excluded_groups = set(app.config.get('PRESENCE_EXCLUDED_GROUPS', self.excluded_groups))
+        self.peers_ttl = app.config.get('PRESENCE_PEERS_TTL', self.peers_ttl)
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='presence-broadcaster', daemon=True)
+        self._thread.start()
+
+    def mark_online(self, user_id):
+        self._record(user_id, True)
+
+    def mark_offline(self, user_id):
+        self._record(user_id, False)
+
+    def _record(self, user_id, online):
+        with self._lock:
+            self._stats['transitions'] += 1
+            before = self._pending.get(user_id)
+            if before is None:
+                # 记录节拍开始时的状态，用于判断变化是否被抵消
+                self._pending[user_id] = [not online, online]
+            else:
+                before[1] = online
+
+    def refresh_peers(self, user_id, group_ids):
+        """计算能看到该用户在线状态的用户（好友，及可选的非公共群成员）并写入 Redis"""
+        friendships = Friendship.query.filter(
+            (Friendship.user_id == user_id) | (Friendship.friend_id == user_id),
+            Friendship.status == 'accepted'
+        ).with_entities(Friendship.user_id, Friendship.friend_id).all()
+        peers = {a if b == user_id else b for a, b in friendships}
+
+        scoped_groups = [gid for gid in group_ids if gid not in self.excluded_groups]
+        if self.include_group_peers and scoped_groups:
+            members = db.session.query(GroupMember.user_id).filter(
+                GroupMember.group_id.in_(scoped_groups)).distinct().all()
+            peers.update(member_id for (member_id,) in members)
+        peers.discard(user_id)
+
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(peers_key(user_id))
+        if peers:
+            pipe.sadd(peers_key(user_id), *peers)
+            pipe.expire(peers_key(user_id), self.peers_ttl)
+        pipe.execute()
+        return peers
+
+    def add_peers(self, user_a, user_b):
+        """新建立好友关系后双向加入可见范围"""
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sadd(peers_key(user_a), user_b)
+        pipe.expire(peers_key(user_a), self.peers_ttl)
+        pipe.sadd(peers_key(user_b), user_a)
+        pipe.expire(peers_key(user_b), self.peers_ttl)
+        pipe.execute()
+
+    def keep_peers(self, worker):
+        """延长 worker 上所有在线用户的可见范围的过期时间，由在线状态心跳定期调用；
+        离线用户的可见范围不再续期，PRESENCE_PEERS_TTL 后自动过期"""
+        return redis_client.eval(KEEP_PEERS_SCRIPT, 0, worker, self.peers_ttl)
+
+    @staticmethod
+    def visible_users(user_id):
+        return {int(uid) for uid in redis_client.smembers(peers_key(user_id))}
+
+    def snapshot(self, user_id):
+        """返回 (版本号, 该用户可见的在线用户列表)，两者在同一事务中读取"""
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.get(version_key(user_id))
+        pipe.sinter(peers_key(user_id), 'online_users')
+        version, members = pipe.execute()
+        return int(version or 0), [int(uid) for uid in members]
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'pending': len(self._pending)}
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._stats['ticks'] += 1
+
+        online, offline = [], []
+        for user_id, (initial, final) in pending.items():
+            if initial == final:
+                continue
+            (online if final else offline).append(user_id)
+
+        with self._lock:
+            self._stats['coalesced'] += len(pending) - len(online) - len(offline)
+        if not online and not offline:
+            return None
+
+        # 每个变化的用户只通知其在线的可见者
+        changed = [(uid, True) for uid in online] + [(uid, False) for uid in offline]
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id, _ in changed:
+            pipe.sinter(peers_key(user_id), 'online_users')
+        watchers_per_user = pipe.execute()
+
+        deltas = {}
+        for (user_id, is_online), watchers in zip(changed, watchers_per_user):
+            for watcher in watchers:
+                delta = deltas.setdefault(int(watcher), {'online': [], 'offline': []})
+                delta['online' if is_online else 'offline'].append(user_id)
+        if not deltas:
+            return None
+
+        pipe = redis_client.pipeline(transaction=False)
+        for watcher in deltas:
+            pipe.incr(version_key(watcher))
+        for watcher, version in zip(deltas, pipe.execute()):
+            deltas[watcher]['version'] = int(version)
+            socketio.emit('presence_delta', deltas[watcher], room=f'user_{watcher}')
+
+        with self._lock:
+            self._stats['deltas'] += len(deltas)
+        return deltas
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f'广播在线状态增量失败: {str(e)}')
+
+
+presence = PresenceBroadcaster()
@@ -0,0 +1,138 @@
+from extensions import redis_client, logger
+from services.history_cache import conversation_key
+
+# 会话计数：conv -> 消息总数 / 最新消息ID
+CONV_COUNT_KEY = 'conv_msg_count'
+CONV_LAST_ID_KEY = 'conv_last_id'
+
+# 新消息：会话计数 +1，发送者视为已读到这条消息；私聊会话记入双方的会话集合
+ON_MESSAGE_SCRIPT = '''
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[3], ARGV[1], count)
+redis.call('HSET', KEYS[4], ARGV[1], ARGV[2])
+for i = 5, #KEYS do
+    redis.call('SADD', KEYS[i], ARGV[1])
+end
+return count
+'''
+
+# 标记已读：把用户在该会话的已读水位设置为当前计数和最新消息ID
+MARK_READ_SCRIPT = '''
+local count = redis.call('HGET', KEYS[1], ARGV[1]) or '0'
+local last_id = redis.call('HGET', KEYS[2], ARGV[1]) or '0'
+redis.call('HSET', KEYS[3], ARGV[1], count)
+redis.call('HSET', KEYS[4], ARGV[1], last_id)
+return last_id
+'''
+
+# 未读数：群聊会话由参数传入，私聊会话取自用户的会话集合；没有已读水位的会话从 0 算起
+UNREAD_SCRIPT = '''
+local convs = redis.call('SMEMBERS', KEYS[3])
+for i = 1, #ARGV do
+    table.insert(convs, ARGV[i])
+end
+if #convs == 0 then
+    return {}
+end
+local totals = redis.call('HMGET', KEYS[1], unpack(convs))
+local reads = redis.call('HMGET', KEYS[2], unpack(convs))
+local result = {}
+for i, conv in ipairs(convs) do
+    local total = tonumber(totals[i]) or 0
+    local unread = total - (tonumber(reads[i]) or 0)
+    if unread > 0 then
+        table.insert(result, conv)
+        table.insert(result, unread)
+    end
+end
+return result
+'''
+
+
+class ReadStateManager:
+    """基于已读水位的未读计数
+
+    每个会话维护消息计数和最新消息ID，每个用户在每个会话上记录读到的计数和消息ID，
+    未读数 = 会话计数 - 已读计数。发消息和标记已读都是单次 O(1) 写入，与群成员数量无关。
+
+    状态只保存在 Redis 中，不再读写 messages.is_read。切换前的历史消息需要运行一次
+    tools/backfill_read_state.py 计入会话计数，私聊的已读水位按旧的 is_read 初始化；
+    群聊没有按人的旧记录，已有成员的水位设置在切换时，切换前的群聊历史视为已读。
+    之后加入群聊时由 on_join 把水位设置为加入时的计数，查询未读时不再补设起点，
+    否则离线期间收到的群消息在第一次查询时会被算作已读。
+    Redis 数据丢失后重新运行该脚本即可恢复计数，但之后标记的已读水位无法恢复。
+    """
+
+    @staticmethod
+    def _read_count_key(user_id):
+        return f'read_count:{user_id}'
+
+    @staticmethod
+    def _read_last_id_key(user_id):
+        return f'read_last_id:{user_id}'
+
+    @staticmethod
+    def _dm_convs_key(user_id):
+        return f'user_dm_convs:{user_id}'
+
+    @staticmethod
+    def on_message(message):
+        conv = conversation_key(message.group_id, message.sender_id, message.receiver_id)
+        keys = [
+            CONV_COUNT_KEY,
+            CONV_LAST_ID_KEY,
+            ReadStateManager._read_count_key(message.sender_id),
+            ReadStateManager._read_last_id_key(message.sender_id)
+        ]
+        if not message.group_id:
+            keys += [
+                ReadStateManager._dm_convs_key(message.sender_id),
+                ReadStateManager._dm_convs_key(message.receiver_id)
+            ]
+        try:
+            redis_client.eval(ON_MESSAGE_SCRIPT, len(keys), *keys, conv, message.id)
+        except Exception as e:
+            # 计数失败只影响未读提示，不影响消息发送
+            logger.error(f'更新未读计数失败: {str(e)}')
+
+    @staticmethod
+    def mark_read(user_id, conv):
+        """标记会话已读，返回已读到的消息ID"""
+        last_id = redis_client.eval(
+            MARK_READ_SCRIPT, 4,
+            CONV_COUNT_KEY,
+            CONV_LAST_ID_KEY,
+            ReadStateManager._read_count_key(user_id),
+            ReadStateManager._read_last_id_key(user_id),
+            conv
+        )
+        return int(last_id)
+
+    @staticmethod
+    def on_join(user_id, group_id):
+        """加入群聊：已读水位设置为当前计数，加入前的消息不计为未读"""
+        try:
+            ReadStateManager.mark_read(user_id, conversation_key(group_id=group_id))
+        except Exception as e:
+            logger.error(f'初始化群聊已读水位失败: {str(e)}')
+
+    @staticmethod
+    def get_last_read_id(user_id, conv):
+        last_id = redis_client.hget(ReadStateManager._read_last_id_key(user_id), conv)
+        return int(last_id) if last_id else 0
+
+    @staticmethod
+    def get_unread_counts(user_id, group_ids):
+        """一次往返返回用户所有有未读消息的会话：{conv: unread}"""
+        result = redis_client.eval(
+            UNREAD_SCRIPT, 3,
+            CONV_COUNT_KEY,
+            ReadStateManager._read_count_key(user_id),
+            ReadStateManager._dm_convs_key(user_id),
+            *[conversation_key(group_id=group_id) for group_id in group_ids]
+        )
+        return {
+            (conv.decode() if isinstance(conv, bytes) else conv): int(unread)
+            for conv, unread in zip(result[::2], result[1::2])
+        }
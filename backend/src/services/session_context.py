@@ -0,0 +1,53 @@
+import threading
+from flask import request
+from models.group_member import GroupMember
+
+# 每个 Socket.IO 连接的会话上下文：连接建立时构建一次，事件处理时直接读取，
+# 不再逐个事件查询用户信息，也不再信任客户端传来的 sender_id
+_contexts = {}
+_lock = threading.Lock()
+
+
+def build_session_context(sid, user_id, username, avatar, group_ids):
+    context = {
+        'user_id': user_id,
+        'username': username,
+        'avatar': avatar,
+        'groups': frozenset(group_ids)
+    }
+    with _lock:
+        _contexts[sid] = context
+    return context
+
+
+def get_session_context(sid=None):
+    return _contexts.get(sid or request.sid)
+
+
+def current_session():
+    """返回当前连接的会话上下文，未经认证的连接直接报错"""
+    context = get_session_context()
+    if not context:
+        raise Exception('连接未认证')
+    return context
+
+
+def in_group(context, group_id):
+    """判断会话用户是否为群成员。连接之后才加入或创建的群组不在缓存中，
+    未命中时回退到数据库确认，确认是成员后补入上下文"""
+    if group_id in context['groups']:
+        return True
+    if not GroupMember.query.filter_by(group_id=group_id, user_id=context['user_id']).first():
+        return False
+    with _lock:
+        context['groups'] = context['groups'] | {group_id}
+    return True
+
+
+def remove_session_context(sid):
+    with _lock:
+        return _contexts.pop(sid, None)
+
+
+def session_count():
+    return len(_contexts)
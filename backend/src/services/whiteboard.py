@@ -0,0 +1,584 @@
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from extensions import socketio, redis_client, logger
+
+
+# 白板操作日志：whiteboard_seq:<room> 为递增序号，whiteboard_log:<room> 是以序号为分值的有序集合
+# （成员为 "<序号>:<笔画JSON>"），whiteboard_snapshot:<room> 是哈希 {seq, floor, strokes, base, truncated}：
+# 截至 seq 的笔画，以及日志中保留的最早序号之前的位置 floor（日志覆盖 (floor, 最新序号]）；
+# 笔画超过上限时最早的 truncated 个笔画栅格化进 base（PNG），strokes 只保留其后的笔画；
+# whiteboard_raster:<room> 是哈希 {seq, png}：截至 seq 的全部笔画栅格化后的 PNG
+def seq_key(room):
+    return f'whiteboard_seq:{room}'
+
+
+def log_key(room):
+    return f'whiteboard_log:{room}'
+
+
+def snapshot_key(room):
+    return f'whiteboard_snapshot:{room}'
+
+
+def raster_key(room):
+    return f'whiteboard_raster:{room}'
+
+
+def state_keys(room):
+    return seq_key(room), log_key(room), snapshot_key(room), raster_key(room)
+
+
+def congested_key(room):
+    return f'whiteboard_congested:{room}'
+
+
+def simplify(points, tolerance):
+    """Ramer–Douglas–Peucker 折线简化（迭代实现），points 为 [(x, y)]，保证偏差不超过 tolerance"""
+    count = len(points)
+    if count < 3:
+        return points
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        ax, ay = points[start]
+        bx, by = points[end]
+        dx, dy = bx - ax, by - ay
+        norm = math.hypot(dx, dy)
+        max_distance, index = -1.0, None
+        for i in range(start + 1, end):
+            px, py = points[i]
+            if norm == 0:
+                distance = math.hypot(px - ax, py - ay)
+            else:
+                distance = abs(dy * px - dx * py + bx * ay - by * ax) / norm
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index is not None and max_distance > tolerance:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+# 追加笔画：分配序号并写入日志，返回 {序号, 快照序号}
+APPEND_SCRIPT = '''
+local seq = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], seq, seq .. ':' .. ARGV[1])
+for i = 1, 4 do
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+return {seq, tonumber(redis.call('HGET', KEYS[3], 'seq') or '0')}
+'''
+
+# 清空：分配序号，丢弃日志、栅格快照和快照底图，写入空快照；落后于该序号的客户端都会收到完整（空）状态
+CLEAR_SCRIPT = '''
+local seq = redis.call('INCR', KEYS[1])
+redis.call('DEL', KEYS[2], KEYS[3], KEYS[4])
+redis.call('HSET', KEYS[3], 'seq', seq, 'floor', seq, 'strokes', '[]')
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+return seq
+'''
+
+# 写入快照并裁剪日志，ARGV[6] 为新的底图（空串表示不变）；读取之后快照已变化（并发生成或被清空）时放弃
+COMPACT_SCRIPT = '''
+if (redis.call('HGET', KEYS[2], 'seq') or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[2], 'seq', ARGV[2], 'floor', ARGV[3], 'strokes', ARGV[4], 'truncated', ARGV[7])
+if ARGV[6] ~= '' then
+    redis.call('HSET', KEYS[2], 'base', ARGV[6])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return 1
+'''
+
+# 读取状态：since 不早于 floor 时只返回 since 之后的操作 {最新序号, 1, 操作}；
+# 否则有可用的栅格快照（且允许使用）时返回 {最新序号, 2, PNG, 栅格快照之后的操作}，
+# 没有时返回 {最新序号, 0, 快照笔画, 快照之后的操作, 底图或空串, 底图中的笔画数}
+LOAD_SCRIPT = '''
+local head = tonumber(redis.call('GET', KEYS[1]) or '0')
+local snapshot = redis.call('HMGET', KEYS[3], 'seq', 'floor', 'strokes')
+local floor = tonumber(snapshot[2] or '0')
+local since = tonumber(ARGV[1])
+if since >= floor and since <= head then
+    return {head, 1, redis.call('ZRANGEBYSCORE', KEYS[2], '(' .. since, '+inf')}
+end
+local raster = redis.call('HMGET', KEYS[4], 'seq', 'png')
+if ARGV[2] == '1' and raster[1] and tonumber(raster[1]) >= floor and tonumber(raster[1]) <= head then
+    return {head, 2, raster[2], redis.call('ZRANGEBYSCORE', KEYS[2], '(' .. raster[1], '+inf')}
+end
+local base = redis.call('HMGET', KEYS[3], 'base', 'truncated')
+return {head, 0, snapshot[3] or '[]', redis.call('ZRANGEBYSCORE', KEYS[2], '(' .. (snapshot[1] or '0'), '+inf'),
+        base[1] or '', base[2] or '0'}
+'''
+
+# 栅格化的输入：栅格快照仍被日志覆盖时返回 {1, 栅格序号, PNG, 之后的操作, 栅格序号}（增量绘制），
+# 否则返回 {0, 栅格序号或空串, 快照笔画, 快照之后的操作, 快照序号, 快照底图或空串}（从快照重新绘制）
+RASTER_SOURCE_SCRIPT = '''
+local raster = redis.call('HMGET', KEYS[3], 'seq', 'png')
+local snapshot = redis.call('HMGET', KEYS[2], 'seq', 'floor', 'strokes', 'base')
+if raster[1] and tonumber(raster[1]) >= tonumber(snapshot[2] or '0') then
+    return {1, raster[1], raster[2], redis.call('ZRANGEBYSCORE', KEYS[1], '(' .. raster[1], '+inf'), raster[1], ''}
+end
+local base = snapshot[1] or '0'
+return {0, raster[1] or '', snapshot[3] or '[]', redis.call('ZRANGEBYSCORE', KEYS[1], '(' .. base, '+inf'), base,
+        snapshot[4] or ''}
+'''
+
+# 写入栅格快照；读取之后栅格快照已变化，或白板已被清空（日志不再覆盖该序号）时放弃
+RASTER_SCRIPT = '''
+if (redis.call('HGET', KEYS[1], 'seq') or '') ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[2]) < tonumber(redis.call('HGET', KEYS[2], 'floor') or '0') then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'seq', ARGV[2], 'png', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+'''
+
+
+def _split_op(member):
+    seq, data = member.split(b':', 1)
+    return int(seq), data
+
+
+def _decode_ops(members):
+    return [json.loads(_split_op(member)[1]) for member in members]
+
+
+def compact_stroke(color, width, points):
+    """笔画的紧凑存储格式：颜色、线宽和展平的整数坐标数组 [x0, y0, x1, y1, ...]"""
+    flat = []
+    for x, y in points:
+        flat.append(int(round(x)))
+        flat.append(int(round(y)))
+    return {'c': color, 'w': width, 'p': flat}
+
+
+class StrokeLog:
+    """白板笔画日志
+
+    客户端仍逐点发送 draw 事件，服务端按 (房间, sid) 把采样点归并为笔画：落笔开始一笔，
+    抬笔（stroke_end）、下一次落笔、离开白板或断开连接时结束。结束的笔画经 RDP 简化、
+    坐标取整后以紧凑数组追加到 Redis 中按序号递增的操作日志（多进程共享，重启不丢失）；
+    只有一个点的笔画和完全落在画布之外的笔画画不出任何内容，直接丢弃。
+
+    每追加 WHITEBOARD_SNAPSHOT_EVERY 个操作把日志合并进快照，日志只保留快照之前
+    WHITEBOARD_LOG_RETAIN 个操作，并在后台更新栅格快照。快照中的笔画超过 WHITEBOARD_MAX_STROKES
+    时，最早的笔画画进快照底图（PNG），笔画只保留最近的部分，内容不会丢失。
+    客户端带着最后见到的序号重新加入时，只要该序号仍在日志范围内就只发送缺少的操作，
+    否则发送栅格快照（没有时为底图加笔画快照）加其后的操作；不接收图片（raster=False）的客户端
+    只能拿到笔画，缺少底图中的早期笔画，返回值中的 truncated 给出缺少的笔画数。清空白板写入空快照。
+    """
+
+    def __init__(self):
+        self.tolerance = Config.WHITEBOARD_SIMPLIFY_TOLERANCE
+        self.max_strokes = Config.WHITEBOARD_MAX_STROKES
+        self.max_points = Config.WHITEBOARD_MAX_STROKE_POINTS
+        self.snapshot_every = Config.WHITEBOARD_SNAPSHOT_EVERY
+        self.log_retain = Config.WHITEBOARD_LOG_RETAIN
+        self.ttl = Config.WHITEBOARD_STATE_TTL
+        self.width, self.height = Config.WHITEBOARD_CANVAS_SIZE
+        self._lock = threading.Lock()
+        # (room, sid) -> {'c', 'w', 'points'}，尚未结束的笔画
+        self._open = {}
+        self._stats = {'points': 0, 'strokes': 0, 'stored_points': 0, 'dropped': 0,
+                       'snapshots': 0, 'baked': 0, 'full_loads': 0, 'incremental_loads': 0, 'raster_loads': 0}
+
+    def begin(self, room, sid, x, y, color, width):
+        finished = None
+        with self._lock:
+            previous = self._open.pop((room, sid), None)
+            self._open[(room, sid)] = {'c': color, 'w': width, 'points': [(x, y)]}
+            self._stats['points'] += 1
+        if previous:
+            finished = self._store(room, previous)
+        return finished
+
+    def extend(self, room, sid, x, y, color, width):
+        overflow = None
+        with self._lock:
+            stroke = self._open.get((room, sid))
+            if stroke is None:
+                # 没有收到落笔事件（例如跨进程重连），从这个点开始一笔
+                stroke = self._open[(room, sid)] = {'c': color, 'w': width, 'points': []}
+            stroke['points'].append((x, y))
+            self._stats['points'] += 1
+            if len(stroke['points']) >= self.max_points:
+                # 过长的笔画分段保存，下一段从当前点接续
+                overflow = stroke
+                self._open[(room, sid)] = {'c': color, 'w': width, 'points': [(x, y)]}
+        if overflow:
+            self._store(room, overflow)
+
+    def end(self, room, sid):
+        with self._lock:
+            stroke = self._open.pop((room, sid), None)
+        if stroke:
+            return self._store(room, stroke)
+        return None
+
+    def end_all(self, sid):
+        """连接断开时结束该连接在所有房间中未完成的笔画"""
+        with self._lock:
+            keys = [key for key in self._open if key[1] == sid]
+            strokes = [(room, self._open.pop((room, s))) for room, s in keys]
+        for room, stroke in strokes:
+            self._store(room, stroke)
+
+    def open_strokes(self, room):
+        """本进程中该房间尚未结束的笔画（加入者需要一并绘制）"""
+        with self._lock:
+            return [compact_stroke(s['c'], s['w'], s['points'])
+                    for (r, _), s in self._open.items() if r == room and len(s['points']) > 1]
+
+    def _visible(self, stroke):
+        points = stroke['points']
+        if len(points) < 2:
+            return False
+        # 笔画外接矩形（按线宽外扩）与画布不相交时整笔不可见
+        margin = stroke['w'] / 2
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        return (max(xs) + margin >= 0 and min(xs) - margin <= self.width
+                and max(ys) + margin >= 0 and min(ys) - margin <= self.height)
+
+    def _store(self, room, stroke):
+        points = stroke['points']
+        if not self._visible(stroke):
+            with self._lock:
+                self._stats['dropped'] += 1
+            return None
+        compact = compact_stroke(stroke['c'], stroke['w'], simplify(points, self.tolerance))
+        try:
+            seq, snapshot_seq = redis_client.eval(
+                APPEND_SCRIPT, 4, *state_keys(room), json.dumps(compact, separators=(',', ':')), self.ttl)
+        except Exception as e:
+            logger.error(f'保存白板笔画失败: {str(e)}')
+            return None
+        with self._lock:
+            self._stats['strokes'] += 1
+            self._stats['stored_points'] += len(compact['p']) // 2
+        # 通过绘制批次把序号告诉房间内的客户端，用于断线重连后的增量同步
+        draw_batcher.commit(room, seq)
+        if seq - snapshot_seq >= self.snapshot_every:
+            try:
+                self.compact(room)
+            except Exception as e:
+                logger.error(f'生成白板快照失败: {str(e)}')
+        return seq
+
+    def compact(self, room):
+        """把快照之后的操作合并进快照，并裁剪日志；超出上限的早期笔画画进底图"""
+        snapshot_seq, snapshot, base, truncated = redis_client.hmget(
+            snapshot_key(room), 'seq', 'strokes', 'base', 'truncated')
+        snapshot_seq = int(snapshot_seq or 0)
+        tail = redis_client.zrangebyscore(log_key(room), f'({snapshot_seq}', '+inf', withscores=True)
+        if not tail:
+            return False
+        strokes = json.loads(snapshot or '[]') + _decode_ops(member for member, _ in tail)
+        seq = int(tail[-1][1])
+        floor = max(0, seq - self.log_retain)
+        truncated = int(truncated or 0)
+        new_base = b''
+        if len(strokes) > self.max_strokes:
+            baked, strokes = strokes[:-self.max_strokes], strokes[-self.max_strokes:]
+            new_base = self._bake(base, baked)
+            truncated += len(baked)
+        written = redis_client.eval(
+            COMPACT_SCRIPT, 2, log_key(room), snapshot_key(room), snapshot_seq, seq, floor,
+            json.dumps(strokes, separators=(',', ':')), self.ttl, new_base, truncated)
+        if written:
+            with self._lock:
+                self._stats['snapshots'] += 1
+                self._stats['baked'] += int(bool(new_base))
+            raster_snapshots.schedule(room)
+        return bool(written)
+
+    def _bake(self, base, strokes):
+        """把笔画画到底图上，返回新的底图 PNG"""
+        from services import whiteboard_raster
+
+        canvas = whiteboard_raster.decode(base) if base else whiteboard_raster.blank(self.width, self.height)
+        return whiteboard_raster.encode(whiteboard_raster.rasterize(canvas, strokes))
+
+    def load(self, room, since=None, raster=True):
+        """返回 (最新序号, 是否增量, PNG 或 None, 笔画列表, 缺少的笔画数)；since 为客户端最后见到的序号
+
+        增量时笔画列表只包含 since 之后的操作；否则为完整状态：有栅格快照时是 PNG 加其后的笔画，
+        没有时是快照底图（如有）加其后的笔画。都附带本进程中未结束的笔画。
+        raster 为 False 时不返回 PNG，已画进底图的早期笔画无法发送，缺少的笔画数大于 0。
+        """
+        result = redis_client.eval(LOAD_SCRIPT, 4, *state_keys(room),
+                                   -1 if since is None else since, 1 if raster else 0)
+        head, mode = int(result[0]), int(result[1])
+        image, truncated = None, 0
+        if mode == 1:
+            strokes = _decode_ops(result[2])
+        elif mode == 2:
+            image, strokes = result[2], _decode_ops(result[3])
+        else:
+            strokes = json.loads(result[2]) + _decode_ops(result[3])
+            if raster:
+                image = result[4] or None
+            else:
+                truncated = int(result[5])
+        with self._lock:
+            self._stats[('full_loads', 'incremental_loads', 'raster_loads')[mode]] += 1
+        return head, mode == 1, image, strokes + self.open_strokes(room), truncated
+
+    def clear(self, room):
+        """清空白板，返回清空操作的序号"""
+        with self._lock:
+            for key in [key for key in self._open if key[0] == room]:
+                del self._open[key]
+        return redis_client.eval(CLEAR_SCRIPT, 4, *state_keys(room), self.ttl)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'open': len(self._open)}
+
+
+stroke_log = StrokeLog()
+
+
+class RasterSnapshots:
+    """白板栅格快照
+
+    每次生成笔画快照后在后台线程中更新栅格快照：在上一张 PNG 上只绘制其后的操作，
+    上一张已不被日志覆盖（或还没有）时从笔画快照重新绘制。加入者收到 PNG 加少量新笔画，
+    加入开销不随白板使用时间增长；从快照重新绘制时以快照底图为起点，超出 WHITEBOARD_MAX_STROKES
+    的早期笔画仍在图像中。同一房间同时只排队一次。
+    """
+
+    def __init__(self):
+        self.width, self.height = Config.WHITEBOARD_CANVAS_SIZE
+        self.ttl = Config.WHITEBOARD_STATE_TTL
+        self._executor = ThreadPoolExecutor(max_workers=Config.WHITEBOARD_RASTER_WORKERS,
+                                            thread_name_prefix='whiteboard-raster')
+        # 正在生成的房间 -> 生成期间是否又有新的快照（需要再生成一次）
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {'rendered': 0, 'incremental': 0, 'failed': 0, 'seconds': 0.0}
+
+    def schedule(self, room):
+        with self._lock:
+            if room in self._pending:
+                self._pending[room] = True
+                return
+            self._pending[room] = False
+        self._executor.submit(self._generate, room)
+
+    def _generate(self, room):
+        while True:
+            try:
+                self.render(room)
+            except Exception as e:
+                with self._lock:
+                    self._stats['failed'] += 1
+                logger.error(f'生成白板栅格快照失败 {room}: {str(e)}')
+            with self._lock:
+                if not self._pending.get(room):
+                    self._pending.pop(room, None)
+                    return
+                self._pending[room] = False
+
+    def render(self, room):
+        # 只在后台线程中用到 NumPy / Pillow
+        from services import whiteboard_raster
+
+        started = time.perf_counter()
+        incremental, base_seq, source, members, seq, base = redis_client.eval(
+            RASTER_SOURCE_SCRIPT, 3, log_key(room), snapshot_key(room), raster_key(room))
+        ops = [_split_op(member) for member in members]
+        if incremental:
+            if not ops:
+                return False
+            canvas = whiteboard_raster.decode(source)
+            strokes = []
+        elif base:
+            canvas = whiteboard_raster.decode(base)
+            strokes = json.loads(source)
+        else:
+            canvas = whiteboard_raster.blank(self.width, self.height)
+            strokes = json.loads(source)
+        strokes += [json.loads(data) for _, data in ops]
+        seq = ops[-1][0] if ops else int(seq)
+        if not (strokes or base) or not seq:
+            return False
+
+        whiteboard_raster.rasterize(canvas, strokes)
+        written = redis_client.eval(
+            RASTER_SCRIPT, 2, raster_key(room), snapshot_key(room),
+            base_seq, seq, whiteboard_raster.encode(canvas), self.ttl)
+        with self._lock:
+            self._stats['rendered'] += 1
+            self._stats['incremental'] += int(bool(incremental))
+            self._stats['seconds'] += time.perf_counter() - started
+        return bool(written)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'pending': len(self._pending)}
+
+
+raster_snapshots = RasterSnapshots()
+
+
+class DrawBatcher:
+    """按节拍合并白板绘制事件
+
+    draw 事件只把点记入所在房间的缓冲区，后台线程每 WHITEBOARD_TICK 秒为每个有新点的房间
+    发送一个 draw_batch：{room, t, strokes: [{c, w, p}]}，格式与笔画日志相同。延续上一节拍的线段
+    以上一个点开头，客户端可以独立绘制每一段，多人同时绘制时互不干扰。本节拍内有笔画写入日志时，
+    批次附带 seq（已写入的最大序号），客户端据此记录最后见到的序号。
+
+    背压：客户端定期用 draw_ack 回报已绘制的最新批次时间 t，落后超过 WHITEBOARD_MAX_LAG 秒的
+    连接记入 whiteboard_congested:<room>（Redis，多进程共享）并暂停推送，同时向它发送
+    whiteboard_paused；该事件排在积压的批次之后，客户端收到时说明积压已消化，随即请求完整状态恢复。
+    """
+
+    def __init__(self):
+        self.tick = Config.WHITEBOARD_TICK
+        self.max_lag = Config.WHITEBOARD_MAX_LAG
+        self._lock = threading.Lock()
+        # room -> [(sid, segment)]，segment 为 {'c', 'w', 'p'}
+        self._pending = {}
+        # (room, sid) -> 上一个点 (x, y, color, width)
+        self._last = {}
+        # room -> 本节拍内写入日志的最大序号
+        self._seq = {}
+        # room -> (过期时间, 暂停推送的 sid 列表)
+        self._congested = {}
+        self._thread = None
+        self._stats = {'points': 0, 'batches': 0, 'paused': 0, 'resumed': 0}
+
+    def init_app(self, app):
+        self.tick = app.config.get('WHITEBOARD_TICK', self.tick)
+        self.max_lag = app.config.get('WHITEBOARD_MAX_LAG', self.max_lag)
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='whiteboard-batcher', daemon=True)
+        self._thread.start()
+
+    def add(self, room, sid, x, y, color, width, drawing):
+        with self._lock:
+            self._stats['points'] += 1
+            segments = self._pending.setdefault(room, [])
+            last = self._last.get((room, sid))
+            self._last[(room, sid)] = (x, y, color, width)
+            # 同一连接在本节拍内的最后一段，颜色和线宽不变时继续追加
+            current = None
+            for owner, segment in reversed(segments):
+                if owner == sid:
+                    current = segment
+                    break
+            if drawing and current and current['c'] == color and current['w'] == width:
+                current['p'].extend((x, y))
+                return
+            points = [x, y]
+            if drawing and last:
+                points = [last[0], last[1], x, y]
+            segments.append((sid, {'c': color, 'w': width, 'p': points}))
+
+    def commit(self, room, seq):
+        with self._lock:
+            self._seq[room] = max(self._seq.get(room, 0), seq)
+
+    def forget(self, room, sid):
+        with self._lock:
+            self._last.pop((room, sid), None)
+
+    def forget_sid(self, sid):
+        with self._lock:
+            for key in [key for key in self._last if key[1] == sid]:
+                del self._last[key]
+
+    def clear(self, room):
+        with self._lock:
+            self._pending.pop(room, None)
+            self._seq.pop(room, None)
+            for key in [key for key in self._last if key[0] == room]:
+                del self._last[key]
+
+    def report_ack(self, room, sid, sent_at):
+        """处理 draw_ack，落后过多时暂停向该连接推送，返回是否暂停"""
+        lag = time.time() - sent_at / 1000
+        if lag <= self.max_lag:
+            return False
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sadd(congested_key(room), sid)
+        pipe.expire(congested_key(room), Config.WHITEBOARD_STATE_TTL)
+        added, _ = pipe.execute()
+        if not added:
+            return False
+        with self._lock:
+            self._congested.pop(room, None)
+            self._stats['paused'] += 1
+        logger.info(f'白板连接 {sid} 落后 {lag:.1f} 秒，暂停推送: {room}')
+        socketio.emit('whiteboard_paused', {'room': room}, to=sid)
+        return True
+
+    def resume(self, room, sid):
+        if redis_client.srem(congested_key(room), sid):
+            with self._lock:
+                self._congested.pop(room, None)
+                self._stats['resumed'] += 1
+
+    def _skipped(self, room, now):
+        # 暂停名单最多缓存一秒，避免每个节拍都访问 Redis
+        cached = self._congested.get(room)
+        if cached and cached[0] > now:
+            return cached[1]
+        sids = [sid.decode() for sid in redis_client.smembers(congested_key(room))]
+        self._congested[room] = (now + 1.0, sids)
+        return sids
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            committed, self._seq = self._seq, {}
+        if not pending and not committed:
+            return 0
+
+        now = time.time()
+        sent = 0
+        for room in set(pending) | set(committed):
+            # 只有落笔点的段画不出内容，它会作为下一段的起点发送
+            strokes = [segment for _, segment in pending.get(room, []) if len(segment['p']) >= 4]
+            if not strokes and room not in committed:
+                continue
+            batch = {'room': room, 't': int(now * 1000), 'strokes': strokes}
+            if room in committed:
+                batch['seq'] = committed[room]
+            skipped = self._skipped(room, now)
+            socketio.emit('draw_batch', batch, room=room, skip_sid=skipped or None)
+            sent += 1
+        with self._lock:
+            self._stats['batches'] += sent
+        return sent
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'rooms': len(self._pending)}
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f'发送白板绘制批次失败: {str(e)}')
+
+
+draw_batcher = DrawBatcher()
@@ -0,0 +1,101 @@
+"""白板笔画栅格化
+
+把 {c, w, p} 格式的笔画画到 RGBA 画布（NumPy 数组）上并编码为 PNG，供加入者直接显示。
+只依赖 NumPy 和 Pillow：线段按 1 像素间隔向量化采样，每个采样点盖一个直径为线宽的圆点
+（与 canvas 的 lineCap='round' 一致），后画的笔画覆盖先画的；不做抗锯齿。
+"""
+import io
+import numpy as np
+from PIL import Image
+
+# 每批栅格化的笔画数，限制中间数组的大小
+CHUNK_STROKES = 500
+
+
+def parse_color(color):
+    """'#rgb' / '#rrggbb' -> (r, g, b, 255)，无法识别时为黑色"""
+    if not isinstance(color, str):
+        return 0, 0, 0, 255
+    value = color.lstrip('#')
+    if len(value) == 3:
+        value = ''.join(ch * 2 for ch in value)
+    try:
+        return int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16), 255
+    except ValueError:
+        return 0, 0, 0, 255
+
+
+def blank(width, height):
+    return np.zeros((height, width, 4), dtype=np.uint8)
+
+
+def decode(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return np.array(image.convert('RGBA'))
+
+
+def encode(canvas):
+    buffer = io.BytesIO()
+    Image.fromarray(canvas, 'RGBA').save(buffer, 'PNG', compress_level=6)
+    return buffer.getvalue()
+
+
+def _samples(strokes):
+    """返回 (x, y, 所属笔画序号)：沿每条线段以不超过 1 像素的间隔采样"""
+    lengths = np.array([len(stroke['p']) // 2 for stroke in strokes])
+    coords = np.concatenate([np.asarray(stroke['p'][:count * 2], dtype=np.float32)
+                             for stroke, count in zip(strokes, lengths)]).reshape(-1, 2)
+    owner = np.repeat(np.arange(len(strokes)), lengths)
+
+    # 相邻两点属于同一笔画时构成一条线段
+    same = owner[:-1] == owner[1:]
+    start, delta, segment_owner = coords[:-1][same], (coords[1:] - coords[:-1])[same], owner[:-1][same]
+    steps = np.ceil(np.abs(delta).max(axis=1)).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(steps)), steps)
+    offsets = np.cumsum(steps) - steps
+    t = (np.arange(steps.sum()) - offsets[segment]) / np.maximum(steps - 1, 1)[segment]
+    points = start[segment] + delta[segment] * t[:, None]
+    return points[:, 0], points[:, 1], segment_owner[segment]
+
+
+def _stamp(width, height, xs, ys, radius):
+    """每个采样点盖一个半径为 radius 的圆点，返回 (像素下标, 采样点下标)"""
+    reach = max(1, int(np.ceil(radius)))
+    base_x, base_y = np.floor(xs).astype(np.int64), np.floor(ys).astype(np.int64)
+    pixels, sources = [], []
+    index = np.arange(len(xs))
+    for oy in range(-reach, reach + 1):
+        for ox in range(-reach, reach + 1):
+            px, py = base_x + ox, base_y + oy
+            # 像素中心落在圆内；线宽小于 1 像素时至少画出采样点所在的像素
+            inside = (px + 0.5 - xs) ** 2 + (py + 0.5 - ys) ** 2 <= radius ** 2
+            if ox == 0 and oy == 0:
+                inside = np.ones(len(xs), dtype=bool)
+            inside &= (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            pixels.append(py[inside] * width + px[inside])
+            sources.append(index[inside])
+    return np.concatenate(pixels), np.concatenate(sources)
+
+
+def rasterize(canvas, strokes):
+    """按顺序把笔画画到 canvas（H x W x 4，uint8）上，原地修改"""
+    height, width = canvas.shape[:2]
+    flat = canvas.reshape(-1, 4)
+    winner = np.empty(height * width, dtype=np.int32)
+    for begin in range(0, len(strokes), CHUNK_STROKES):
+        chunk = [stroke for stroke in strokes[begin:begin + CHUNK_STROKES] if len(stroke['p']) >= 4]
+        if not chunk:
+            continue
+        xs, ys, owner = _samples(chunk)
+        colors = np.array([parse_color(stroke['c']) for stroke in chunk], dtype=np.uint8)
+        radii = np.array([max(float(stroke['w']), 1.0) / 2 for stroke in chunk])
+
+        # 同一像素被多次覆盖时取最后画的笔画（序号最大）
+        winner.fill(-1)
+        for radius in np.unique(radii):
+            selected = np.nonzero(radii[owner] == radius)[0]
+            pixels, source = _stamp(width, height, xs[selected], ys[selected], radius)
+            np.maximum.at(winner, pixels, owner[selected][source].astype(np.int32))
+        touched = np.nonzero(winner >= 0)[0]
+        flat[touched] = colors[winner[touched]]
+    return canvas
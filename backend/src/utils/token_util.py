@@ -1,4 +1,7 @@
 import jwt
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from config import Config
 
 def decode_jwt_token(token):
@@ -12,4 +15,14 @@ def decode_jwt_token(token):
     except jwt.ExpiredSignatureError:
         raise Exception("Token已过期")
     except jwt.InvalidTokenError:
-        raise Exception("无效的Token")
\ No newline at end of file
+        raise Exception("无效的Token")
+
+def admin_required(fn):
+    """需要登录且用户ID在 Config.ADMIN_USER_IDS 中"""
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if int(get_jwt_identity()) not in Config.ADMIN_USER_IDS:
+            return jsonify({'error': '需要管理员权限'}), 403
+        return fn(*args, **kwargs)
+    return wrapper
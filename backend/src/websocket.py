@@ -1,27 +1,138 @@
 from flask_socketio import emit, join_room, leave_room, rooms
 from extensions import db, socketio, redis_client
 from services.call_service import CallService  # 添加导入
+from services.presence import presence, peers_key
+from services.session_context import build_session_context, get_session_context, remove_session_context
+from services.whiteboard import stroke_log, draw_batcher
+from redis.exceptions import ResponseError
 from flask import request, current_app
 from models.group_member import GroupMember
 from models.user import User
 from flask_jwt_extended import decode_token, verify_jwt_in_request, get_jwt_identity
 
-import jwt
+import jwt, json, os, time, uuid, atexit, threading
+import socket as socket_module
 from config import Config
 
 call_service = CallService()
 
+# 建立会话：记录 sid -> 用户及会话元数据，返回 1 表示该用户由离线变为在线
+CONNECT_SCRIPT = '''
+local sid, user_id, worker = ARGV[1], ARGV[2], ARGV[3]
+redis.call('HSET', 'sid_user:' .. sid, 'user_id', user_id, 'worker', worker, 'connected_at', ARGV[4], 'rooms', ARGV[5])
+redis.call('SADD', 'user_sids:' .. user_id, sid)
+redis.call('SET', 'user_sid:' .. user_id, sid)
+redis.call('SADD', 'worker_sids:' .. worker, sid)
+return redis.call('SADD', 'online_users', user_id)
+'''
+
+# 断开会话：通过 sid 反查用户并清理，返回 {user_id, 是否变为离线}，sid 不存在时返回 nil
+DISCONNECT_SCRIPT = '''
+local sid = ARGV[1]
+local meta = redis.call('HMGET', 'sid_user:' .. sid, 'user_id', 'worker')
+local user_id, worker = meta[1], meta[2]
+if not user_id then
+    return nil
+end
+redis.call('DEL', 'sid_user:' .. sid)
+if worker then
+    redis.call('SREM', 'worker_sids:' .. worker, sid)
+end
+redis.call('SREM', 'user_sids:' .. user_id, sid)
+if redis.call('SCARD', 'user_sids:' .. user_id) == 0 then
+    redis.call('DEL', 'user_sids:' .. user_id, 'user_sid:' .. user_id)
+    redis.call('SREM', 'online_users', user_id)
+    return {user_id, 1}
+end
+if redis.call('GET', 'user_sid:' .. user_id) == sid then
+    redis.call('SET', 'user_sid:' .. user_id, redis.call('SRANDMEMBER', 'user_sids:' .. user_id))
+end
+return {user_id, 0}
+'''
+
 class OnlineUserManager:
+    """在线用户管理
+
+    除 online_users 集合外，维护 sid -> 用户的反向索引（sid_user:<sid>，含所在房间、连接时间等元数据）
+    和每个用户的 sid 集合，断开连接时一次 Lua 调用即可完成清理。
+    每个进程有唯一的 worker ID 并定期写心跳，进程崩溃后残留的 sid 由其他进程回收。
+    """
+    worker_id = f'{socket_module.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+    _heartbeat_thread = None
+    _smismember_supported = True
+
     @staticmethod
-    def add_online_user(user_id: int, sid: str):
-        redis_client.sadd('online_users', user_id)
-        redis_client.set(f'user_sid:{user_id}', sid)
-    
+    def add_session(user_id: int, sid: str, joined_rooms: list) -> bool:
+        """登记连接，返回该用户是否刚刚上线（此前没有其他连接）"""
+        became_online = redis_client.eval(
+            CONNECT_SCRIPT, 0,
+            sid, user_id, OnlineUserManager.worker_id, int(time.time()), json.dumps(joined_rooms)
+        )
+        return bool(became_online)
+
     @staticmethod
-    def remove_online_user(user_id: int):
-        redis_client.srem('online_users', user_id)
-        redis_client.delete(f'user_sid:{user_id}')
-    
+    def remove_session(sid: str):
+        """清理连接，返回 (user_id, 是否变为离线)；未登记的 sid 返回 None"""
+        result = redis_client.eval(DISCONNECT_SCRIPT, 0, sid)
+        if not result:
+            return None
+        return int(result[0]), bool(result[1])
+
+    @staticmethod
+    def get_session(sid: str):
+        meta = redis_client.hgetall(f'sid_user:{sid}')
+        if not meta:
+            return None
+        meta = {k.decode(): v.decode() for k, v in meta.items()}
+        return {
+            'user_id': int(meta['user_id']),
+            'worker': meta.get('worker'),
+            'connected_at': int(meta.get('connected_at', 0)),
+            'rooms': json.loads(meta.get('rooms', '[]'))
+        }
+
+    @staticmethod
+    def get_user_id(sid: str):
+        user_id = redis_client.hget(f'sid_user:{sid}', 'user_id')
+        return int(user_id) if user_id else None
+
+    @staticmethod
+    def get_visible_status(viewer_id, user_ids):
+        """批量查询 viewer 可见范围内用户的在线状态，可见性和在线状态在同一次往返中查出"""
+        user_ids = list(dict.fromkeys(int(uid) for uid in user_ids))[:Config.PRESENCE_BATCH_LIMIT]
+        if not user_ids:
+            return {}
+        pipe = redis_client.pipeline(transaction=False)
+        OnlineUserManager._pipe_membership(pipe, peers_key(viewer_id), user_ids)
+        OnlineUserManager._pipe_membership(pipe, 'online_users', user_ids)
+        results = pipe.execute()
+        if OnlineUserManager._smismember_supported:
+            visible, online = results
+        else:
+            visible, online = results[:len(user_ids)], results[len(user_ids):]
+        return {
+            uid: bool(is_online)
+            for uid, is_visible, is_online in zip(user_ids, visible, online)
+            if is_visible or uid == viewer_id
+        }
+
+    @staticmethod
+    def _pipe_membership(pipe, key, members):
+        # Redis 6.2+ 用 SMISMEMBER，一条命令查完；旧版本退回到流水线中的逐个 SISMEMBER
+        if OnlineUserManager._smismember_supported:
+            pipe.smismember(key, members)
+        else:
+            for member in members:
+                pipe.sismember(key, member)
+
+    @staticmethod
+    def detect_smismember():
+        try:
+            redis_client.smismember('online_users', [0])
+        except ResponseError:
+            OnlineUserManager._smismember_supported = False
+            print("Redis 不支持 SMISMEMBER，批量在线状态查询退回到 SISMEMBER 流水线")
+
     @staticmethod
     def get_online_users():
         return [int(uid) for uid in redis_client.smembers('online_users')]
@@ -30,7 +141,80 @@ class OnlineUserManager:
     def get_user_sid(user_id: int):
         return redis_client.get(f'user_sid:{user_id}')
 
-user_rooms = {}
+    @staticmethod
+    def init_app(app):
+        if OnlineUserManager._heartbeat_thread:
+            return
+        OnlineUserManager.detect_smismember()
+        interval = app.config.get('WORKER_HEARTBEAT_INTERVAL', Config.WORKER_HEARTBEAT_INTERVAL)
+        OnlineUserManager._heartbeat(interval)
+        OnlineUserManager.reap_dead_workers(app)
+        OnlineUserManager._heartbeat_thread = threading.Thread(
+            target=OnlineUserManager._heartbeat_loop, args=(app, interval), name='online-heartbeat', daemon=True)
+        OnlineUserManager._heartbeat_thread.start()
+        atexit.register(OnlineUserManager._release_worker, app)
+
+    @staticmethod
+    def _heartbeat(interval):
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sadd('workers', OnlineUserManager.worker_id)
+        pipe.set(f'worker_alive:{OnlineUserManager.worker_id}', 1, ex=interval * 3)
+        pipe.execute()
+
+    @staticmethod
+    def _heartbeat_loop(app, interval):
+        # 可见范围的续期不必每次心跳都做，每 PRESENCE_PEERS_TTL 的四分之一做一次
+        kept_at = time.monotonic()
+        while True:
+            time.sleep(interval)
+            try:
+                OnlineUserManager._heartbeat(interval)
+                OnlineUserManager.reap_dead_workers(app)
+                if time.monotonic() - kept_at >= presence.peers_ttl / 4:
+                    presence.keep_peers(OnlineUserManager.worker_id)
+                    kept_at = time.monotonic()
+            except Exception as e:
+                print(f"在线状态心跳失败: {str(e)}")
+
+    @staticmethod
+    def reap_dead_workers(app):
+        """回收心跳已过期的进程遗留的 sid"""
+        for worker in redis_client.smembers('workers'):
+            worker = worker.decode()
+            if worker == OnlineUserManager.worker_id or redis_client.exists(f'worker_alive:{worker}'):
+                continue
+            OnlineUserManager._reap_worker(app, worker)
+
+    @staticmethod
+    def _reap_worker(app, worker):
+        sids = redis_client.smembers(f'worker_sids:{worker}')
+        for sid in sids:
+            result = OnlineUserManager.remove_session(sid.decode())
+            if result and result[1]:
+                with app.app_context():
+                    mark_user_offline(result[0])
+        redis_client.delete(f'worker_sids:{worker}')
+        redis_client.srem('workers', worker)
+        if sids:
+            print(f"已回收进程 {worker} 遗留的 {len(sids)} 个连接")
+
+    @staticmethod
+    def _release_worker(app):
+        try:
+            OnlineUserManager._reap_worker(app, OnlineUserManager.worker_id)
+            redis_client.delete(f'worker_alive:{OnlineUserManager.worker_id}')
+        except Exception as e:
+            print(f"清理本进程连接失败: {str(e)}")
+
+
+def mark_user_offline(user_id):
+    """用户最后一个连接断开后：更新数据库状态并广播离线"""
+    user = User.query.get(user_id)
+    if user:
+        user.status = 'offline'
+        db.session.commit()
+
+    presence.mark_offline(user_id)
 
 @socketio.on('connect')
 def handle_connect(auth):
@@ -46,15 +230,17 @@ def handle_connect(auth):
         )
         user_id = decoded_token.get('user_id')
         
-        user = User.query.get(user_id)
-        if user:
-            user.status = 'online'
-            db.session.commit()
-            db.session.refresh(user)  # 刷新用户对象
-        
         if user_id == None:
             raise Exception('Token中未包含用户ID')
         
+        # 一次查询取出用户信息及所在群组，构建本连接的会话上下文
+        rows = db.session.query(User.username, User.avatar, GroupMember.group_id).outerjoin(
+            GroupMember, GroupMember.user_id == User.id
+        ).filter(User.id == user_id).all()
+        username, avatar = (rows[0][0], rows[0][1]) if rows else (None, None)
+        group_ids = [group_id for _, _, group_id in rows if group_id is not None]
+        build_session_context(request.sid, user_id, username, avatar, group_ids)
+        
         current_rooms = rooms()
         
         # 加入私人房间（如果未加入）
@@ -64,10 +250,9 @@ def handle_connect(auth):
             print(f"用户 {user_id} 加入私人房间: {private_room}")
         
         # 加入用户所在的群组（如果未加入）
-        user_groups = GroupMember.query.filter_by(user_id=user_id).all()
         group_rooms = []
-        for group in user_groups:
-            room_id = f'group_{group.group_id}'
+        for group_id in group_ids:
+            room_id = f'group_{group_id}'
             if room_id not in current_rooms:
                 join_room(room_id)
                 print(f"用户 {user_id} 加入群组房间: {room_id}")
@@ -75,84 +260,88 @@ def handle_connect(auth):
 
         print(f"{user_id} 加入的房间: {rooms()}")   
         
-        # 更新用户房间记录
-        user_rooms[user_id] = {
-            'private': private_room,
-            'groups': group_rooms
-        }
+        # 计算在线状态的可见范围（好友及群成员），状态变化只推送给他们
+        presence.refresh_peers(user_id, group_ids)
         
-        # 添加到在线用户管理
-        OnlineUserManager.add_online_user(user_id, request.sid)
+        # 登记连接（sid 反向索引及房间等元数据）
+        became_online = OnlineUserManager.add_session(user_id, request.sid, [private_room] + group_rooms)
         
-        online_users = OnlineUserManager.get_online_users()
-        emit('online_users', {'users': online_users}, broadcast=True)
-        # 广播该用户上线消息
-        emit('user_online', {'user_id': user_id}, broadcast=True)
+        # 上线事件合并到下一个节拍的增量广播中；客户端需要完整列表时自行发送 presence_sync
+        if became_online:
+            User.query.filter_by(id=user_id).update({'status': 'online'})
+            db.session.commit()
+            presence.mark_online(user_id)
         
         return True
         
     except Exception as e:
         print(f"连接错误: {str(e)}")
+        remove_session_context(request.sid)
         return False
 
 @socketio.on('disconnect')
 def handle_disconnect():
     try:
-        # 通过 request.sid 查找对应的用户 ID
-        for user_id in redis_client.scan_iter("user_sid:*"):
-            user_id_key = user_id.decode('utf-8')
-            sid = redis_client.get(user_id_key)
-            if sid and sid.decode('utf-8') == request.sid:
-                user_id = int(user_id_key.split(':')[1])
-                
-                # 更新用户状态
-                user = User.query.get(user_id)
-                if user:
-                    user.status = 'offline'
-                    db.session.commit()
-                
-                # 清理 Redis 中的数据
-                OnlineUserManager.remove_online_user(user_id)
-                
-                # 清理房间
-                if user_id in user_rooms:
-                    room_list = [user_rooms[user_id]['private']] + user_rooms[user_id]['groups']
-                    for room in room_list:
-                        leave_room(room)
-                    del user_rooms[user_id]
-                
-                # 广播用户离线消息
-                online_users = OnlineUserManager.get_online_users()
-                emit('online_users', {'users': online_users}, broadcast=True)
-                emit('user_offline', {'user_id': user_id}, broadcast=True)
-                break
+        # 通过 sid 反向索引直接找到用户，房间由 Socket.IO 在断开时自动清理
+        remove_session_context(request.sid)
+        # 保存该连接在白板上尚未结束的笔画
+        stroke_log.end_all(request.sid)
+        draw_batcher.forget_sid(request.sid)
+        result = OnlineUserManager.remove_session(request.sid)
+        if not result:
+            return
+
+        user_id, became_offline = result
+        if became_offline:
+            mark_user_offline(user_id)
 
     except Exception as e:
         print(f"断开连接错误: {str(e)}")
 
 
+@socketio.on('presence_sync')
+def handle_presence_sync(data):
+    try:
+        context = get_session_context()
+        if not context:
+            return
+        user_id = context['user_id']
+        client_version = (data or {}).get('version')
+        version, online_users = presence.snapshot(user_id)
+        if client_version == version:
+            emit('presence_synced', {'version': version})
+        else:
+            emit('online_users', {'users': online_users, 'version': version})
+    except Exception as e:
+        print(f"同步在线状态错误: {str(e)}")
+
 @socketio.on('get_online_status')
 def handle_get_online_status(data):
     try:
-        user_ids = data.get('user_ids', [])
-        # 从数据库获取用户状态
-        users = User.query.filter(User.id.in_(user_ids)).all()
-        online_status = {
-            user.id: user.status == 'online' or user.id in OnlineUserManager.get_online_users()
-            for user in users
-        }
+        context = get_session_context()
+        if not context:
+            return
+        user_id = context['user_id']
+        # 只回答调用者可见范围内（好友、群成员及自己）的用户，不访问数据库
+        online_status = OnlineUserManager.get_visible_status(user_id, data.get('user_ids', []))
         emit('online_status_update', online_status)
     except Exception as e:
         print(f"获取在线状态错误: {str(e)}")
 
+def _relay_own_presence(event):
+    # 只允许转发调用者自己的状态，并且只发给其可见范围内的用户
+    context = get_session_context()
+    if not context:
+        return
+    user_id = context['user_id']
+    peers = presence.visible_users(user_id)
+    if peers:
+        emit(event, user_id, room=[f'user_{peer}' for peer in peers])
+
 @socketio.on('user_online')
 def handle_user_online(data):
-    user_id = data.get('user_id')
-    if user_id:
-        emit('user_online', user_id, broadcast=True)
+    _relay_own_presence('user_online')
 
 @socketio.on('user_offline')
 def handle_user_offline(data):
-    user_id = data.get('user_id')
-    if user_id:
-        emit('user_offline', user_id, broadcast=True)
\ No newline at end of file
+    _relay_own_presence('user_offline')
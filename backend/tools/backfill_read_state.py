@@ -0,0 +1,195 @@
+"""把上线基于已读水位的未读计数之前的历史消息补进 Redis
+
+未读数 = 会话消息计数 - 用户已读计数，计数只在发消息时累加（services/read_state.py），
+切换之前已在 messages 表中的消息没有计入，旧的 messages.is_read 也不再使用。本脚本按会话：
+
+- 把会话计数设置为数据库中截至 Redis 当前最新消息ID 的消息数，最新消息ID 缺失时一并补上；
+- 已有已读水位的用户（切换后标记过已读或发过消息）水位随计数同步平移，未读数保持不变；
+- 私聊中还没有水位的用户按旧的 is_read 初始化：未读数 = 发给他且 is_read=0 的消息数，
+  已读到的消息ID 为第一条未读消息之前；并把会话加入双方的私聊会话集合；
+- 群聊没有按人的已读记录，还没有水位的成员把水位设置在切换时：切换前的群聊历史视为已读，
+  切换后的消息（Redis 中原有的计数）仍计为未读。之后加入的成员由 ReadStateManager.on_join 设置水位。
+
+每个会话在一个 Lua 脚本中更新，期间该会话有新消息（最新消息ID 变化）时重新读取后重试；
+可以在服务运行时执行，也可以重复执行，第二次起不会再改变任何计数。
+消息由批量写入器异步落库，建议在写入器队列为空（/api/chat/writer/stats）时执行。
+
+前置条件：.env 中的数据库和 Redis 配置与后端一致。
+
+用法（在 backend 目录下）：
+    python tools/backfill_read_state.py
+    python tools/backfill_read_state.py --dry-run
+"""
+import argparse
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+os.chdir(SRC_DIR)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from flask import Flask
+from sqlalchemy import func, or_
+from config import Config
+from extensions import db, redis_client
+from models.message import Message
+from models.group_member import GroupMember
+from services.history_cache import conversation_key
+from services.read_state import ReadStateManager, CONV_COUNT_KEY, CONV_LAST_ID_KEY
+
+# KEYS: 会话计数, 会话最新ID, 然后每个参与者的 (已读计数, 已读ID)
+# ARGV: 会话, 读取时的最新ID（不存在为空串）, 数据库消息数, 数据库最新ID, 然后每个参与者的 (未读数, 已读ID)
+# 最新ID 已变化返回 -1，否则返回计数的增量
+BACKFILL_SCRIPT = '''
+local conv = ARGV[1]
+local last_id = redis.call('HGET', KEYS[2], conv)
+if (last_id or '') ~= ARGV[2] then
+    return -1
+end
+local old = tonumber(redis.call('HGET', KEYS[1], conv) or '0')
+local total = math.max(old, tonumber(ARGV[3]))
+local delta = total - old
+redis.call('HSET', KEYS[1], conv, total)
+if not last_id then
+    redis.call('HSET', KEYS[2], conv, ARGV[4])
+end
+for i = 3, #KEYS, 2 do
+    local arg = 5 + (i - 3)
+    if redis.call('HEXISTS', KEYS[i], conv) == 1 then
+        if delta > 0 then
+            redis.call('HINCRBY', KEYS[i], conv, delta)
+        end
+    else
+        redis.call('HSET', KEYS[i], conv, math.max(total - tonumber(ARGV[arg]), 0))
+        redis.call('HSET', KEYS[i + 1], conv, ARGV[arg + 1])
+    end
+end
+return delta
+'''
+
+MAX_RETRIES = 5
+
+
+def is_direct():
+    return or_(Message.group_id == 0, Message.group_id.is_(None))
+
+
+def conversations():
+    """返回 {会话: (消息数, 最新ID, 参与者列表)}，群聊的参与者为当前群成员"""
+    result = {}
+    for group_id, count, last_id in db.session.query(
+            Message.group_id, func.count(Message.id), func.max(Message.id)).filter(
+            Message.group_id > 0).group_by(Message.group_id):
+        members = [uid for (uid,) in db.session.query(GroupMember.user_id).filter_by(group_id=group_id)]
+        result[conversation_key(group_id=group_id)] = (count, last_id, members)
+
+    low, high = func.least(Message.sender_id, Message.receiver_id), func.greatest(Message.sender_id, Message.receiver_id)
+    for a, b, count, last_id in db.session.query(
+            low, high, func.count(Message.id), func.max(Message.id)).filter(is_direct()).group_by(low, high):
+        result[conversation_key(sender_id=a, receiver_id=b)] = (count, last_id, [a, b])
+    return result
+
+
+def legacy_unread():
+    """返回 {(会话, 接收者): (is_read=0 的消息数, 第一条未读消息ID)}"""
+    rows = db.session.query(
+        Message.sender_id, Message.receiver_id, func.count(Message.id), func.min(Message.id)).filter(
+        is_direct(), Message.is_read.is_(False)).group_by(Message.sender_id, Message.receiver_id)
+    return {(conversation_key(sender_id=sender, receiver_id=receiver), receiver): (count, first_id)
+            for sender, receiver, count, first_id in rows}
+
+
+def count_until(conv, last_id):
+    """截至 last_id 的消息数（回填期间又有新消息落库时使用）"""
+    query = db.session.query(func.count(Message.id)).filter(Message.id <= last_id)
+    if conv.startswith('group:'):
+        query = query.filter(Message.group_id == int(conv.split(':')[1]))
+    else:
+        a, b = (int(uid) for uid in conv.split(':')[1:])
+        query = query.filter(is_direct(), or_(
+            (Message.sender_id == a) & (Message.receiver_id == b),
+            (Message.sender_id == b) & (Message.receiver_id == a)))
+    return query.scalar()
+
+
+def nth_id(conv, n):
+    """群聊中第 n 条消息的ID，n 为 0 时返回 0"""
+    if n <= 0:
+        return 0
+    return db.session.query(Message.id).filter(
+        Message.group_id == int(conv.split(':')[1])).order_by(Message.id).offset(n - 1).limit(1).scalar()
+
+
+def backfill(conv, count, last_id, participants, unread):
+    """返回计数的增量，多次重试仍有并发的新消息时返回 None"""
+    keys = [CONV_COUNT_KEY, CONV_LAST_ID_KEY]
+    for user_id in participants:
+        keys += [ReadStateManager._read_count_key(user_id), ReadStateManager._read_last_id_key(user_id)]
+
+    for _ in range(MAX_RETRIES):
+        live_last_id = redis_client.hget(CONV_LAST_ID_KEY, conv)
+        expected = live_last_id.decode() if live_last_id else ''
+        db_count, db_last_id = count, last_id
+        if live_last_id and int(live_last_id) < last_id:
+            # 数据库中有 Redis 还没记到的消息（读取 Redis 后新发的），只统计到 Redis 的最新ID
+            db_last_id = int(live_last_id)
+            db_count = count_until(conv, db_last_id)
+
+        args = [conv, expected, db_count, db_last_id]
+        if conv.startswith('group:'):
+            # Redis 中原有的计数都是切换后发的消息，数据库中此前的消息为切换前的历史
+            old = int(redis_client.hget(CONV_COUNT_KEY, conv) or 0)
+            history = max(db_count - old, 0)
+            history_last_id = nth_id(conv, history)
+        for user_id in participants:
+            if conv.startswith('group:'):
+                args += [max(old, db_count) - history, history_last_id]
+            else:
+                pending, first_id = unread.get((conv, user_id), (0, db_last_id + 1))
+                args += [pending, first_id - 1]
+        delta = redis_client.eval(BACKFILL_SCRIPT, len(keys), *keys, *args)
+        if delta >= 0:
+            return delta
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dry-run', action='store_true', help='只统计，不写 Redis')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    redis_client.init_app(app)
+
+    with app.app_context():
+        convs = conversations()
+        unread = legacy_unread()
+        print(f'会话 {len(convs)} 个，其中私聊有旧未读记录的 {len({conv for conv, _ in unread})} 个')
+        if args.dry_run:
+            print('dry-run，未做任何修改')
+            return
+
+        shifted = skipped = 0
+        for conv, (count, last_id, participants) in convs.items():
+            if not conv.startswith('group:'):
+                pipe = redis_client.pipeline(transaction=False)
+                for user_id in participants:
+                    pipe.sadd(ReadStateManager._dm_convs_key(user_id), conv)
+                pipe.execute()
+            delta = backfill(conv, count, last_id, participants, unread)
+            if delta is None:
+                skipped += 1
+                print(f'会话 {conv} 持续有新消息，已跳过，稍后重新执行即可')
+            elif delta:
+                shifted += 1
+
+        print(f'回填完成: 计数有变化的会话 {shifted}，跳过 {skipped}')
+
+
+if __name__ == '__main__':
+    main()
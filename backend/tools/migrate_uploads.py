@@ -0,0 +1,181 @@
+"""把平铺在 uploads/ 下的旧上传文件迁移到按内容哈希分片的目录，并写入 files 表
+
+每个文件计算 sha256 后硬链接到 uploads/objects/<ab>/<cd>/<sha256>（相同内容只保留一份），
+所有者、会话、时间取自引用该文件的消息（messages.file_url），找不到消息时从文件名
+<发送者ID>_<时间戳>_<文件名> 中解析。每批先建链接、再提交 files 记录、最后删除平铺文件，
+中途中断后重新运行即可继续；已迁移的文件会被跳过。
+
+同时把早期一级目录布局 uploads/objects/<ab>/<sha256> 中的对象移到两级目录。
+
+前置条件：已执行 sql/migrations/002_files_table.sql，.env 中的数据库配置与后端一致。
+
+用法（在 backend 目录下）：
+    python tools/migrate_uploads.py --batch 500
+    python tools/migrate_uploads.py --dry-run
+"""
+import argparse
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+from datetime import datetime
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+os.chdir(SRC_DIR)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from flask import Flask
+from config import Config
+from extensions import db
+from models.file import File
+from models.message import Message
+from models.user import User
+from services.file_manager import object_path, SHA256_PATTERN
+from services.history_cache import conversation_key
+
+FILE_ID_PATTERN = re.compile(r'^(\d+)_(\d+)_(.+)$')
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def link_object(path, digest):
+    target = object_path(digest)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(path, target)
+    except FileExistsError:
+        pass
+
+
+def relocate_legacy_objects(dry_run):
+    """uploads/objects/<ab>/<sha256> -> uploads/objects/<ab>/<cd>/<sha256>"""
+    moved = 0
+    root = Config.UPLOAD_OBJECTS_FOLDER
+    if not os.path.isdir(root):
+        return moved
+    for prefix in os.scandir(root):
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            if not entry.is_file() or not SHA256_PATTERN.match(entry.name):
+                continue
+            if not dry_run:
+                link_object(entry.path, entry.name)
+                os.remove(entry.path)
+            moved += 1
+    return moved
+
+
+def legacy_files():
+    for entry in os.scandir(Config.UPLOAD_FOLDER):
+        if entry.is_file() and not entry.name.startswith('.'):
+            yield entry
+
+
+def migrate_batch(entries, dry_run):
+    file_ids = [entry.name for entry in entries]
+    existing = {file_id for (file_id,) in db.session.query(File.file_id).filter(File.file_id.in_(file_ids))}
+
+    urls = {f'/uploads/{file_id}': file_id for file_id in file_ids}
+    messages = {}
+    for message in Message.query.filter(Message.file_url.in_(list(urls))).order_by(Message.id):
+        messages.setdefault(urls[message.file_url], message)
+
+    parsed = {file_id: FILE_ID_PATTERN.match(file_id) for file_id in file_ids}
+    candidate_owners = {int(m.group(1)) for m in parsed.values() if m}
+    known_users = {uid for (uid,) in db.session.query(User.id).filter(User.id.in_(candidate_owners))} \
+        if candidate_owners else set()
+
+    rows, done = [], []
+    for entry in entries:
+        file_id = entry.name
+        if file_id in existing:
+            # 记录已提交但上次中断前没来得及删除平铺文件
+            done.append(entry.path)
+            continue
+
+        digest = sha256_of(entry.path)
+        stat = entry.stat()
+        match = parsed[file_id]
+        message = messages.get(file_id)
+        if message:
+            owner_id = message.sender_id
+            conversation = conversation_key(message.group_id, message.sender_id, message.receiver_id)
+            created_at = message.created_at
+        else:
+            owner_id = int(match.group(1)) if match and int(match.group(1)) in known_users else None
+            conversation = None
+            created_at = datetime.fromtimestamp(stat.st_mtime)
+        name = match.group(3) if match else file_id
+
+        rows.append({
+            'file_id': file_id,
+            'name': name,
+            'sha256': digest,
+            'size': stat.st_size,
+            'mime_type': mimetypes.guess_type(name)[0],
+            'owner_id': owner_id,
+            'conversation': conversation,
+            'created_at': created_at
+        })
+        if not dry_run:
+            link_object(entry.path, digest)
+        done.append(entry.path)
+
+    if dry_run:
+        return len(rows), 0
+
+    if rows:
+        db.session.execute(File.__table__.insert(), rows)
+        db.session.commit()
+    for path in done:
+        os.remove(path)
+    return len(rows), len(done) - len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, default=500, help='每批写入的文件记录数')
+    parser.add_argument('--dry-run', action='store_true', help='只统计，不移动文件也不写数据库')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+
+    with app.app_context():
+        relocated = relocate_legacy_objects(args.dry_run)
+        print(f'一级目录对象迁移: {relocated}')
+
+        migrated = resumed = 0
+        batch = []
+        for entry in legacy_files():
+            batch.append(entry)
+            if len(batch) >= args.batch:
+                added, cleaned = migrate_batch(batch, args.dry_run)
+                migrated, resumed = migrated + added, resumed + cleaned
+                print(f'已迁移 {migrated} 个文件')
+                batch = []
+        if batch:
+            added, cleaned = migrate_batch(batch, args.dry_run)
+            migrated, resumed = migrated + added, resumed + cleaned
+
+        print(f'迁移完成: 新增记录 {migrated}，清理已迁移的平铺文件 {resumed}'
+              + ('（dry-run，未做任何修改）' if args.dry_run else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,7 @@ const Chat: React.FC<ChatProps> = ({ channelId, groupId, friendId, avatar }) =>
     const [showWhiteboard, setShowWhiteboard] = useState(false);
     const { socket } = useSocketContext();
     const { chatRoomId, whiteBoardRoomId } = useRoomId(channelId, groupId, friendId);
-    const { messages, sendMessage } = useChat(socket, chatRoomId, channelId, groupId, friendId);
+    const { messages, sendMessage, loadOlder } = useChat(socket, chatRoomId, channelId, groupId, friendId);
     const [showAiSuggestion, setShowAiSuggestion] = useState(false);
     const [selectedModel, setSelectedModel] = useState('doubao');
 
@@ -55,6 +55,7 @@ const Chat: React.FC<ChatProps> = ({ channelId, groupId, friendId, avatar }) =>
                 <MessageList
                     messages={messages}
                     onAvatarClick={handleAvatarClick}
+                    onReachTop={loadOlder}
                 />
             </Box>
 
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { 
   List, 
   ListItem, 
@@ -13,7 +13,7 @@ import {
 import { useNavigate } from 'react-router-dom';
 import { styled } from '@mui/material/styles';
 import { useSocketContext } from '../contexts/SocketContextProvider';
-import {ChatItem, FriendRequestAcceptedData} from '../types';
+import {ChatItem, FriendRequestAcceptedData, PresenceDelta} from '../types';
 import {OnlineBadge} from '../styles';
 import { motion } from 'framer-motion';
 
@@ -22,6 +22,7 @@ const ListItemMotion = motion.create(ListItemButton);
 const ChatList: React.FC = () => {
   const [chatItems, setChatItems] = useState<ChatItem[]>([]);
   const [onlineUsers, setOnlineUsers] = useState<number[]>([]);
+  const presenceVersion = useRef<number | null>(null);
   const navigate = useNavigate();
   const { socket } = useSocketContext();
 
@@ -73,18 +74,45 @@ const ChatList: React.FC = () => {
         }
       };
 
+      // 版本号未知或不连续时请求完整快照
+      const syncPresence = () => {
+        socket.emit('presence_sync', { version: presenceVersion.current });
+      };
+
       // 监听连接成功事件
       socket.on('connect', () => {
         requestOnlineStatus();
+        syncPresence();
       });
 
-      // 监听在线用户列表更新
-      socket.on('online_users', (data: { users: number[] }) => {
+      // 监听在线用户列表更新（完整快照）
+      socket.on('online_users', (data: { users: number[], version?: number }) => {
         setOnlineUsers(data.users);
+        if (data.version !== undefined) {
+          presenceVersion.current = data.version;
+        }
         // 重新请求在线状态以确保数据准确性
         requestOnlineStatus();
       });
 
+      // 监听在线状态增量
+      socket.on('presence_delta', (delta: PresenceDelta) => {
+        const current = presenceVersion.current;
+        if (current !== null && delta.version <= current) {
+          return;
+        }
+        if (current === null || delta.version !== current + 1) {
+          syncPresence();
+        }
+        presenceVersion.current = delta.version;
+        setOnlineUsers(prev => {
+          const next = new Set(prev);
+          delta.online.forEach(id => next.add(id));
+          delta.offline.forEach(id => next.delete(id));
+          return Array.from(next);
+        });
+      });
+
       // 监听在线状态更新
       socket.on('online_status_update', (statusMap: {[key: number]: boolean}) => {
         setOnlineUsers(prev => {
@@ -95,33 +123,20 @@ const ChatList: React.FC = () => {
         });
       });
 
-      // 监听单个用户上线
-      socket.on('user_online', (data: { user_id: number }) => {
-        setOnlineUsers(prev => {
-          if (!prev.includes(data.user_id)) {
-            return [...prev, data.user_id];
-          }
-          return prev;
-        });
-      });
-
-      // 监听单个用户离线
-      socket.on('user_offline', (data: { user_id: number }) => {
-        setOnlineUsers(prev => prev.filter(id => id !== data.user_id));
-      });
-
       // 初始化时请求一次在线状态
       if (chatItems.length > 0) {
         requestOnlineStatus();
       }
+      if (presenceVersion.current === null) {
+        syncPresence();
+      }
 
       return () => {
         if (socket) {
           socket.off('connect');
           socket.off('online_users');
           socket.off('online_status_update');
-          socket.off('user_online');
-          socket.off('user_offline');
+          socket.off('presence_delta');
         }
       };
     }
@@ -129,26 +144,6 @@ const ChatList: React.FC = () => {
 
   useEffect(() => {
     if (socket) {
-      // 监听在线用户列表更新
-      socket.on('online_users', (data: { users: number[] }) => {
-        setOnlineUsers(data.users);
-      });
-
-      // 监听单个用户上线
-      socket.on('user_online', (data: { user_id: number }) => {
-        setOnlineUsers(prev => {
-          if (!prev.includes(data.user_id)) {
-            return [...prev, data.user_id];
-          }
-          return prev;
-        });
-      });
-
-      // 监听单个用户离线
-      socket.on('user_offline', (data: { user_id: number }) => {
-        setOnlineUsers(prev => prev.filter(id => id !== data.user_id));
-      });
-
       socket.on('friend_request_accepted', (data: FriendRequestAcceptedData) => {
         const currentUserId = parseInt(localStorage.getItem('userId') || '0');
         const newFriend = data.sender.id === currentUserId ? data.receiver : data.sender;
@@ -188,9 +183,6 @@ const ChatList: React.FC = () => {
 
     return () => {
       if (socket) {
-        socket.off('online_users');
-        socket.off('user_online');
-        socket.off('user_offline');
         socket.off('friend_request_accepted');
       }
     };
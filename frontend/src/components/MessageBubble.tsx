@@ -78,13 +78,16 @@ const MessageBubble: React.FC<MessageBubbleProps> = ({ message, isown, avatar, o
     if (!message.file_url) return;
 
     try {
-      const response = await fetch(`${global.preUrl}/api/file${message.file_url}`, {
-        headers: {
-          'Authorization': `Bearer ${localStorage.getItem('token')}`
-        }
-      });
-
       const fileType = getFileType(message.content);
+      const headers = { 'Authorization': `Bearer ${localStorage.getItem('token')}` };
+      const fileUrl = `${global.preUrl}/api/file${message.file_url}`;
+      // 图片取预览图、音视频取低码率版本；后台尚未生成时回退到原文件
+      const variant = ({ image: 'preview', video: 'low', music: 'low' } as Record<string, string>)[fileType];
+      let response = variant ? await fetch(`${fileUrl}?variant=${variant}`, { headers }) : null;
+      if (!response || !response.ok) {
+        response = await fetch(fileUrl, { headers });
+      }
+
       if (fileType === 'text') {
         const text = await response.text();
         setPreviewContent(text);
@@ -16,8 +16,31 @@ const Whiteboard: React.FC<WhiteboardProps> = ({ roomId, onClose }) => {
   const [context, setContext] = useState<CanvasRenderingContext2D | null>(null);
   const { socket } = useSocketContext();
 
+  const lastPointRef = useRef<{ x: number; y: number } | null>(null);
+  const latestBatchRef = useRef(0);
+  const ackedBatchRef = useRef(0);
+  // 已同步到的白板操作序号，断线重连后只请求之后的笔画
+  const lastSeqRef = useRef<number | null>(null);
+  // 栅格快照解码期间收到的绘制批次，图像画好后再补画
+  const imageLoadingRef = useRef(false);
+  const bufferedStrokesRef = useRef<{ c: string; w: number; p: number[] }[]>([]);
+
   const whiteboardRoomId = `whiteboard_${roomId}`;
 
+  // 每段独立开始路径，远端绘制不会打断本地正在画的线
+  const drawStrokes = (ctx: CanvasRenderingContext2D, strokes: { c: string; w: number; p: number[] }[]) => {
+    strokes.forEach(stroke => {
+      ctx.strokeStyle = stroke.c;
+      ctx.lineWidth = stroke.w;
+      ctx.beginPath();
+      ctx.moveTo(stroke.p[0], stroke.p[1]);
+      for (let i = 2; i < stroke.p.length; i += 2) {
+        ctx.lineTo(stroke.p[i], stroke.p[i + 1]);
+      }
+      ctx.stroke();
+    });
+  };
+
   useEffect(() => {
     const canvas = canvasRef.current;
     if (!canvas) return;
@@ -32,61 +55,109 @@ const Whiteboard: React.FC<WhiteboardProps> = ({ roomId, onClose }) => {
 
     // console.log('Joining whiteboard room:', whiteboardRoomId); 
 
-    socket?.emit('join_whiteboard', { 
-      room: whiteboardRoomId,
-      token: localStorage.getItem('token'),
-    });
+    const joinWhiteboard = () => {
+      socket?.emit('join_whiteboard', { 
+        room: whiteboardRoomId,
+        token: localStorage.getItem('token'),
+        since: lastSeqRef.current ?? undefined,
+      });
+    };
 
-    socket?.emit('request_whiteboard_state', { 
-      room: whiteboardRoomId 
-    });
+    joinWhiteboard();
+    // 断线重连后重新加入房间，带上已同步的序号做增量同步
+    socket?.on('connect', joinWhiteboard);
 
-    // 监听绘制事件
-    socket?.on('draw', (data: { x: number; y: number; drawing: boolean; color: string; lineWidth: number; room: string }) => {
-        // console.log(data.room, whiteboardRoomId)
-      
-        if (!context || data.room !== whiteboardRoomId) return;
-      
-      context.strokeStyle = data.color;
-      context.lineWidth = data.lineWidth;
-      
-      if (data.drawing) {
-        context.lineTo(data.x, data.y);
-        context.stroke();
+    // 监听绘制批次：服务端按节拍合并各人的绘制点，每段为 { c: 颜色, w: 线宽, p: [x0, y0, x1, y1, ...] }
+    socket?.on('draw_batch', (data: { room: string; t: number; seq?: number; strokes: { c: string; w: number; p: number[] }[] }) => {
+      if (!context || data.room !== whiteboardRoomId) return;
+
+      if (imageLoadingRef.current) {
+        bufferedStrokesRef.current.push(...data.strokes);
       } else {
-        context.beginPath();
-        context.moveTo(data.x, data.y);
+        drawStrokes(context, data.strokes);
+      }
+      latestBatchRef.current = data.t;
+      if (data.seq && lastSeqRef.current !== null) {
+        lastSeqRef.current = Math.max(lastSeqRef.current, data.seq);
       }
     });
 
+    // 绘制落后太多时服务端暂停推送，积压处理完后收到该事件，请求完整状态恢复
+    socket?.on('whiteboard_paused', (data: { room: string }) => {
+      if (data.room !== whiteboardRoomId) return;
+      socket?.emit('request_whiteboard_state', {
+        room: whiteboardRoomId,
+        resume: true,
+        since: lastSeqRef.current ?? undefined,
+      });
+    });
+
     // 监听清空白板事件
-    socket?.on('clear_whiteboard', (data: { room: string }) => {
+    socket?.on('clear_whiteboard', (data: { room: string; seq: number }) => {
       if (!context || !canvas || data.room !== whiteboardRoomId) return;
       context.clearRect(0, 0, canvas.width, canvas.height);
+      lastSeqRef.current = data.seq;
     });
 
-    // 监听白板状态
-    socket?.on('whiteboard_state', (data: { state: any[], room: string }) => {
+    // 监听白板状态：每个笔画为 { c: 颜色, w: 线宽, p: [x0, y0, x1, y1, ...] }；
+    // incremental 为 true 时只包含 since 之后的笔画，直接叠加绘制；
+    // 带 image 时先画服务端生成的栅格快照（PNG），再画快照之后的笔画；
+    // 不接收图片时最早的 truncated 个笔画只保存在服务端快照底图中，画面缺少这部分
+    socket?.on('whiteboard_state', (data: { strokes: { c: string; w: number; p: number[] }[], seq: number, incremental: boolean, image?: ArrayBuffer, truncated?: number, room: string }) => {
       if (!context || data.room !== whiteboardRoomId) return;
       
+      if (data.incremental) {
+        drawStrokes(context, data.strokes);
+        lastSeqRef.current = data.seq;
+        return;
+      }
+
+      if (data.image) {
+        imageLoadingRef.current = true;
+        bufferedStrokesRef.current = [];
+        createImageBitmap(new Blob([data.image], { type: 'image/png' }))
+          .then(bitmap => {
+            context.clearRect(0, 0, canvas.width, canvas.height);
+            context.drawImage(bitmap, 0, 0);
+            bitmap.close();
+            drawStrokes(context, data.strokes);
+            lastSeqRef.current = data.seq;
+          })
+          .catch(error => {
+            console.error('白板快照解码失败:', error);
+            // 退回请求完整的笔画状态
+            lastSeqRef.current = null;
+            socket?.emit('request_whiteboard_state', { room: whiteboardRoomId, raster: false });
+          })
+          .finally(() => {
+            drawStrokes(context, bufferedStrokesRef.current);
+            bufferedStrokesRef.current = [];
+            imageLoadingRef.current = false;
+          });
+        return;
+      }
+
       context.clearRect(0, 0, canvas.width, canvas.height);
-      
-      data.state.forEach(item => {
-        context.strokeStyle = item.color;
-        context.lineWidth = item.lineWidth;
-        
-        if (item.drawing) {
-          context.lineTo(item.x, item.y);
-          context.stroke();
-        } else {
-          context.beginPath();
-          context.moveTo(item.x, item.y);
-        }
-      });
+      drawStrokes(context, data.strokes);
+      lastSeqRef.current = data.seq;
+      if (data.truncated) {
+        console.warn(`白板较早的 ${data.truncated} 个笔画只保存在栅格快照中，当前画面不完整`);
+      }
     });
 
+    // 定期回报已绘制的最新批次，服务端据此判断是否需要暂停推送
+    const ackTimer = setInterval(() => {
+      if (latestBatchRef.current && latestBatchRef.current !== ackedBatchRef.current) {
+        ackedBatchRef.current = latestBatchRef.current;
+        socket?.emit('draw_ack', { room: whiteboardRoomId, t: latestBatchRef.current });
+      }
+    }, 500);
+
     return () => {
-      socket?.off('draw');
+      clearInterval(ackTimer);
+      socket?.off('connect', joinWhiteboard);
+      socket?.off('draw_batch');
+      socket?.off('whiteboard_paused');
       socket?.off('clear_whiteboard');
       socket?.off('whiteboard_state');
     };
@@ -101,8 +172,11 @@ const Whiteboard: React.FC<WhiteboardProps> = ({ roomId, onClose }) => {
     const x = e.clientX - rect.left;
     const y = e.clientY - rect.top;
 
-    context.lineTo(x, y);
-    context.stroke();
+    const last = lastPointRef.current;
+    if (last) {
+      drawStrokes(context, [{ c: '#000000', w: 2, p: [last.x, last.y, x, y] }]);
+    }
+    lastPointRef.current = { x, y };
 
     // 发送绘制数据
     socket?.emit('draw', {
@@ -121,8 +195,7 @@ const Whiteboard: React.FC<WhiteboardProps> = ({ roomId, onClose }) => {
     const x = e.clientX - rect.left;
     const y = e.clientY - rect.top;
 
-    context.beginPath();
-    context.moveTo(x, y);
+    lastPointRef.current = { x, y };
 
     socket?.emit('draw', {
       x,
@@ -133,10 +206,12 @@ const Whiteboard: React.FC<WhiteboardProps> = ({ roomId, onClose }) => {
   };
 
   const stopDrawing = () => {
-    setIsDrawing(false);
-    if (context) {
-      context.beginPath();
+    if (isDrawing) {
+      // 通知服务端这一笔已结束，服务端据此简化并保存笔画
+      socket?.emit('stroke_end', { room: whiteboardRoomId });
     }
+    setIsDrawing(false);
+    lastPointRef.current = null;
   };
 
   const clearCanvas = () => {
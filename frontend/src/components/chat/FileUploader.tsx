@@ -27,33 +27,54 @@ const FileUploader: React.FC<FileUploaderProps> = ({
     const [isUploading, setIsUploading] = useState(false);
     const receivedChunksRef = useRef(0);
     const totalChunksRef = useRef(0);
+    const currentFileIdRef = useRef<string | null>(null);
+    const pendingAcksRef = useRef(new Map<string, (progress?: number | null) => void>());
 
     const CHUNK_SIZE = 200 * 1024;
-    const MAX_CONCURRENT_UPLOADS = 5;
+    // 服务端未下发窗口大小时的默认在途分片数
+    const DEFAULT_CHUNK_WINDOW = 5;
     const TIMEOUT_DURATION = 5000;
     const MAX_RETRIES = 3;
+    const MAX_RESUMES = 5;
+    // 不超过该大小的文件先计算 SHA-256，服务端已有相同内容时无需上传（crypto.subtle 需要一次读入整个文件）
+    const HASH_PRECHECK_MAX_SIZE = 64 * 1024 * 1024;
+
+    // 按 fileId:chunkIndex 匹配分片确认，乱序到达的确认不会错配到其他分片
+    const chunkAck = (fileId: string, chunkIndex: number) => `${fileId}:${chunkIndex}`;
 
     useEffect(() => {
         if (!socket) return;
 
-        const handleUploadProgress = (data: { fileId: string, progress: number, room: string }) => {
-            if (data.room === messageData.room) {
+        // 服务端只向上传者推送自己文件的进度（已节流）
+        const handleUploadProgress = (data: { fileId: string, progress: number }) => {
+            if (data.fileId === currentFileIdRef.current) {
                 onUploadProgress(true, data.progress);
             }
         };
 
+        const handleChunkReceived = (data: { fileId: string, index: number, progress?: number | null }) => {
+            const key = chunkAck(data.fileId, data.index);
+            const ack = pendingAcksRef.current.get(key);
+            if (ack) {
+                pendingAcksRef.current.delete(key);
+                ack(data.progress);
+            }
+        };
+
         socket.on('upload_progress', handleUploadProgress);
+        socket.on('chunk_received', handleChunkReceived);
         return () => {
             socket.off('upload_progress', handleUploadProgress);
+            socket.off('chunk_received', handleChunkReceived);
         };
-    }, [socket, onUploadProgress, messageData.room]);
+    }, [socket, onUploadProgress]);
 
     const updateUploadProgress = useCallback((received: number, total: number) => {
         const progress = (received / total) * 100;
         onUploadProgress(true, progress);
     }, [onUploadProgress]);
 
-    const uploadChunk = async (
+    const uploadChunk = (
         fileId: string,
         chunkIndex: number,
         chunk: ArrayBuffer,
@@ -61,61 +82,131 @@ const FileUploader: React.FC<FileUploaderProps> = ({
         retryCount = 0
     ): Promise<void> => {
         return new Promise((resolve, reject) => {
-            const chunkHandler = () => {
+            const key = chunkAck(fileId, chunkIndex);
+            const timeoutId = setTimeout(() => {
+                pendingAcksRef.current.delete(key);
+                if (retryCount < MAX_RETRIES) {
+                    uploadChunk(fileId, chunkIndex, chunk, totalChunks, retryCount + 1).then(resolve, reject);
+                } else {
+                    reject(new Error(`分片 ${chunkIndex} 上传超时，已重试 ${MAX_RETRIES} 次`));
+                }
+            }, TIMEOUT_DURATION);
+
+            pendingAcksRef.current.set(key, (progress) => {
+                clearTimeout(timeoutId);
                 receivedChunksRef.current += 1;
-                updateUploadProgress(receivedChunksRef.current, totalChunksRef.current);
+                // 分片确认携带服务端的接收进度
+                if (progress != null) {
+                    onUploadProgress(true, progress);
+                } else {
+                    updateUploadProgress(receivedChunksRef.current, totalChunksRef.current);
+                }
                 resolve();
-            };
+            });
 
-            socket?.once('chunk_received', chunkHandler);
             socket?.emit('file_chunk', {
                 fileId,
                 chunkIndex,
                 totalChunks,
-                data: Array.from(new Uint8Array(chunk))
+                data: chunk
             });
+        });
+    };
 
-            const timeoutId = setTimeout(async () => {
-                socket?.off('chunk_received', chunkHandler);
-                if (retryCount < MAX_RETRIES) {
-                    try {
-                        await uploadChunk(fileId, chunkIndex, chunk, totalChunks, retryCount + 1);
-                        resolve();
-                    } catch (error) {
-                        reject(error);
-                    }
-                } else {
-                    reject(new Error(`分片 ${chunkIndex} 上传超时，已重试 ${MAX_RETRIES} 次`));
+    const readChunk = (file: File, chunkIndex: number): Promise<ArrayBuffer> => {
+        const start = chunkIndex * CHUNK_SIZE;
+        const end = Math.min(start + CHUNK_SIZE, file.size);
+        return file.slice(start, end).arrayBuffer();
+    };
+
+    // 滑动窗口：始终保持 windowSize 个分片在途，任一分片确认后立即发送下一个；
+    // 分片按需读取，不把整个文件读入内存
+    const uploadChunksConcurrently = async (
+        file: File,
+        fileId: string,
+        indices: number[],
+        totalChunks: number,
+        windowSize: number
+    ) => {
+        let next = 0;
+        let failed = false;
+        const sender = async () => {
+            while (!failed && next < indices.length) {
+                const chunkIndex = indices[next++];
+                try {
+                    const chunk = await readChunk(file, chunkIndex);
+                    await uploadChunk(fileId, chunkIndex, chunk, totalChunks);
+                } catch (error) {
+                    failed = true;
+                    throw error;
                 }
-            }, TIMEOUT_DURATION);
+            }
+        };
+        await Promise.all(Array.from({ length: Math.min(windowSize, indices.length) }, sender));
+    };
 
-            socket?.once('chunk_received', () => {
-                clearTimeout(timeoutId);
-                socket?.off('chunk_received', chunkHandler);
+    const waitForConnection = (): Promise<void> => {
+        return new Promise((resolve) => {
+            if (socket?.connected) {
                 resolve();
-            });
+            } else {
+                socket?.once('connect', () => resolve());
+            }
         });
     };
 
-    const uploadChunksConcurrently = async (chunks: ArrayBuffer[], fileId: string, totalChunks: number) => {
-        try {
-            for (let i = 0; i < chunks.length; i += MAX_CONCURRENT_UPLOADS) {
-                const uploadPromises = [];
-                for (let j = 0; j < MAX_CONCURRENT_UPLOADS && i + j < chunks.length; j++) {
-                    const chunkIndex = i + j;
-                    uploadPromises.push(uploadChunk(fileId, chunkIndex, chunks[chunkIndex], totalChunks));
-                }
-                await Promise.all(uploadPromises);
+    // 查询服务端缺失的分片；上传会话已不存在时返回 null
+    const queryMissingChunks = (fileId: string): Promise<number[] | null> => {
+        return new Promise((resolve, reject) => {
+            const statusHandler = (data: { fileId: string, exists: boolean, missing: number[] }) => {
+                if (data.fileId !== fileId) return;
+                clearTimeout(timeoutId);
+                socket?.off('file_transfer_status', statusHandler);
+                resolve(data.exists ? data.missing : null);
+            };
+
+            socket?.on('file_transfer_status', statusHandler);
+            socket?.emit('file_transfer_status', { fileId });
+
+            const timeoutId = setTimeout(() => {
+                socket?.off('file_transfer_status', statusHandler);
+                reject(new Error('查询上传状态超时'));
+            }, TIMEOUT_DURATION);
+        });
+    };
+
+    // 上传失败（超时、断线重连）后向服务端查询缺失的分片，只补传这些分片
+    const uploadWithResume = async (file: File, fileId: string, totalChunks: number, windowSize: number) => {
+        let indices = Array.from({ length: totalChunks }, (_, i) => i);
+        for (let attempt = 0; ; attempt++) {
+            try {
+                await uploadChunksConcurrently(file, fileId, indices, totalChunks, windowSize);
+                break;
+            } catch (error) {
+                if (attempt >= MAX_RESUMES) throw error;
+                console.warn('分片上传中断，尝试续传:', error);
+                await waitForConnection();
+                const missing = await queryMissingChunks(fileId);
+                if (missing === null) throw error;
+                if (missing.length === 0) break;
+                indices = missing;
+                receivedChunksRef.current = totalChunks - missing.length;
+                updateUploadProgress(receivedChunksRef.current, totalChunks);
             }
-            // 所有分片上传完成后再关闭进度条
-            setTimeout(() => {
-                setIsUploading(false);
-                onUploadProgress(false, 0);
-            }, 500);
-        } catch (error) {
-            console.error('分片上传失败:', error);
-            throw error;
         }
+        // 所有分片上传完成后再关闭进度条
+        setTimeout(() => {
+            setIsUploading(false);
+            onUploadProgress(false, 0);
+        }, 500);
+    };
+
+    const computeSha256 = async (file: File): Promise<string | undefined> => {
+        if (file.size > HASH_PRECHECK_MAX_SIZE || !window.crypto?.subtle) return undefined;
+        const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        return Array.from(new Uint8Array(digest))
+            .map((b) => b.toString(16).padStart(2, '0'))
+            .join('');
     };
 
     const handleFileUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
@@ -143,17 +234,16 @@ const FileUploader: React.FC<FileUploaderProps> = ({
 
         try {
             totalChunksRef.current = Math.ceil(file.size / CHUNK_SIZE);
-            const chunks: ArrayBuffer[] = [];
 
-            for (let i = 0; i < totalChunksRef.current; i++) {
-                const start = i * CHUNK_SIZE;
-                const end = Math.min(start + CHUNK_SIZE, file.size);
-                chunks.push(await file.slice(start, end).arrayBuffer());
-            }
+            const sha256 = await computeSha256(file);
 
-            const fileId = await new Promise<string>((resolve, reject) => {
+            const { file_id: fileId, complete, window: chunkWindow } = await new Promise<{
+                file_id: string,
+                complete?: boolean,
+                window?: number
+            }>((resolve, reject) => {
                 const initHandler = (response: any) => {
-                    resolve(response.file_id);
+                    resolve(response);
                 };
 
                 socket?.once('file_transfer_init', initHandler);
@@ -161,7 +251,9 @@ const FileUploader: React.FC<FileUploaderProps> = ({
                     fileName,
                     fileSize: file.size,
                     totalChunks: totalChunksRef.current,
+                    chunkSize: CHUNK_SIZE,
                     fileType: file.type,
+                    sha256,
                     message: fileMessageData,
                     room: messageData.room
                 });
@@ -172,7 +264,14 @@ const FileUploader: React.FC<FileUploaderProps> = ({
                 }, 5000);
             });
 
-            await uploadChunksConcurrently(chunks, fileId, totalChunksRef.current);
+            currentFileIdRef.current = fileId;
+            if (complete) {
+                // 服务端已有相同内容，直接完成
+                setIsUploading(false);
+                onUploadProgress(false, 0);
+            } else {
+                await uploadWithResume(file, fileId, totalChunksRef.current, chunkWindow || DEFAULT_CHUNK_WINDOW);
+            }
             message.success('文件上传成功,请稍等');
         } catch (error) {
             console.error('文件上传失败:', error);
@@ -1,4 +1,4 @@
-import React, { useRef, useEffect } from 'react';
+import React, { useRef, useEffect, useState } from 'react';
 import { Box } from '@mui/material';
 import { Message } from '../../types';
 import MessageBubble from '../MessageBubble';
@@ -7,11 +7,57 @@ import { MessagesContainer } from '../../styles';
 interface MessageListProps {
     messages: Message[];
     onAvatarClick: (userId: number) => void;
+    onReachTop?: () => void;
 }
 
-const MessageList: React.FC<MessageListProps> = ({ messages, onAvatarClick }) => {
+// 用户 ID -> 头像内容版本（null 表示没有上传过头像），各聊天窗口共用
+const avatarVersions: Record<number, string | null> = {};
+
+const fetchAvatarVersions = async (userIds: number[]) => {
+    const response = await fetch(`${global.preUrl}/api/file/avatar/versions`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${localStorage.getItem('token')}`
+        },
+        body: JSON.stringify({ user_ids: userIds })
+    });
+    if (!response.ok) {
+        throw new Error('获取头像版本失败');
+    }
+    const versions: Record<string, string | null> = await response.json();
+    userIds.forEach(id => {
+        avatarVersions[id] = versions[id] ?? null;
+    });
+};
+
+const avatarUrl = (userId: number) => {
+    const version = avatarVersions[userId];
+    // 带上 ?v= 后服务端返回可永久缓存的缩略图，头像更换后版本随之变化
+    return `${global.preUrl}/api/file/avatar/avatar_${userId}.jpg?size=64${version ? `&v=${version}` : ''}`;
+};
+
+const MessageList: React.FC<MessageListProps> = ({ messages, onAvatarClick, onReachTop }) => {
     const messagesEndRef = useRef<HTMLDivElement>(null);
     const containerRef = useRef<HTMLDivElement>(null);
+    const [, setVersionsLoaded] = useState(0);
+
+    useEffect(() => {
+        const missing = Array.from(new Set(messages.map(message => message.sender_id)))
+            .filter(id => !(id in avatarVersions));
+        if (missing.length === 0) {
+            return;
+        }
+        fetchAvatarVersions(missing)
+            .catch(error => {
+                console.error(error);
+                // 获取失败时不带版本，按协商缓存加载
+                missing.forEach(id => {
+                    avatarVersions[id] = null;
+                });
+            })
+            .finally(() => setVersionsLoaded(count => count + 1));
+    }, [messages]);
 
     // console.log(messages);
 
@@ -32,6 +78,11 @@ const MessageList: React.FC<MessageListProps> = ({ messages, onAvatarClick }) =>
     return (
         <MessagesContainer
             ref={containerRef}
+            onScroll={() => {
+                if (onReachTop && containerRef.current && containerRef.current.scrollTop === 0) {
+                    onReachTop();
+                }
+            }}
             style={{ transition: 'opacity 0.5s ease-in-out', opacity: 1 }}
         >
             <Box sx={{ flexGrow: 1, minHeight: 'min-content' }}>
@@ -40,7 +91,7 @@ const MessageList: React.FC<MessageListProps> = ({ messages, onAvatarClick }) =>
                         key={`${message.id}_${index}`}
                         message={message}
                         isown={message.sender_id.toString() === localStorage.getItem('userId')}
-                        avatar={`${global.preUrl}/api/file/avatar/avatar_${message.sender_id}.jpg`}
+                        avatar={message.sender_id in avatarVersions ? avatarUrl(message.sender_id) : undefined}
                         onAvatarClick={() => onAvatarClick(message.sender_id)}
                     />
                 ))}
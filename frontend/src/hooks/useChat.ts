@@ -1,31 +1,56 @@
-import { useState, useEffect } from 'react';
-import { Message } from '../types';
+import { useState, useEffect, useCallback } from 'react';
+import { Message, HistoryPage } from '../types';
 import { Socket } from 'socket.io-client';
 
 export const useChat = (socket: Socket | null, roomId: string | string[], channelId?: string, groupId?: string, friendId?: string) => {
     const [messages, setMessages] = useState<Message[]>([]);
     const [avator, setAvator] = useState<string[]>(['']);
+    const [prevCursor, setPrevCursor] = useState<string | null>(null);
+    const [hasMoreBefore, setHasMoreBefore] = useState(false);
+    const [loadingOlder, setLoadingOlder] = useState(false);
+
+    const fetchHistory = useCallback(async (cursor?: string | null): Promise<HistoryPage> => {
+        const response = await fetch(`${global.preUrl}/api/chat/history`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Bearer ${localStorage.getItem('token')}`
+            },
+            body: JSON.stringify({ channelId, groupId, friendId, cursor, direction: 'before' })
+        });
+        return response.json();
+    }, [channelId, groupId, friendId]);
 
     useEffect(() => {
         const loadHistory = async () => {
             try {
-                const response = await fetch(`${global.preUrl}/api/chat/history`, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                        'Authorization': `Bearer ${localStorage.getItem('token')}`
-                    },
-                    body: JSON.stringify({ channelId, groupId, friendId })
-                });
-                const data = await response.json();
-                setMessages(data);
+                const page = await fetchHistory();
+                setMessages(page.messages);
+                setPrevCursor(page.prev_cursor);
+                setHasMoreBefore(page.has_more_before);
             } catch (error) {
                 console.error('获取历史消息失败:', error);
             }
         };
 
         loadHistory();
-    }, [channelId, groupId, friendId]);
+    }, [fetchHistory]);
+
+    // 向上翻页加载更早的消息
+    const loadOlder = async () => {
+        if (!hasMoreBefore || !prevCursor || loadingOlder) return;
+        setLoadingOlder(true);
+        try {
+            const page = await fetchHistory(prevCursor);
+            setMessages(prev => [...page.messages, ...prev]);
+            setPrevCursor(page.prev_cursor);
+            setHasMoreBefore(page.has_more_before);
+        } catch (error) {
+            console.error('获取更早的消息失败:', error);
+        } finally {
+            setLoadingOlder(false);
+        }
+    };
 
     useEffect(() => {
         if (!socket || !roomId) return;
@@ -70,5 +95,5 @@ export const useChat = (socket: Socket | null, roomId: string | string[], channe
         socket?.emit('chat', { message: messageData, room: roomId });
     };
 
-    return { messages, sendMessage, avator};
+    return { messages, sendMessage, avator, loadOlder, hasMoreBefore };
 };
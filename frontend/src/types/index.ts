@@ -11,6 +11,20 @@ export interface Message {
     file_url?: string;
 }
 
+export interface PresenceDelta {
+    version: number;
+    online: number[];
+    offline: number[];
+}
+
+export interface HistoryPage {
+    messages: Message[];
+    prev_cursor: string | null;
+    next_cursor: string | null;
+    has_more_before: boolean;
+    has_more_after: boolean;
+}
+
 export interface MessageBubbleProps {
     message: Message;
     isown: boolean;